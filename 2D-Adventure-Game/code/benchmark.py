@@ -0,0 +1,308 @@
+import argparse
+import gc
+import json
+import math
+import os
+import sys
+import random
+import time
+import tracemalloc
+from headless import HeadlessRunner, INPUTS, format_report
+import pygame
+from time import perf_counter
+from config import MAP_FILE, TILE_SIZE, VIEW_SIZE, FIXED_DT, REGION_BUDGET
+from gameEntities import animations
+from rendering.bundle import AssetBundle, build_bundle, animation_specs, layer_specs, CHUNK_TILES
+from rendering.streaming import RegionStreamer, load_layout, world_size
+from rendering.tilemap import ChunkedMapRenderer
+from rendering.ui import get_ui
+from mechanics.persistence import EntityStore
+from world import World, PLAYER_SPAWN
+from gameEntities.enemy_manager import EnemyManager
+
+# Headless load benchmark: steps the simulation with N enemies as fast as
+# possible and reports ticks/sec, tick-time percentiles and per-phase cost.
+#   python code/benchmark.py --enemies 10 50 200 --ticks 1000
+# --check-ai places one enemy next to an idle, invulnerable player, once as
+# an Enemy and once in the EnemyManager, and exits non-zero unless both stay
+# on the player the same way.
+# --ui-frames also draws the per-frame UI (health bars and the death screen)
+# offscreen under tracemalloc and reports what it allocates per frame. Once
+# the caches are warm it exits non-zero if a frame creates any font or
+# surface (their pixels are outside tracemalloc's view), allocates more than
+# UI_BYTES_PER_FRAME, or the frames trigger more than UI_GC_PER_100_FRAMES
+# garbage collections per 100 frames.
+# --startup rebuilds the asset bundle and times loading every animation and
+# the first screen of map chunks from the PNGs and from the bundle.
+# --streaming LAYOUT walks a view through every region of a world layout at
+# 60 fps, loading regions on the background thread and then inline, and
+# reports frame times, stalls, the memory held by loaded regions and the
+# most walls the World held at once.
+
+# Drawing the UI from warm caches allocates a couple of hundred bytes a frame
+# (the blit argument lists), whatever the number of enemies; anything that
+# builds a surface or a font per frame is far above this
+UI_BYTES_PER_FRAME = 1024
+UI_GC_PER_100_FRAMES = 1
+
+def measure_close_enemy(vectorized, ticks=600, seed=0, offset=30):
+    # How far an enemy starting `offset` px from the player strays, and for
+    # how many ticks it is out of attack range
+    spawn = (PLAYER_SPAWN[0] + offset, PLAYER_SPAWN[1])
+    runner = HeadlessRunner(0, seed=seed, inputs='idle', vectorized=vectorized, spawns=[spawn])
+    try:
+        player = runner.world.players[0]
+        enemy = runner.world.enemies[0]
+        furthest = 0.0
+        out_of_range = 0
+        for _ in range(ticks):
+            runner.step()
+            player.health = 100
+            distance = math.hypot(enemy.x - player.x, enemy.y - player.y)
+            furthest = max(furthest, distance)
+            out_of_range += distance >= EnemyManager.attack_range
+    finally:
+        runner.close()
+    return {'vectorized': vectorized, 'ticks': ticks, 'furthest_px': furthest, 'out_of_range_ticks': out_of_range}
+
+def check_ai(ticks=600, seed=0, tolerance=0.05):
+    # The EnemyManager is meant as a drop-in batched Enemy.update: both must
+    # stay on the player, out of range for at most `tolerance` of the ticks
+    reports = [measure_close_enemy(vectorized, ticks, seed) for vectorized in (False, True)]
+    failed = [report for report in reports
+              if report['out_of_range_ticks'] > tolerance * ticks
+              or report['furthest_px'] >= EnemyManager.chase_distance]
+    return reports, failed
+
+def measure_ui(runner, frames):
+    screen = pygame.Surface((1120, 640))
+    ui = get_ui()
+    players = runner.world.players
+    enemies = runner.world.enemies
+    player = players[0]
+
+    def draw_frame():
+        for entity in players:
+            entity.draw_health_bar(screen, 0, 0)
+        for entity in enemies:
+            entity.draw_health_bar(screen, 0, 0)
+        player.dim_background(screen)
+        player.display_death_message(screen, "You Died", "Press r to Respawn", ui.font(72), ui.font(32),
+                                     screen.get_width(), screen.get_height())
+
+    # The first frames fill the caches
+    for _ in range(10):
+        draw_frame()
+
+    created = ui.created
+    collections = gc.get_stats()[0]['collections']
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    transient = 0
+    for _ in range(frames):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        draw_frame()
+        transient += tracemalloc.get_traced_memory()[1] - before
+    retained = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return {
+        'ui_frames': frames,
+        'ui_peak_bytes_per_frame': transient / frames,
+        'ui_retained_bytes': retained,
+        'ui_gc_collections': gc.get_stats()[0]['collections'] - collections,
+        'ui_surfaces_created': ui.created - created,
+    }
+
+def load_assets(bundle=None):
+    # What startup loads: every entity animation and the chunks of one screen
+    animations.clear_cache()
+    animations.use_bundle(bundle)
+    start = perf_counter()
+    for spec in animation_specs():
+        animations.load_animation(*spec)
+    screen = pygame.Surface((1120, 640))
+    for names, image, opaque in layer_specs():
+        layer = ChunkedMapRenderer(MAP_FILE, names, TILE_SIZE, screen.get_size(), CHUNK_TILES,
+                                   fallback_image=image, opaque=opaque, bundle=bundle)
+        layer.draw(screen, 2940, 1680)
+    elapsed = perf_counter() - start
+    animations.use_bundle(None)
+    return elapsed
+
+def measure_startup():
+    build = build_bundle()
+    return {
+        'bundle_bytes': build['bytes'],
+        'bundle_build_s': build['build_s'],
+        'bundle_decode_s': build['decode_s'],
+        'startup_png_s': load_assets(),
+        'startup_bundle_s': load_assets(AssetBundle()),
+    }
+
+def measure_streaming(layout, background, budget=REGION_BUDGET, bundle=None, speed=16):
+    # The view visits each region's centre in turn and comes back to the
+    # first, `speed` pixels a frame; frames are paced to the tick rate so
+    # the loader thread gets the idle time it would get in the game
+    regions = load_layout(layout)
+    width, height = world_size(regions)
+    world = World(width, height, store=EntityStore(':memory:', flush_interval=0), rng=random.Random(0),
+                  streaming=True)
+    streamer = RegionStreamer(regions, bundle=bundle, budget=budget, background=background,
+                              on_load=lambda region, walls, tiles: world.add_walls(region.name, walls, tiles,
+                                                                                   region.rect),
+                              on_unload=lambda region: world.remove_walls(region.name))
+    surface = pygame.Surface(VIEW_SIZE)
+    stops = [region.rect.center for region in regions] + [regions[0].rect.center]
+    view = pygame.Rect((0, 0), VIEW_SIZE)
+    view.center = stops[0]
+    streamer.update([view])
+
+    times = []
+    peak = streamer.resident_bytes
+    peak_walls = len(world.walls)
+    for (x0, y0), (x1, y1) in zip(stops, stops[1:]):
+        steps = max(1, int(max(abs(x1 - x0), abs(y1 - y0)) // speed))
+        for step in range(1, steps + 1):
+            start = perf_counter()
+            view.center = (x0 + (x1 - x0) * step // steps, y0 + (y1 - y0) * step // steps)
+            streamer.update([view])
+            streamer.base.draw(surface, view.x, view.y)
+            streamer.foreground.draw(surface, view.x, view.y)
+            elapsed = perf_counter() - start
+            times.append(elapsed)
+            peak = max(peak, streamer.resident_bytes)
+            peak_walls = max(peak_walls, len(world.walls))
+            time.sleep(max(0.0, FIXED_DT - elapsed))
+    streamer.close()
+
+    times.sort()
+    return {
+        'streaming': 'background' if background else 'inline',
+        'frames': len(times),
+        'frame_p50_ms': times[len(times) // 2] * 1000,
+        'frame_p99_ms': times[int(len(times) * 0.99)] * 1000,
+        'frame_max_ms': times[-1] * 1000,
+        'region_loads': streamer.loads,
+        'region_unloads': streamer.unloads,
+        'region_stalls': streamer.stalls,
+        'region_peak_bytes': peak,
+        'peak_walls': peak_walls,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless simulation benchmark')
+    parser.add_argument('--enemies', type=int, nargs='*', default=[10, 50, 200])
+    parser.add_argument('--ticks', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--inputs', choices=sorted(INPUTS), default='random')
+    parser.add_argument('--vectorized', action='store_true', help='use the array-backed EnemyManager')
+    parser.add_argument('--no-pathfinding', action='store_true', help='chase in straight lines instead of flow fields')
+    parser.add_argument('--shards', type=int, nargs='+', default=[],
+                        help='also run with enemies split across this many worker processes, '
+                             'and compare each against the single-process vectorized run')
+    parser.add_argument('--lod', action='store_true', help='update distant enemies less often, as main.py does')
+    parser.add_argument('--no-separation', action='store_true', help="let enemies stack on top of each other")
+    parser.add_argument('--no-line-of-sight', action='store_true', help='aggro on distance alone, through walls')
+    parser.add_argument('--ui-frames', type=int, default=0, help='also measure UI allocations over N frames')
+    parser.add_argument('--startup', action='store_true', help='rebuild the asset bundle and time asset loading')
+    parser.add_argument('--streaming', metavar='LAYOUT', help='walk a view across the regions of a world layout')
+    parser.add_argument('--region-budget', type=int, default=REGION_BUDGET // 2 ** 20, metavar='MIB',
+                        help='memory kept for loaded regions in --streaming')
+    parser.add_argument('--no-bundle', action='store_true', help='load --streaming regions from the PNGs')
+    parser.add_argument('--check-ai', action='store_true',
+                        help='check the EnemyManager keeps a close enemy on the player like Enemy does')
+    parser.add_argument('--json', help='write the reports to this file')
+    args = parser.parse_args()
+    # The runner switches to the game root so sprite paths resolve
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    reports = []
+    failures = []
+    for num_enemies in args.enemies:
+        # Sharded runs are measured against the same seed on one process
+        vectorized = args.vectorized or bool(args.shards)
+        baseline = None
+        for shards in [0] + args.shards:
+            runner = HeadlessRunner(num_enemies, seed=args.seed, inputs=args.inputs, vectorized=vectorized,
+                                    pathfinding=not args.no_pathfinding, shards=shards, lod=args.lod,
+                                    separation=not args.no_separation, line_of_sight=not args.no_line_of_sight)
+            try:
+                report = runner.run(args.ticks)
+                if args.ui_frames and not shards:
+                    report.update(measure_ui(runner, args.ui_frames))
+            finally:
+                runner.close()
+            reports.append(report)
+            print(format_report(report))
+            if baseline is None:
+                baseline = report
+            else:
+                report['speedup'] = report['ticks_per_sec'] / baseline['ticks_per_sec']
+                print(f"  {report['speedup']:.2f}x the single-process ticks/s, "
+                      f"{report['enemies']} enemies left vs {baseline['enemies']}")
+            if args.ui_frames and not shards:
+                print(f"  ui         {report['ui_peak_bytes_per_frame']:.0f} B/frame peak, "
+                      f"{report['ui_retained_bytes']} B retained, {report['ui_gc_collections']} gc collections, "
+                      f"{report['ui_surfaces_created']} fonts/surfaces created over {args.ui_frames} frames")
+                if report['ui_surfaces_created']:
+                    failures.append(f"UI created {report['ui_surfaces_created']} fonts/surfaces from warm caches "
+                                    f"with {num_enemies} enemies")
+                if report['ui_peak_bytes_per_frame'] > UI_BYTES_PER_FRAME:
+                    failures.append(f"UI allocates {report['ui_peak_bytes_per_frame']:.0f} B/frame with "
+                                    f"{num_enemies} enemies (limit {UI_BYTES_PER_FRAME})")
+                if report['ui_gc_collections'] > UI_GC_PER_100_FRAMES * args.ui_frames / 100:
+                    failures.append(f"UI frames triggered {report['ui_gc_collections']} gc collections with "
+                                    f"{num_enemies} enemies (limit {UI_GC_PER_100_FRAMES} per 100 frames)")
+
+    if args.startup:
+        # Needs the display mode and working directory a runner sets up
+        runner = HeadlessRunner(0, seed=args.seed)
+        try:
+            startup = measure_startup()
+        finally:
+            runner.close()
+        reports.append(startup)
+        print(f"bundle {startup['bundle_bytes'] / 2 ** 20:.1f} MiB, built in {startup['bundle_build_s']:.2f} s "
+              f"({startup['bundle_decode_s']:.2f} s decoding PNGs)")
+        print(f"  startup from PNGs   {startup['startup_png_s'] * 1000:.0f} ms")
+        print(f"  startup from bundle {startup['startup_bundle_s'] * 1000:.0f} ms")
+
+    if args.streaming:
+        layout = os.path.abspath(args.streaming)
+        runner = HeadlessRunner(0, seed=args.seed)
+        try:
+            bundle = None if args.no_bundle else AssetBundle()
+            for background in (True, False):
+                report = measure_streaming(layout, background, args.region_budget * 2 ** 20, bundle)
+                reports.append(report)
+                print(f"streaming {report['streaming']:10} {report['frames']} frames, "
+                      f"p50 {report['frame_p50_ms']:.2f} ms, p99 {report['frame_p99_ms']:.2f} ms, "
+                      f"max {report['frame_max_ms']:.1f} ms")
+                print(f"  {report['region_loads']} loads, {report['region_unloads']} unloads, "
+                      f"{report['region_stalls']} stalls, peak {report['region_peak_bytes'] / 2 ** 20:.0f} MiB "
+                      f"in loaded regions")
+                print(f"  at most {report['peak_walls']} walls in the World")
+        finally:
+            runner.close()
+
+    if args.check_ai:
+        checks, failed = check_ai(seed=args.seed)
+        reports.extend(checks)
+        for check in checks:
+            print(f"close enemy ({'vectorized' if check['vectorized'] else 'Enemy'}): "
+                  f"strayed up to {check['furthest_px']:.1f} px, out of attack range "
+                  f"{check['out_of_range_ticks']} of {check['ticks']} ticks")
+        failures += [f"{'vectorized' if check['vectorized'] else 'Enemy'} enemy wandered off the player"
+                     for check in failed]
+
+    if json_path:
+        with open(json_path, 'w') as file:
+            json.dump(reports, file, indent=4)
+    for failure in failures:
+        print(f'FAILED: {failure}', file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
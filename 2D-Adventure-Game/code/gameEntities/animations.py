@@ -0,0 +1,76 @@
+import pygame
+from os.path import join
+
+# Process-wide caches shared by every Player and Enemy. Sheets are keyed by
+# path, animations by (path, frame size, frame count, zoom). With an asset
+# bundle in use, animations it holds are read from it instead of decoding
+# and scaling the PNG strip.
+#
+# With a render scale above 1 the world is drawn into a surface that many
+# times smaller (rendering.target), so frames are loaded that much smaller
+# too. Sizes in world pixels are a frame's size times its animation's scale.
+_sheets = {}
+_animations = {}
+_bundle = None
+_render_scale = 1
+
+class Animation(list):
+    # A list of scaled frames that also keeps the left-facing copies, so
+    # drawing never has to flip a surface
+    def __init__(self, frames, flipped=None):
+        super().__init__(frames)
+        self.flipped = flipped if flipped is not None else [pygame.transform.flip(frame, True, False) for frame in frames]
+        # World pixels per frame pixel
+        self.scale = 1
+
+    def facing(self, facing_left):
+        return self.flipped if facing_left else self
+
+def load_sheet(sheet_path):
+    sheet = _sheets.get(sheet_path)
+    if sheet is None:
+        sheet = pygame.image.load(join('sprites', sheet_path)).convert_alpha()
+        _sheets[sheet_path] = sheet
+    return sheet
+
+def load_animation(sheet_path, frame_width, frame_height, num_frames, zoom_factor):
+    # zoom_factor is in world pixels; the frames are divided by the render scale
+    if _render_scale != 1:
+        zoom_factor = zoom_factor / _render_scale
+    key = (sheet_path, frame_width, frame_height, num_frames, zoom_factor)
+    animation = _animations.get(key)
+    if animation is None:
+        if _bundle is not None:
+            animation = _bundle.animation(key)
+        if animation is None:
+            animation = Animation(extract_frames(load_sheet(sheet_path), frame_width, frame_height, num_frames,
+                                                 zoom_factor))
+        animation.scale = _render_scale
+        _animations[key] = animation
+    return animation
+
+def extract_frames(sheet, frame_width, frame_height, num_frames, zoom_factor):
+    sheet_width, sheet_height = sheet.get_size()
+    scaled_size = (int(frame_width * zoom_factor), int(frame_height * zoom_factor))
+
+    frames = []
+    for i in range(num_frames):
+        x = i * frame_width
+        # Strips shorter than num_frames just yield fewer frames
+        if x + frame_width <= sheet_width and frame_height <= sheet_height:
+            frame = sheet.subsurface(pygame.Rect(x, 0, frame_width, frame_height))
+            frames.append(pygame.transform.scale(frame, scaled_size))
+    return frames
+
+def set_render_scale(scale):
+    # Before any entity is created; frames already loaded keep their scale
+    global _render_scale
+    _render_scale = scale
+
+def use_bundle(bundle):
+    global _bundle
+    _bundle = bundle
+
+def clear_cache():
+    _sheets.clear()
+    _animations.clear()
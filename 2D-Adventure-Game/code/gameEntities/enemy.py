@@ -1,46 +1,64 @@
 import pygame
-import json
-import os
-from os.path import join
+from gameEntities.animations import load_animation
 from random import randint
-from math import sqrt
-from mechanics.combat import update_health_json
+from math import sqrt, ceil
+from itertools import count
+from mechanics.instrumentation import timed
+from rendering.ui import get_ui
+from mechanics.persistence import get_store
+
+# Every enemy gets its own save key: enemy1, enemy2, ...
+_enemy_ids = count(1)
 
 class Enemy:
     def __init__(self, sprite_sheet_path, idle_sprite_sheet_path, 
                  attack_sheet_path, death_sheet_path, hurt_sheet_path, health, 
-                 position, zoom_factor, enemy_id="enemy1"):
+                 position, zoom_factor, enemy_id=None, store=None):
         self.zoom_factor = zoom_factor
 
-        self.sprite_sheet = pygame.image.load(join('sprites', sprite_sheet_path)).convert_alpha()
-        self.idle_sprite_sheet = pygame.image.load(join('sprites', idle_sprite_sheet_path)).convert_alpha()
-        self.attack_sheet = pygame.image.load(join('sprites', attack_sheet_path)).convert_alpha()
-        self.death_sheet = pygame.image.load(join('sprites', death_sheet_path)).convert_alpha()
-        self.hurt_sheet = pygame.image.load(join('sprites', hurt_sheet_path)).convert_alpha()
-
         self.num_attack_frames = 7
-        self.current_attack_frame = 0
         self.attack_speed = 0.15
-        self.attacking = False
-
-        self.health = health
 
         # Frame settings
         self.frame_width = 96
         self.frame_height = 42
         self.num_frames = 8
-        self.frames = self.extract_frames(self.sprite_sheet)
-        self.idle_frames = self.extract_frames(self.idle_sprite_sheet)
-        self.death_frames = self.extract_frames(self.death_sheet)
-        self.attack_frames = self.extract_frames(self.attack_sheet)
+        # Frames come from the shared animation cache, so spawning another
+        # skeleton doesn't load or scale any surfaces
+        self.frames = self.extract_frames(sprite_sheet_path)
+        self.idle_frames = self.extract_frames(idle_sprite_sheet_path)
+        self.death_frames = self.extract_frames(death_sheet_path)
+        self.attack_frames = self.extract_frames(attack_sheet_path)
+        self.hurt_frames = self.extract_frames(hurt_sheet_path)
 
         # Enemy attributes
-        self.x, self.y = position
-        self.current_frame = 0
-        self.speed = 1
         self.chase_speed = 2
         self.chase_distance = 150  
         self.animation_speed = 0.1
+
+        self.attack_range = 50 
+        self.attack_cooldown = 2  
+
+        self.store = store or get_store()
+        self.rect = pygame.Rect(0, 0, 54, 64)
+        # Slot in EnemyPool.active, -1 when not pooled or free
+        self.pool_index = -1
+
+        # A position of None leaves the enemy dormant until reset(), which
+        # is how EnemyPool pre-allocates them
+        self.enemy_id = None
+        if position is not None:
+            self.reset(position, health, enemy_id)
+
+    def reset(self, position, health=100, enemy_id=None):
+        # Per-life state; everything else is shared by every life of this object
+        self.current_attack_frame = 0
+        self.attacking = False
+        self.health = health
+
+        self.x, self.y = position
+        self.current_frame = 0
+        self.speed = 1
         self.moving = False
         self.direction = None
         self.facing_left = False
@@ -49,34 +67,23 @@ class Enemy:
         self.is_dead = False
         self.death_frame_index = 0
         self.death_animation_done = False
+        # Simulation time since the last attack; starts ready to attack
+        self.since_attack = self.attack_cooldown
 
-        self.attack_range = 50 
-        self.attack_cooldown = 2  
-        self.last_attack_time = 0  
-
-        self.enemy_id = enemy_id
-        self.json_file = f'{self.enemy_id}.json'
+        self.enemy_id = enemy_id or f'enemy{next(_enemy_ids)}'
         self.load_from_json(position)
 
         self.dx, self.dy = 0, 0 
 
-        self.rect = pygame.Rect(self.x, self.y, 54, 64)
-        self.generate_json()
-
-    def extract_frames(self, sprite_sheet):
-        sheet_width, sheet_height = sprite_sheet.get_size()
+        self.rect.update(self.x, self.y, 54, 64)
+        self.save()
 
-        frames = []
-        for i in range(self.num_frames):
-            x = i * self.frame_width
-            if x + self.frame_width <= sheet_width and self.frame_height <= sheet_height:
-                frame = sprite_sheet.subsurface(pygame.Rect(x, 0, self.frame_width, self.frame_height))
-                scaled_frame = pygame.transform.scale(frame, (int(self.frame_width * self.zoom_factor), int(self.frame_height * self.zoom_factor)))
-                frames.append(scaled_frame)
-        return frames
+    def extract_frames(self, sheet_path):
+        return load_animation(sheet_path, self.frame_width, self.frame_height, self.num_frames, self.zoom_factor)
 
+    @timed('enemy.collisions')
     def handle_horizontal_collisions(self, walls):
-        for wall in walls:
+        for wall in walls.query(self.rect):
             if self.rect.colliderect(wall):
                 if self.dx > 0: 
                     self.rect.right = wall.left
@@ -88,8 +95,9 @@ class Enemy:
                 self.dx = 0
                 self.moving = False
 
+    @timed('enemy.collisions')
     def handle_vertical_collisions(self, walls):
-        for wall in walls:
+        for wall in walls.query(self.rect):
             if self.rect.colliderect(wall):
                 if self.dy > 0: 
                     self.rect.bottom = wall.top
@@ -104,7 +112,7 @@ class Enemy:
     def distance_to_player(self, player):
         return sqrt((self.x - player.x) ** 2 + (self.y - player.y) ** 2)
 
-    def chase_player(self, walls, players, player):
+    def chase_player(self, walls, players, player, pathfinder=None, steps=1):
         if self.attacking:
             return
 
@@ -113,44 +121,55 @@ class Enemy:
         if self.current_frame >= self.num_frames:
             self.current_frame = 0
 
-        # Calculate direction and speed
-        if self.x < player.x - 30:
-            self.dx = self.chase_speed
-            self.facing_left = False
-        elif self.x > player.x + 30:
-            self.dx = -self.chase_speed
-            self.facing_left = True
+        # Follow the player's flow field around walls; once in the player's
+        # cell (or off the field) steer straight at them
+        step = pathfinder.step(player, *self.rect.center) if pathfinder else None
+        if step and step != (0, 0):
+            self.dx = step[0] * self.chase_speed
+            self.dy = step[1] * self.chase_speed
+            if self.dx:
+                self.facing_left = self.dx < 0
         else:
-            self.dx = 0
-            self.moving = False
+            # Calculate direction and speed
+            if self.x < player.x - 30:
+                self.dx = self.chase_speed
+                self.facing_left = False
+            elif self.x > player.x + 30:
+                self.dx = -self.chase_speed
+                self.facing_left = True
+            else:
+                self.dx = 0
+                self.moving = False
 
-        if self.y < player.y + 10:
-            self.dy = self.chase_speed
-        elif self.y > player.y:
-            self.dy = -self.chase_speed
-        else:
-            self.dy = 0
-            self.moving = False
+            if self.y < player.y + 10:
+                self.dy = self.chase_speed
+            elif self.y > player.y:
+                self.dy = -self.chase_speed
+            else:
+                self.dy = 0
+                self.moving = False
 
         # Move the enemy
-        self.x += self.dx
-        self.rect.x = self.x
-        self.handle_horizontal_collisions(walls)
-
-        self.y += self.dy
-        self.rect.y = self.y
-        self.handle_vertical_collisions(walls)
-
-    def attack_player(self, player):
-        current_time = pygame.time.get_ticks() / 1000 
-        if current_time - self.last_attack_time >= self.attack_cooldown:
-            self.attacking = True  
+        self.move(walls, steps)
+
+    def attack(self):
+        if not self.attacking:
+            self.attacking = True
             self.current_attack_frame = 0
+
+    def attack_player(self, player, combat=None):
+        if self.since_attack >= self.attack_cooldown:
+            self.since_attack = 0
+            if combat is not None:
+                # Damage, the save and the swing animation happen when the
+                # combat queue resolves at the end of the tick
+                combat.emit(self, player, 10)
+                return
+            self.attack()
             player.health -= 10  
-            update_health_json(player) 
-            self.last_attack_time = current_time
+            player.save()
 
-    def detect_nearby_player(self, walls, players):
+    def detect_nearby_player(self, walls, players, pathfinder=None, combat=None, sight=None, steps=1):
         closest_player = None
         closest_distance = float('inf')
         
@@ -161,17 +180,45 @@ class Enemy:
                     closest_distance = distance
                     closest_player = player
 
+        if closest_player and closest_distance < self.chase_distance and sight is not None:
+            # A wall in the way: carry on as if the player were out of range
+            if not sight.visible(*self.rect.center, *closest_player.rect.center):
+                closest_distance = float('inf')
+
         if closest_player:
             if closest_distance < self.attack_range:
-                self.attack_player(closest_player)
+                self.attack_player(closest_player, combat)
             elif closest_distance < self.chase_distance:
                 self.is_near_player = True
-                self.chase_player(walls, players, closest_player) 
+                self.chase_player(walls, players, closest_player, pathfinder, steps)
             else:
                 self.is_near_player = False
                 self.dx, self.dy = 0, 0
 
-    def move_in_direction(self, walls):
+    def move(self, walls, steps=1):
+        # Moves by (dx, dy) once per tick covered, `steps` ticks at a time.
+        # A jump shorter than the body can't pass a wall without ending up
+        # overlapping it, so longer ones are made in pieces that aren't
+        move_x, move_y = self.dx * steps, self.dy * steps
+        pieces = max(1, ceil(abs(move_x) / self.rect.width), ceil(abs(move_y) / self.rect.height))
+        if pieces > 1:
+            move_x, move_y = move_x / pieces, move_y / pieces
+        for _ in range(pieces):
+            self.x += move_x
+            self.rect.x = self.x
+            self.handle_horizontal_collisions(walls)
+
+            self.y += move_y
+            self.rect.y = self.y
+            self.handle_vertical_collisions(walls)
+
+            # Stopped by a wall along an axis: the rest of the jump is too
+            if not self.dx:
+                move_x = 0
+            if not self.dy:
+                move_y = 0
+
+    def move_in_direction(self, walls, steps=1):
         if not self.is_dead:
             self.dx, self.dy = 0, 0
 
@@ -184,13 +231,7 @@ class Enemy:
             elif self.direction == 'right':
                 self.dx = self.speed
 
-            self.x += self.dx
-            self.rect.x = self.x
-            self.handle_horizontal_collisions(walls)
-
-            self.y += self.dy
-            self.rect.y = self.y
-            self.handle_vertical_collisions(walls)
+            self.move(walls, steps)
 
     def choose_new_direction(self):
         if not self.is_dead and not self.is_near_player:
@@ -211,24 +252,21 @@ class Enemy:
                 self.dx = self.speed
 
     def load_from_json(self, default_position):
-        if os.path.exists(self.json_file):
-            with open(self.json_file, 'r') as file:
-                data = json.load(file)
-                self.alive = data.get("alive", True)
-                self.id = data.get("id")
-                self.x = data.get("position", {}).get("x", default_position[0])
-                self.y = data.get("position", {}).get("y", default_position[1])
-                self.speed = data.get("stats", {}).get("speed", 3)
-                self.health = data.get("stats", {}).get("health", 100) 
+        data = self.store.load(self.enemy_id)
+        if data:
+            self.alive = data.get("alive", True)
+            self.id = data.get("id")
+            self.x = data.get("position", {}).get("x", default_position[0])
+            self.y = data.get("position", {}).get("y", default_position[1])
+            self.speed = data.get("stats", {}).get("speed", 3)
+            self.health = data.get("stats", {}).get("health", 100) 
         else:
             self.x, self.y = default_position
             self.speed = 3
             self.health = 100 
 
-        self.rect = pygame.Rect(self.x, self.y, 54, 64)
-
-    def generate_json(self):
-        enemy_data = {
+    def to_record(self):
+        return {
             "alive": "true",
             "id": self.enemy_id,
             "position": {
@@ -241,10 +279,21 @@ class Enemy:
             }
         }
 
-        with open(self.json_file, 'w') as file:
-            json.dump(enemy_data, file, indent=4)
+    def save(self):
+        # Write-behind: the store snapshots to_record() on its flush thread
+        self.store.mark_dirty(self.enemy_id, self)
 
-    def update(self, walls, players):
+    def advance_frame(self):
+        self.current_frame += self.animation_speed
+        if self.current_frame >= self.num_frames:
+            self.current_frame = 0
+
+    @timed('enemy.update')
+    def update(self, walls, players, dt, pathfinder=None, combat=None, animate=True, sight=None, steps=1):
+        # animate=False holds the idle and walk cycles still (off screen);
+        # with a LineOfSight, players behind walls aren't chased or attacked.
+        # An update standing in for `steps` ticks moves `steps` ticks' worth
+        self.since_attack += dt
         if self.health <= 0 and not self.is_dead:
             self.is_dead = True
             self.current_frame = 0 
@@ -262,16 +311,15 @@ class Enemy:
                 alive_players = [player for player in players if player.health > 0]
 
                 if alive_players:
-                    self.detect_nearby_player(walls, alive_players) 
+                    self.detect_nearby_player(walls, alive_players, pathfinder, combat, sight, steps)
                 else:
                     self.dx, self.dy = 0, 0 
                     self.is_near_player = False
 
                 if not self.is_near_player:
                     if not self.moving:
-                        self.current_frame += self.animation_speed
-                        if self.current_frame >= self.num_frames:
-                            self.current_frame = 0
+                        if animate:
+                            self.advance_frame()
 
                         # Choose a new direction occasionally
                         if randint(0, 100) < 5:
@@ -280,19 +328,16 @@ class Enemy:
                                 self.choose_new_direction()
 
                     if self.moving:
-                        self.move_in_direction(walls)
-                        self.current_frame += self.animation_speed
-                        if self.current_frame >= self.num_frames:
-                            self.current_frame = 0
+                        self.move_in_direction(walls, steps)
+                        if animate:
+                            self.advance_frame()
                         # Occasionally stop moving
                         if randint(0, 100) < 5:
                             self.moving = False
-                    else:
-                        self.current_frame += self.animation_speed
-                        if self.current_frame >= self.num_frames:
-                            self.current_frame = 0
+                    elif animate:
+                        self.advance_frame()
 
-        self.generate_json() 
+        self.save() 
 
     def play_death_animation(self):
         self.current_frame += self.animation_speed
@@ -304,33 +349,43 @@ class Enemy:
         return self.death_animation_done
 
     def draw_health_bar(self, surface, camera_x, camera_y):
-        bar_width = 50
-        bar_height = 5
-        
-        health_percentage = self.health / 100
-        
         health_color = (255, 0, 0) 
         
         bar_x = self.x - camera_x
         bar_y = self.y - camera_y - 10 
         
-        pygame.draw.rect(surface, (0, 0, 0), (bar_x, bar_y, bar_width, bar_height))
-        
-        current_health_width = int(bar_width * health_percentage)
-        pygame.draw.rect(surface, health_color, (bar_x, bar_y, current_health_width, bar_height))
-
-    def draw(self, surface, camera_x, camera_y):
+        # Pre-rendered per health value, so this is a single blit
+        get_ui().draw_health_bar(surface, self.health, health_color, bar_x, bar_y)
+
+    def screen_rect(self, camera_x, camera_y):
+        # Area draw() touches, in world pixels; the health bar fits inside the frame
+        width, height = self.frames[0].get_size()
+        scale = self.frames.scale
+        return pygame.Rect(self.x - camera_x, self.y - camera_y, width * scale, height * scale)
+
+    @property
+    def depth(self):
+        # World y of the bottom of the frame, for drawing in depth order
+        return self.y + self.frames[0].get_height() * self.frames.scale
+
+    def sprites(self, camera_x, camera_y):
+        # (image, position) pairs draw() blits, in order, in the frames'
+        # own pixels (world pixels unless there's a render scale)
+        # Left-facing frames are pre-flipped by the animation cache
+        left = self.facing_left
         if self.is_dead:
-            current_frame_image = self.death_frames[self.death_frame_index]
+            current_frame_image = self.death_frames.facing(left)[self.death_frame_index]
         elif self.attacking:
-            current_frame_image = self.attack_frames[int(self.current_attack_frame)]
+            current_frame_image = self.attack_frames.facing(left)[int(self.current_attack_frame)]
         elif not self.moving:
-            current_frame_image = self.idle_frames[int(self.current_frame) % len(self.idle_frames)]
+            current_frame_image = self.idle_frames.facing(left)[int(self.current_frame) % len(self.idle_frames)]
         else:
-            current_frame_image = self.frames[int(self.current_frame) % len(self.frames)]
+            current_frame_image = self.frames.facing(left)[int(self.current_frame) % len(self.frames)]
 
-        if self.facing_left:
-            current_frame_image = pygame.transform.flip(current_frame_image, True, False)
+        scale = self.frames.scale
+        x, y = (self.x - camera_x) / scale, (self.y - camera_y) / scale
+        return [(current_frame_image, (x, y)),
+                (get_ui().health_bar(self.health, (255, 0, 0), scale), (x + 120 / scale, y + 55 / scale))]
 
-        surface.blit(current_frame_image, (self.x - camera_x, self.y - camera_y))
-        self.draw_health_bar(surface, camera_x - 120, camera_y - 65)
\ No newline at end of file
+    def draw(self, surface, camera_x, camera_y):
+        surface.blits(self.sprites(camera_x, camera_y), doreturn=False)
\ No newline at end of file
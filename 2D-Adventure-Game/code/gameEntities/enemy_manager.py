@@ -0,0 +1,568 @@
+import numpy as np
+import pygame
+from gameEntities.animations import load_animation
+from gameEntities.enemy import _enemy_ids
+from mechanics.lod import MAX_PERIOD
+from mechanics.instrumentation import timed
+from mechanics.separation import separation
+from rendering.ui import get_ui
+
+# Struct-of-arrays alternative to a list of Enemy objects. Positions,
+# velocities, health, state and timers live in NumPy arrays and the AI
+# (player distances, chase/attack decisions, wandering, cooldowns) runs as
+# batched array operations once per tick. Only enemies that moved next to a
+# wall fall back to per-enemy collision resolution. EnemyView objects give
+# drawing and combat code the same attributes an Enemy has.
+#
+# With a LevelOfDetail only the enemies due this tick think, move and
+# resolve walls; the rest keep their state until their turn, when they move
+# as far as they would have over the ticks they skipped. The living
+# enemies updated this tick are then pushed apart (mechanics.separation).
+# In a streamed world, enemies outside the resident areas
+# (mechanics.residency) are never due and their clock stands still.
+# With a LineOfSight, enemies only chase or attack a player they can see.
+
+# Wander directions in the order Enemy.choose_new_direction uses:
+# up, down, left, right
+DIRECTIONS = np.array([[0, -1], [0, 1], [-1, 0], [1, 0]])
+
+# Per-enemy arrays and their types. `slot` is the enemy's index in a shared
+# RegionShards block when running in a worker process, unused otherwise;
+# `phase` staggers enemies in the same level-of-detail band and `updated` is
+# the tick an enemy last updated on.
+FIELDS = {
+    'x': np.float64, 'y': np.float64, 'dx': np.float64, 'dy': np.float64,
+    'health': np.float64, 'frame': np.float64, 'attack_frame': np.float64,
+    'death_frame': np.int64, 'last_attack': np.float64, 'direction': np.int64,
+    'moving': np.bool_, 'attacking': np.bool_, 'dead': np.bool_, 'facing_left': np.bool_,
+    'slot': np.int64, 'phase': np.int64, 'updated': np.int64,
+}
+
+class EnemyView:
+    __slots__ = ('manager', 'index', 'enemy_id')
+
+    def __init__(self, manager, index, enemy_id):
+        self.manager = manager
+        self.index = index
+        self.enemy_id = enemy_id
+
+    @property
+    def x(self):
+        return int(self.manager.x[self.index])
+
+    @x.setter
+    def x(self, value):
+        self.manager.x[self.index] = value
+
+    @property
+    def y(self):
+        return int(self.manager.y[self.index])
+
+    @y.setter
+    def y(self, value):
+        self.manager.y[self.index] = value
+
+    @property
+    def health(self):
+        return int(self.manager.health[self.index])
+
+    @health.setter
+    def health(self, value):
+        self.manager.health[self.index] = value
+
+    @property
+    def rect(self):
+        return pygame.Rect(self.x, self.y, self.manager.width, self.manager.height)
+
+    @property
+    def facing_left(self):
+        return bool(self.manager.facing_left[self.index])
+
+    @property
+    def moving(self):
+        return bool(self.manager.moving[self.index])
+
+    @property
+    def attacking(self):
+        return bool(self.manager.attacking[self.index])
+
+    @property
+    def is_dead(self):
+        return bool(self.manager.dead[self.index])
+
+    @property
+    def current_frame(self):
+        return float(self.manager.frame[self.index])
+
+    @property
+    def current_attack_frame(self):
+        return float(self.manager.attack_frame[self.index])
+
+    @property
+    def death_frame_index(self):
+        return int(self.manager.death_frame[self.index])
+
+    def to_record(self):
+        return {
+            "alive": "true",
+            "id": self.enemy_id,
+            "position": {
+                "x": self.x,
+                "y": self.y
+            },
+            "stats": {
+                "speed": self.manager.speed,
+                "health": 100
+            }
+        }
+
+    def attack(self):
+        manager = self.manager
+        if not manager.attacking[self.index]:
+            manager.attacking[self.index] = True
+            manager.attack_frame[self.index] = 0
+
+    def save(self):
+        if self.manager.store is not None:
+            self.manager.store.mark_dirty(self.enemy_id, self)
+
+    def draw_health_bar(self, surface, camera_x, camera_y):
+        get_ui().draw_health_bar(surface, self.health, (255, 0, 0), self.x - camera_x, self.y - camera_y - 10)
+
+    def screen_rect(self, camera_x, camera_y):
+        frames = self.manager.frames
+        width, height = frames[0].get_size()
+        return pygame.Rect(self.x - camera_x, self.y - camera_y, width * frames.scale, height * frames.scale)
+
+    @property
+    def depth(self):
+        frames = self.manager.frames
+        return self.y + frames[0].get_height() * frames.scale
+
+    def sprites(self, camera_x, camera_y):
+        manager = self.manager
+        i = self.index
+        left = bool(manager.facing_left[i])
+        if manager.dead[i]:
+            image = manager.death_frames.facing(left)[int(manager.death_frame[i])]
+        elif manager.attacking[i]:
+            image = manager.attack_frames.facing(left)[int(manager.attack_frame[i])]
+        elif not manager.moving[i]:
+            image = manager.idle_frames.facing(left)[int(manager.frame[i]) % len(manager.idle_frames)]
+        else:
+            image = manager.frames.facing(left)[int(manager.frame[i]) % len(manager.frames)]
+
+        scale = manager.frames.scale
+        x, y = (self.x - camera_x) / scale, (self.y - camera_y) / scale
+        return [(image, (x, y)), (get_ui().health_bar(self.health, (255, 0, 0), scale), (x + 120 / scale, y + 55 / scale))]
+
+    def draw(self, surface, camera_x, camera_y):
+        surface.blits(self.sprites(camera_x, camera_y), doreturn=False)
+
+class EnemyManager:
+    width, height = 54, 64
+    speed = 3
+    chase_speed = 2
+    chase_distance = 150
+    attack_range = 50
+    attack_cooldown = 2
+    attack_damage = 10
+    animation_speed = 0.1
+    attack_speed = 0.15
+    # randint(0, 100) < 5 in Enemy.update
+    move_chance = 5 / 101
+    turn_chance = 20 / 101
+    save_every = 30
+    mask_resolution = 4
+
+    def __init__(self, sheets, zoom_factor=3, store=None, seed=None, capacity=64, lod=None, separation=True,
+                 resident=None):
+        if lod is not None and max(self.speed, self.chase_speed) * MAX_PERIOD >= min(self.width, self.height):
+            raise ValueError('an enemy skipping MAX_PERIOD ticks would move further than its own size '
+                             'and could pass through walls')
+        walk, idle, attack, death, hurt = sheets
+        self.frames = load_animation(walk, 96, 42, 8, zoom_factor)
+        self.idle_frames = load_animation(idle, 96, 42, 8, zoom_factor)
+        self.attack_frames = load_animation(attack, 96, 42, 8, zoom_factor)
+        self.death_frames = load_animation(death, 96, 42, 8, zoom_factor)
+        self.num_frames = 8
+
+        self.store = store
+        self.rng = np.random.default_rng(seed)
+        self.views = []
+        self.count = 0
+        self.ticks = 0
+        self.spawned = 0
+        # Views of the enemies inside a view after the latest update
+        self.lod = lod
+        self.near = []
+        self.resident = resident
+        self.separation = separation
+        # Simulation seconds, advanced by update()
+        self.time = 0.0
+        self.allocate(capacity)
+
+        self.mask_walls = None
+        self.mask_version = 0
+        self.wall_table = None
+        self.wall_array = None
+        self.rect = pygame.Rect(0, 0, self.width, self.height)
+
+    def allocate(self, capacity):
+        old = self.count
+        for name, dtype in FIELDS.items():
+            array = np.zeros(capacity, dtype=dtype)
+            if old:
+                array[:old] = getattr(self, name)[:old]
+            setattr(self, name, array)
+        self.capacity = capacity
+        self.fields = tuple(FIELDS)
+
+    def __len__(self):
+        return self.count
+
+    def spawn(self, position, health=100, enemy_id=None):
+        if self.count == self.capacity:
+            self.allocate(self.capacity * 2)
+        i = self.count
+        for name in self.fields:
+            getattr(self, name)[i] = 0
+        self.x[i], self.y[i] = position
+        self.health[i] = health
+        self.direction[i] = -1
+        self.phase[i] = self.spawned % MAX_PERIOD
+        self.updated[i] = self.ticks - 1
+        # Ready to attack straight away, like Enemy
+        self.last_attack[i] = self.time - self.attack_cooldown
+        self.count += 1
+        self.spawned += 1
+
+        view = EnemyView(self, i, enemy_id or f'enemy{next(_enemy_ids)}')
+        self.views.append(view)
+        if self.store is not None:
+            self.store.mark_dirty(view.enemy_id, view)
+        return view
+
+    def build_wall_mask(self, walls):
+        # Summed-area table over a coarse raster of the wall rects. It tells in
+        # O(1) per enemy, for all enemies at once, whether a swept rect touches
+        # any wall, so only those enemies go through exact resolution.
+        res = self.mask_resolution
+        rects = list(walls.grid if hasattr(walls, 'grid') else walls)
+        self.mask_walls = walls
+        self.mask_version = getattr(walls, 'version', 0)
+        self.wall_array = np.array([tuple(r) for r in rects], dtype=np.float64).reshape(-1, 4)
+        if not rects:
+            self.wall_table = None
+            return
+        left = min(r[0] for r in rects) // res
+        top = min(r[1] for r in rects) // res
+        right = max(r[0] + r[2] for r in rects) // res + 1
+        bottom = max(r[1] + r[3] for r in rects) // res + 1
+        mask = np.zeros((bottom - top, right - left), dtype=np.int32)
+        for r in rects:
+            x0, y0 = r[0] // res - left, r[1] // res - top
+            x1, y1 = (r[0] + r[2] - 1) // res - left + 1, (r[1] + r[3] - 1) // res - top + 1
+            mask[y0:y1, x0:x1] = 1
+        table = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=np.int32)
+        table[1:, 1:] = mask.cumsum(0).cumsum(1)
+        self.wall_table = table
+        self.mask_origin = (left, top)
+
+    def near_walls(self, indices, dx=None, dy=None):
+        # Enemies among `indices` whose move of (dx, dy), this tick's
+        # velocity by default, may touch a wall
+        if self.wall_table is None:
+            return indices[:0]
+        res = self.mask_resolution
+        left, top = self.mask_origin
+        table = self.wall_table
+        rows, cols = table.shape[0] - 1, table.shape[1] - 1
+        x, y = self.x[indices], self.y[indices]
+        dx = self.dx[indices] if dx is None else dx
+        dy = self.dy[indices] if dy is None else dy
+
+        # The rect swept over this tick's move
+        x0 = np.clip((x + np.minimum(dx, 0)) // res - left, 0, cols).astype(np.int64)
+        y0 = np.clip((y + np.minimum(dy, 0)) // res - top, 0, rows).astype(np.int64)
+        x1 = np.clip((x + self.width + np.maximum(dx, 0) - 1) // res - left + 1, 0, cols).astype(np.int64)
+        y1 = np.clip((y + self.height + np.maximum(dy, 0) - 1) // res - top + 1, 0, rows).astype(np.int64)
+        covered = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+        return indices[covered > 0]
+
+    def follow_flow_fields(self, pathfinder, players, chase, closest):
+        # Overrides the straight-line steering with each player's flow field
+        # wherever the enemy's cell is on the field
+        n = self.count
+        x, y, dx, dy = self.x[:n], self.y[:n], self.dx[:n], self.dy[:n]
+        size = pathfinder.grid.cell_size
+        cols, rows = pathfinder.grid.cols, pathfinder.grid.rows
+        for p, player in enumerate(players):
+            field = pathfinder.field_for(player)
+            if field is None:
+                continue
+            chasing = np.flatnonzero(chase & (closest == p))
+            if not len(chasing):
+                continue
+            col = ((x[chasing] + self.width // 2) // size).astype(np.int64)
+            row = ((y[chasing] + self.height // 2) // size).astype(np.int64)
+            inside = (col >= 0) & (col < cols) & (row >= 0) & (row < rows)
+            chasing, col, row = chasing[inside], col[inside], row[inside]
+            sx = field.step_x[row, col]
+            sy = field.step_y[row, col]
+            follow = field.reached[row, col] & ((sx != 0) | (sy != 0))
+            chasing, sx, sy = chasing[follow], sx[follow], sy[follow]
+            dx[chasing] = sx * self.chase_speed
+            dy[chasing] = sy * self.chase_speed
+            self.moving[chasing] = True
+            self.facing_left[chasing[sx < 0]] = True
+            self.facing_left[chasing[sx > 0]] = False
+
+    def can_see(self, sight, players, mask, closest):
+        # False for the enemies in `mask` whose closest player is behind a
+        # wall; the checks are cached per tile pair, so this stays a loop
+        seen = np.ones(len(mask), dtype=bool)
+        centres = [player.rect.center for player in players]
+        indices = np.flatnonzero(mask)
+        xs = (self.x[indices] + self.width / 2).tolist()
+        ys = (self.y[indices] + self.height / 2).tolist()
+        for i, x, y, p in zip(indices.tolist(), xs, ys, closest[indices].tolist()):
+            if not sight.visible(x, y, *centres[p]):
+                seen[i] = False
+        return seen
+
+    def resolve_collisions(self, walls, indices, horizontal):
+        rect = self.rect
+        x, y, dx, dy, moving = self.x, self.y, self.dx, self.dy, self.moving
+        for i in indices:
+            rect.x = int(x[i])
+            rect.y = int(y[i])
+            for wall in walls.query(rect):
+                if rect.colliderect(wall):
+                    if horizontal:
+                        if dx[i] > 0:
+                            rect.right = wall.left
+                        elif dx[i] < 0:
+                            rect.left = wall.right
+                        x[i] = rect.x
+                        dx[i] = 0
+                    else:
+                        if dy[i] > 0:
+                            rect.bottom = wall.top
+                        elif dy[i] < 0:
+                            rect.top = wall.bottom
+                        y[i] = rect.y
+                        dy[i] = 0
+                    moving[i] = False
+
+    def in_walls(self, x, y):
+        # Whether an enemy rect at each (x, y) overlaps any wall, exactly;
+        # meant for the handful of positions near_walls() lets through
+        walls = self.wall_array
+        x, y = x[:, None], y[:, None]
+        return ((x < walls[:, 0] + walls[:, 2]) & (x + self.width > walls[:, 0]) &
+                (y < walls[:, 1] + walls[:, 3]) & (y + self.height > walls[:, 1])).any(axis=1)
+
+    @timed('enemy.separation')
+    def separate(self, indices):
+        # Pushes the enemies at `indices` apart. Near a wall each axis of the
+        # push is only kept if it doesn't end inside one
+        push_x, push_y = separation(self.x[indices], self.y[indices])
+        pushed = (push_x != 0) | (push_y != 0)
+        indices, push_x, push_y = indices[pushed], push_x[pushed], push_y[pushed]
+        if not len(indices):
+            return
+        check = np.flatnonzero(np.isin(indices, self.near_walls(indices, push_x, push_y)))
+        if len(check):
+            x, y = self.x[indices[check]], self.y[indices[check]]
+            push_x[check[self.in_walls(x + push_x[check], y)]] = 0
+            push_y[check[self.in_walls(x + push_x[check], y + push_y[check])]] = 0
+        self.x[indices] += push_x
+        self.y[indices] += push_y
+
+    def advance_frames(self, frame, mask):
+        frame[mask] += self.animation_speed
+        frame[mask & (frame >= self.num_frames)] = 0
+
+    def schedule(self, n):
+        # (due, animate, elapsed): who updates this tick, who is close enough
+        # for their idle and walk cycles to be seen, and how many ticks each
+        # enemy's move this tick stands for
+        frozen = None
+        if self.resident is not None:
+            frozen = ~self.resident.active_mask(self.x[:n], self.y[:n], self.width, self.height)
+        if self.lod is None:
+            everyone = np.ones(n, dtype=bool)
+            due = everyone if frozen is None else ~frozen
+            return due, everyone, np.ones(n, dtype=np.int64)
+        periods = self.lod.periods(self.x[:n], self.y[:n])
+        animate = periods == 1
+        self.near = [self.views[i] for i in np.flatnonzero(animate)]
+        due = (self.ticks + self.phase[:n]) % periods == 0
+        updated = self.updated[:n]
+        if frozen is not None:
+            due &= ~frozen
+            updated[frozen] = self.ticks - 1
+        elapsed = self.ticks - updated
+        updated[due] = self.ticks
+        return due, animate, elapsed
+
+    @timed('enemy.update')
+    def update(self, walls, players, dt, pathfinder=None, combat=None, sight=None):
+        # Returns how many enemies were updated
+        self.time += dt
+        now = self.time
+        n = self.count
+        if n == 0:
+            self.near = []
+            return 0
+        if self.mask_walls is not walls or self.mask_version != getattr(walls, 'version', 0):
+            self.build_wall_mask(walls)
+
+        x, y, dx, dy = self.x[:n], self.y[:n], self.dx[:n], self.dy[:n]
+        health, frame, dead = self.health[:n], self.frame[:n], self.dead[:n]
+        attacking, attack_frame, moving = self.attacking[:n], self.attack_frame[:n], self.moving[:n]
+        facing_left, direction = self.facing_left[:n], self.direction[:n]
+        due, animate, elapsed = self.schedule(n)
+
+        newly_dead = (health <= 0) & ~dead
+        dead[newly_dead] = True
+        frame[newly_dead] = 0
+
+        # Death animation; finished enemies are removed at the end of the tick
+        dying = dead & due
+        frame[dying] += self.animation_speed
+        done = dying & (frame.astype(np.int64) >= len(self.death_frames))
+        playing = dying & ~done
+        self.death_frame[:n][playing] = frame[playing].astype(np.int64) % len(self.death_frames)
+
+        # Attack animation; like an Enemy, a swinging enemy stands still
+        swinging = attacking & ~dead & due
+        attack_frame[swinging] += self.attack_speed
+        finished = swinging & (attack_frame.astype(np.int64) >= len(self.attack_frames))
+        attacking[finished] = False
+        attack_frame[finished] = 0
+        dx[swinging] = 0
+        dy[swinging] = 0
+
+        active = ~dead & ~swinging & due
+        near = np.zeros(n, dtype=bool)
+        dx[active] = 0
+        dy[active] = 0
+
+        alive_players = [player for player in players if player.health > 0]
+        if alive_players and active.any():
+            px = np.array([player.x for player in alive_players], dtype=np.float64)
+            py = np.array([player.y for player in alive_players], dtype=np.float64)
+            distances = np.hypot(x[:, None] - px[None, :], y[:, None] - py[None, :])
+            closest = distances.argmin(axis=1)
+            closest_distance = distances[np.arange(n), closest]
+
+            close = active & (closest_distance < self.chase_distance)
+            if sight is not None and close.any():
+                close &= self.can_see(sight, alive_players, close, closest)
+            in_range = close & (closest_distance < self.attack_range)
+            strike = in_range & (now - self.last_attack[:n] >= self.attack_cooldown)
+            self.last_attack[:n][strike] = now
+            if combat is not None:
+                # Queued; the swing starts when the hit resolves
+                views = self.views
+                for i in np.flatnonzero(strike):
+                    combat.emit(views[i], alive_players[closest[i]], self.attack_damage)
+            elif strike.any():
+                attacking[strike] = True
+                attack_frame[strike] = 0
+                hits = np.bincount(closest[strike], minlength=len(alive_players))
+                for player, count in zip(alive_players, hits):
+                    if count:
+                        player.health -= self.attack_damage * int(count)
+                        player.save()
+
+            # In range counts as near too (Enemy.is_near_player), so an
+            # attacker doesn't wander off between swings
+            chase = close & ~in_range
+            near[close] = True
+            tx, ty = px[closest], py[closest]
+
+            moving[chase] = True
+            self.advance_frames(frame, chase)
+
+            right = chase & (x < tx - 30)
+            left = chase & ~right & (x > tx + 30)
+            dx[right] = self.chase_speed
+            dx[left] = -self.chase_speed
+            facing_left[right] = False
+            facing_left[left] = True
+            moving[chase & ~right & ~left] = False
+
+            down = chase & (y < ty + 10)
+            up = chase & ~down & (y > ty)
+            dy[down] = self.chase_speed
+            dy[up] = -self.chase_speed
+            moving[chase & ~down & ~up] = False
+
+            if pathfinder is not None and chase.any():
+                self.follow_flow_fields(pathfinder, alive_players, chase, closest)
+
+        # Wandering: the same random decisions as Enemy.update, drawn for
+        # every enemy at once
+        wander = active & ~near
+        rolls = self.rng.random((3, n))
+        idle = wander & ~moving
+        self.advance_frames(frame, idle & animate)
+        start = idle & (rolls[0] < self.move_chance)
+        moving[start] = True
+        turn = start & ((direction < 0) | (rolls[1] < self.turn_chance))
+        if turn.any():
+            direction[turn] = self.rng.integers(0, 4, int(turn.sum()))
+            facing_left[turn & (direction == 2)] = True
+            facing_left[turn & (direction == 3)] = False
+
+        walking = wander & moving & (direction >= 0)
+        steps = DIRECTIONS[direction[walking]] * self.speed
+        dx[walking] = steps[:, 0]
+        dy[walking] = steps[:, 1]
+        self.advance_frames(frame, walking & animate)
+        self.advance_frames(frame, wander & ~moving & animate)
+
+        # Move, then resolve walls only for enemies near one. A move covers
+        # every tick since the enemy's last update; it is shorter than the
+        # body (checked in __init__), so it can't pass a wall without ending
+        # up overlapping it
+        moved = np.flatnonzero(due & ((dx != 0) | (dy != 0)))
+        if len(moved):
+            step_x = dx[moved] * elapsed[moved]
+            step_y = dy[moved] * elapsed[moved]
+            candidates = self.near_walls(moved, step_x, step_y)
+            x[moved] += step_x
+            self.resolve_collisions(walls, candidates, True)
+            y[moved] += step_y
+            self.resolve_collisions(walls, candidates, False)
+        if self.separation:
+            self.separate(np.flatnonzero(due & ~dead))
+
+        moving[walking & (rolls[2] < self.move_chance)] = False
+
+        if done.any():
+            if self.lod is not None:
+                self.near = [view for view in self.near if not done[view.index]]
+            self.remove(~done)
+
+        self.ticks += 1
+        if self.store is not None and self.ticks % self.save_every == 0:
+            for view in self.views:
+                self.store.mark_dirty(view.enemy_id, view)
+        return int(due.sum())
+
+    def remove(self, keep):
+        n = self.count
+        kept = int(keep.sum())
+        for name in self.fields:
+            array = getattr(self, name)
+            array[:kept] = array[:n][keep]
+        self.count = kept
+        views = [view for view, k in zip(self.views, keep) if k]
+        for index, view in enumerate(views):
+            view.index = index
+        # Update in place so World.enemies keeps pointing at this list
+        self.views[:] = views
@@ -0,0 +1,146 @@
+from gameEntities.enemy import Enemy
+from mechanics.lod import MAX_PERIOD, next_tick
+from mechanics.separation import separate
+
+# Pre-allocated Enemy objects. acquire() resets a free enemy instead of
+# constructing one, and release() hands a dead one back with a swap-remove,
+# so neither spawning nor despawning scales with the number of enemies.
+# `active` is the live list the World iterates and draws; its order changes
+# when an enemy is released.
+#
+# With a LevelOfDetail, enemies are kept on a timing wheel instead: each
+# enemy sits in the slot of the tick it is next due on, and a tick only
+# visits its own slot, so distant enemies cost nothing on the ticks they
+# skip. `near` lists the enemies inside a view after the latest update.
+#
+# After moving, the enemies updated this tick are pushed apart
+# (mechanics.separation) so crowds spread out instead of stacking.
+#
+# In a streamed world, enemies outside the resident areas
+# (mechanics.residency) are frozen: skipped, and on the wheel checked again
+# MAX_PERIOD ticks later with their clock restarted, so they don't make up
+# the frozen time once their region loads.
+
+class EnemyPool:
+    def __init__(self, sheets, capacity=16, zoom_factor=3, store=None, lod=None, separation=True, resident=None):
+        self.sheets = sheets
+        self.zoom_factor = zoom_factor
+        self.store = store
+        self.active = []
+        self.free = []
+        self.allocated = 0
+
+        self.separation = separation
+        self.lod = lod
+        self.resident = resident
+        self.wheel = [[] for _ in range(MAX_PERIOD)]
+        self.near = []
+        self.ticks = 0
+        self.spawned = 0
+        self.reserve(capacity)
+
+    def allocate(self):
+        self.allocated += 1
+        return Enemy(*self.sheets, 100, None, self.zoom_factor, store=self.store)
+
+    def reserve(self, capacity):
+        # Make sure at least `capacity` enemies exist
+        for _ in range(capacity - self.allocated):
+            self.free.append(self.allocate())
+
+    def acquire(self, position, health=100, enemy_id=None):
+        # Out of free enemies: grow rather than refuse to spawn
+        enemy = self.free.pop() if self.free else self.allocate()
+        enemy.reset(position, health, enemy_id)
+        enemy.pool_index = len(self.active)
+        self.active.append(enemy)
+        if self.lod is not None:
+            # Due on the next tick; the phase staggers it within its band
+            enemy.lod_phase = self.spawned % MAX_PERIOD
+            enemy.lod_tick = self.ticks
+            self.wheel[(self.ticks + 1) % MAX_PERIOD].append(enemy)
+        self.spawned += 1
+        return enemy
+
+    def release(self, enemy):
+        index = enemy.pool_index
+        last = self.active.pop()
+        if last is not enemy:
+            self.active[index] = last
+            last.pool_index = index
+        enemy.pool_index = -1
+        self.free.append(enemy)
+
+    def update(self, walls, players, dt, pathfinder=None, combat=None, sight=None):
+        # Returns how many enemies were updated
+        if self.lod is not None:
+            return self.update_due(walls, players, dt, pathfinder, combat, sight)
+        # Enemy.update returns True once the death animation has finished.
+        # A released slot is refilled from the end of the list, so the same
+        # index is visited again instead of advancing.
+        active = self.active
+        resident = self.resident
+        if resident is None:
+            updated = len(active)
+            moved = active
+        else:
+            updated = 0
+            moved = []
+        i = 0
+        while i < len(active):
+            enemy = active[i]
+            if resident is not None:
+                if not resident.active(enemy.rect):
+                    i += 1
+                    continue
+                updated += 1
+            if enemy.update(walls, players, dt, pathfinder, combat, sight=sight):
+                self.release(enemy)
+                continue
+            if resident is not None:
+                moved.append(enemy)
+            i += 1
+        if self.separation:
+            separate(moved, walls)
+        return updated
+
+    def update_due(self, walls, players, dt, pathfinder, combat, sight=None):
+        # Updates this tick's slot of the wheel, each enemy with the time
+        # and the distance to cover since its last update, and files it
+        # under its next due tick
+        lod = self.lod
+        wheel = self.wheel
+        self.ticks += 1
+        tick = self.ticks
+        due = wheel[tick % MAX_PERIOD]
+        wheel[tick % MAX_PERIOD] = []
+        near = self.near
+        near.clear()
+        resident = self.resident
+        frozen = 0
+        updated = []
+        for enemy in due:
+            if resident is not None and not resident.active(enemy.rect):
+                enemy.lod_tick = tick
+                wheel[next_tick(tick, MAX_PERIOD, enemy.lod_phase) % MAX_PERIOD].append(enemy)
+                frozen += 1
+                continue
+            period = lod.period(enemy.x, enemy.y)
+            elapsed = tick - enemy.lod_tick
+            enemy.lod_tick = tick
+            if enemy.update(walls, players, dt * elapsed, pathfinder, combat, period == 1, sight, elapsed):
+                self.release(enemy)
+                continue
+            wheel[next_tick(tick, period, enemy.lod_phase) % MAX_PERIOD].append(enemy)
+            updated.append(enemy)
+            if period == 1:
+                near.append(enemy)
+        if self.separation:
+            separate(updated, walls)
+        return len(due) - frozen
+
+    def __len__(self):
+        return len(self.active)
+
+    def __iter__(self):
+        return iter(self.active)
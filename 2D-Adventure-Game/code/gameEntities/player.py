@@ -1,32 +1,28 @@
 import pygame
-import json
-import os
-from os.path import join
+from gameEntities.animations import load_animation
+from mechanics.instrumentation import timed
+from rendering.ui import get_ui
+from mechanics.persistence import get_store
 
 class Player:
     def __init__(self, sprite_sheet_path, hair_sheet_path, idle_sprite_sheet_path, 
                  idle_hair_sheet_path, attack_sheet_path, attack_hair_path, death_sheet_path, 
-                 death_hair_sheet_path, position, zoom_factor, player_id="player1"):
+                 death_hair_sheet_path, position, zoom_factor, player_id="player1", store=None):
         self.zoom_factor = zoom_factor
 
-        # Load sprite sheets
-        self.sprite_sheet = pygame.image.load(join('sprites', sprite_sheet_path)).convert_alpha()
-        self.hair_sheet = pygame.image.load(join('sprites', hair_sheet_path)).convert_alpha()
-        self.idle_sheet = pygame.image.load(join('sprites', idle_sprite_sheet_path)).convert_alpha()
-        self.hair_idle_sheet = pygame.image.load(join('sprites', idle_hair_sheet_path)).convert_alpha()
-        self.death_sheet = pygame.image.load(join('sprites', death_sheet_path)).convert_alpha()
-        self.hair_death_sheet = pygame.image.load(join('sprites', death_hair_sheet_path)).convert_alpha()
-
         # Frame settings
         self.frame_width = 96
         self.frame_height = 42
         self.num_frames = 8
-        self.frames = self.extract_frames(self.sprite_sheet)
-        self.hair_frames = self.extract_frames(self.hair_sheet)
-        self.idle_frames = self.extract_frames(self.idle_sheet)
-        self.idle_hair_frames = self.extract_frames(self.hair_idle_sheet)
-        self.death_frames = self.extract_frames(self.death_sheet)
-        self.death_hair_frames = self.extract_frames(self.hair_death_sheet)
+
+        # Frames come from the shared animation cache, so every player built
+        # from the same sheets reuses the same surfaces
+        self.frames = self.extract_frames(sprite_sheet_path)
+        self.hair_frames = self.extract_frames(hair_sheet_path)
+        self.idle_frames = self.extract_frames(idle_sprite_sheet_path)
+        self.idle_hair_frames = self.extract_frames(idle_hair_sheet_path)
+        self.death_frames = self.extract_frames(death_sheet_path)
+        self.death_hair_frames = self.extract_frames(death_hair_sheet_path)
 
         self.death_animation_done = False
         self.death_frame_index = 0
@@ -34,58 +30,52 @@ class Player:
         self.animation_speed = 0.1
 
         # Attack animation setup
-        self.attack_sheet = pygame.image.load(join('sprites', attack_sheet_path)).convert_alpha()
-        self.attack_hair_sheet = pygame.image.load(join('sprites', attack_hair_path)).convert_alpha()
         self.num_attack_frames = 10
-        self.attack_frames = self.extract_frames(self.attack_sheet, self.num_attack_frames)
-        self.attack_hair = self.extract_frames(self.attack_hair_sheet, self.num_attack_frames)
+        self.attack_frames = self.extract_frames(attack_sheet_path, self.num_attack_frames)
+        self.attack_hair = self.extract_frames(attack_hair_path, self.num_attack_frames)
         self.attacking = False
         self.current_attack_frame = 0
         self.attack_speed = 0.15
         self.isDead = True
 
-        # Load data from file if it exists, else use default values
+        # Load saved state if it exists, else use default values
         self.player_id = player_id
-        self.json_file = f'{self.player_id}.json'
+        self.store = store or get_store()
         self.load_from_json(position)
         self.current_frame = 0
         self.frame_speed = 0.1
         self.facing_left = False
         self.moving = False
-        self.lastRegen = 0
+        self.sinceRegen = 0
+        self.lastAttackTime = 0
         self.currentTime = 0
 
 
-        self.update_json()
+        self.save()
 
     def load_from_json(self, default_position):
-        if os.path.exists(self.json_file):
-            with open(self.json_file, 'r') as file:
-                data = json.load(file)
-                self.x = data.get("position", {}).get("x", default_position[0])
-                self.y = data.get("position", {}).get("y", default_position[1])
-                self.speed = data.get("stats", {}).get("speed", 3)
-                self.health = data.get("stats", {}).get("health", 100)
-                if self.health > 0:
-                    self.isDead = False
+        data = self.store.load(self.player_id)
+        if data:
+            self.x = data.get("position", {}).get("x", default_position[0])
+            self.y = data.get("position", {}).get("y", default_position[1])
+            self.speed = data.get("stats", {}).get("speed", 3)
+            self.health = data.get("stats", {}).get("health", 100)
+            if self.health > 0:
+                self.isDead = False
         else:
             self.x, self.y = default_position
             self.speed = 3
             self.health = 100
+            self.isDead = False
 
         self.rect = pygame.Rect(self.x, self.y, 54, 64)
 
-    def extract_frames(self, sheet, num_frames=None):
-        frames = []
+    def extract_frames(self, sheet_path, num_frames=None):
         num_frames = num_frames or self.num_frames
-        for i in range(num_frames):
-            frame = sheet.subsurface(pygame.Rect(i * self.frame_width, 0, self.frame_width, self.frame_height))
-            scaled_frame = pygame.transform.scale(frame, (int(self.frame_width * self.zoom_factor), int(self.frame_height * self.zoom_factor)))
-            frames.append(scaled_frame)
-        return frames
-
-    def update_json(self):
-        player_data = {
+        return load_animation(sheet_path, self.frame_width, self.frame_height, num_frames, self.zoom_factor)
+
+    def to_record(self):
+        return {
             "id": self.player_id,
             "position": {
                 "x": self.x,
@@ -97,8 +87,9 @@ class Player:
             }
         }
 
-        with open(self.json_file, 'w') as file:
-            json.dump(player_data, file, indent=4)
+    def save(self):
+        # Write-behind: the store snapshots to_record() on its flush thread
+        self.store.mark_dirty(self.player_id, self)
 
     def respawn(self, position):
         self.x, self.y = position
@@ -108,9 +99,10 @@ class Player:
         self.isDead = False
         self.current_frame = 0 
         self.death_animation_done = False
-        self.update_json() 
+        self.save() 
 
-    def update(self, keys, walls):
+    @timed('player.update')
+    def update(self, keys, walls, dt):
         if self.health > 0:
             self.moving = False
             self.dx, self.dy = 0, 0
@@ -155,20 +147,22 @@ class Player:
                     self.current_attack_frame = 0
                     self.attacking = False
 
-            self.currentTime = pygame.time.get_ticks() / 1000
-            if self.currentTime > self.lastRegen + 5:
+            # Simulation time since the last regen tick
+            self.sinceRegen += dt
+            if self.sinceRegen > 5:
                 if self.health > 0 and self.health < 100:
-                    self.lastRegen = pygame.time.get_ticks() / 1000
+                    self.sinceRegen = 0
                     self.health += 5
                     if self.health > 100:
                         self.health = 100
         else:
             self.play_death_animation()
 
-        self.update_json()
+        self.save()
 
+    @timed('player.collisions')
     def handle_horizontal_collisions(self, walls):
-        for wall in walls:
+        for wall in walls.query(self.rect):
             if self.rect.colliderect(wall):
                 if self.dx > 0:
                     self.rect.right = wall.left
@@ -177,8 +171,9 @@ class Player:
                     self.rect.left = wall.right
                     self.x = self.rect.x
 
+    @timed('player.collisions')
     def handle_vertical_collisions(self, walls):
-        for wall in walls:
+        for wall in walls.query(self.rect):
             if self.rect.colliderect(wall):
                 if self.dy > 0:
                     self.rect.bottom = wall.top
@@ -193,20 +188,13 @@ class Player:
             self.current_attack_frame = 0
 
     def draw_health_bar(self, surface, camera_x, camera_y):
-        bar_width = 50
-        bar_height = 5
-        
-        health_percentage = self.health / 100
-        
         health_color = (135,206,250) 
         
         bar_x = self.x - camera_x
         bar_y = self.y - camera_y - 10 
         
-        pygame.draw.rect(surface, (0, 0, 0), (bar_x, bar_y, bar_width, bar_height))
-        
-        current_health_width = int(bar_width * health_percentage)
-        pygame.draw.rect(surface, health_color, (bar_x, bar_y, current_health_width, bar_height))
+        # Pre-rendered per health value, so this is a single blit
+        get_ui().draw_health_bar(surface, self.health, health_color, bar_x, bar_y)
 
     def play_death_animation(self):
         self.isDead = True
@@ -229,45 +217,59 @@ class Player:
             self.death_animation_done = True
 
     def dim_background(self, surface):
-        dim_surface = pygame.Surface(surface.get_size())
-        dim_surface.set_alpha(128)
-        dim_surface.fill((0, 0, 0))
-        surface.blit(dim_surface, (0, 0))
+        get_ui().dim(surface)
 
     def display_death_message(self, surface, message, respawnInstructions, font, font2, screen_width, screen_height):
-        text = font.render(message, True, (255, 255, 255))  # White text
+        ui = get_ui()
+        text = ui.render(font, message, (255, 255, 255))  # White text
         text_rect = text.get_rect(center=(screen_width // 2, screen_height // 2))
         surface.blit(text, text_rect)
-        text2 = font.render(respawnInstructions, True, (255, 255, 255))  # White text
+        text2 = ui.render(font, respawnInstructions, (255, 255, 255))  # White text
         text_rect2 = text.get_rect(center=(screen_width // 2 - 120, screen_height // 2 + 100))
         surface.blit(text2, text_rect2)
 
-    def draw(self, surface, camera_x, camera_y):
+    def screen_rect(self, camera_x, camera_y):
+        # Area draw() touches, in world pixels; the hair frames and health
+        # bar fit inside the body frame
+        width, height = self.frames[0].get_size()
+        scale = self.frames.scale
+        return pygame.Rect(self.x - camera_x, self.y - camera_y, width * scale, height * scale)
+
+    @property
+    def depth(self):
+        # World y of the bottom of the frame, for drawing in depth order
+        return self.y + self.frames[0].get_height() * self.frames.scale
+
+    def sprites(self, camera_x, camera_y):
+        # (image, position) pairs draw() blits, in order, in the frames'
+        # own pixels (world pixels unless there's a render scale)
+        # Left-facing frames are pre-flipped by the animation cache
+        left = self.facing_left
         if self.health > 0:
             if self.attacking:
-                current_frame_image = self.attack_frames[int(self.current_attack_frame)]
-                current_hair_image = self.attack_hair[int(self.current_attack_frame)]
+                current_frame_image = self.attack_frames.facing(left)[int(self.current_attack_frame)]
+                current_hair_image = self.attack_hair.facing(left)[int(self.current_attack_frame)]
             elif self.moving:
-                current_frame_image = self.frames[int(self.current_frame)]
-                current_hair_image = self.hair_frames[int(self.current_frame)]
+                current_frame_image = self.frames.facing(left)[int(self.current_frame)]
+                current_hair_image = self.hair_frames.facing(left)[int(self.current_frame)]
             else:
-                current_frame_image = self.idle_frames[int(self.current_frame)]
-                current_hair_image = self.idle_hair_frames[int(self.current_frame)]
+                current_frame_image = self.idle_frames.facing(left)[int(self.current_frame)]
+                current_hair_image = self.idle_hair_frames.facing(left)[int(self.current_frame)]
         else:
             if self.death_frame_index >= len(self.death_frames):
                 self.death_frame_index = len(self.death_frames) - 1
-            current_frame_image = self.death_frames[self.death_frame_index]
-            current_hair_image = self.death_hair_frames[self.death_frame_index]
-
-        if self.facing_left:
-            current_frame_image = pygame.transform.flip(current_frame_image, True, False)
-            current_hair_image = pygame.transform.flip(current_hair_image, True, False)
+            current_frame_image = self.death_frames.facing(left)[self.death_frame_index]
+            current_hair_image = self.death_hair_frames.facing(left)[self.death_frame_index]
 
-        adjusted_x = self.x - camera_x
-        adjusted_y = self.y - camera_y
+        scale = self.frames.scale
+        adjusted_x = (self.x - camera_x) / scale
+        adjusted_y = (self.y - camera_y) / scale
 
-        surface.blit(current_frame_image, (adjusted_x, adjusted_y))
-        surface.blit(current_hair_image, (adjusted_x, adjusted_y))
-        
+        blits = [(current_frame_image, (adjusted_x, adjusted_y)), (current_hair_image, (adjusted_x, adjusted_y))]
         if self.health > 0:
-            self.draw_health_bar(surface, camera_x - 120, camera_y - 60)
\ No newline at end of file
+            bar = get_ui().health_bar(self.health, (135, 206, 250), scale)
+            blits.append((bar, (adjusted_x + 120 / scale, adjusted_y + 50 / scale)))
+        return blits
+
+    def draw(self, surface, camera_x, camera_y):
+        surface.blits(self.sprites(camera_x, camera_y), doreturn=False)
\ No newline at end of file
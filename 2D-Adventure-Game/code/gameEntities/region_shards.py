@@ -0,0 +1,238 @@
+import multiprocessing
+import numpy as np
+import pygame
+from multiprocessing import shared_memory
+from gameEntities.animations import load_animation
+from gameEntities.enemy import _enemy_ids
+from gameEntities.enemy_manager import EnemyManager, EnemyView, FIELDS
+from mechanics.instrumentation import timed
+from mechanics.pathfinding import Pathfinder
+from mechanics.sight import LineOfSight
+
+# Enemies simulated by worker processes, one per vertical strip of the map.
+# Every enemy has a fixed slot in a block of multiprocessing.shared_memory
+# arrays (the EnemyManager fields plus its owning region), and that block is
+# the state between ticks: each tick a worker copies the slots its region
+# owns into a private EnemyManager, runs the usual vectorized update, and
+# writes them back. An enemy whose centre has left the strip is handed off
+# by writing the new region to `next_owner`; the main process publishes
+# those after every worker has finished, so no worker sees a half-done tick.
+#
+# The main process keeps players, input and combat resolution. It sends the
+# player positions with each tick, gets back the hits enemies landed, and
+# draws the enemies through EnemyViews that read the shared arrays.
+#
+# Workers are forked so they inherit the walls, the loaded animations and
+# the shared mapping; this needs a platform with fork (Linux, macOS).
+
+FREE = -1
+
+def region_of(x, map_width, regions):
+    strip = -(-map_width // regions)
+    return np.clip((np.asarray(x) + EnemyManager.width // 2) // strip, 0, regions - 1).astype(np.int32)
+
+class SharedEnemyState:
+    def __init__(self, capacity):
+        fields = [(name, np.dtype(dtype)) for name, dtype in FIELDS.items() if name != 'slot']
+        fields += [('owner', np.dtype(np.int32)), ('next_owner', np.dtype(np.int32))]
+        # Widest types first keeps every array aligned
+        fields.sort(key=lambda field: -field[1].itemsize)
+        size = sum(capacity * dtype.itemsize for _, dtype in fields)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(1, size))
+        self.capacity = capacity
+        self.names = tuple(name for name, _ in fields if name not in ('owner', 'next_owner'))
+
+        offset = 0
+        for name, dtype in fields:
+            setattr(self, name, np.ndarray(capacity, dtype=dtype, buffer=self.memory.buf, offset=offset))
+            offset += capacity * dtype.itemsize
+        self.owner[:] = FREE
+        self.next_owner[:] = FREE
+
+    def close(self):
+        # Arrays must go before the buffer they view can be released
+        for name in self.names + ('owner', 'next_owner'):
+            setattr(self, name, None)
+        self.memory.close()
+        self.memory.unlink()
+
+class PlayerProxy:
+    # A player as seen by a worker: position and health from the tick message
+    __slots__ = ('index', 'x', 'y', 'health', 'rect')
+
+    def __init__(self, index):
+        self.index = index
+        self.x = self.y = self.health = 0
+        self.rect = None
+
+class StrikeCollector:
+    # Stands in for a CombatSystem in a worker; records (slot, player, damage)
+    def __init__(self, manager):
+        self.manager = manager
+        self.strikes = []
+
+    def emit(self, attacker, target, amount):
+        self.strikes.append((int(self.manager.slot[attacker.index]), target.index, amount))
+
+def load_region(manager, state, slots):
+    n = len(slots)
+    if manager.capacity < n:
+        manager.allocate(max(n, manager.capacity * 2))
+    for name in state.names:
+        getattr(manager, name)[:n] = getattr(state, name)[slots]
+    manager.slot[:n] = slots
+    manager.count = n
+
+    # Views only carry an index, so they're reused from tick to tick
+    views = manager.views
+    for i in range(len(views), n):
+        views.append(EnemyView(manager, i, None))
+    del views[n:]
+
+def run_region(conn, state, region, regions, walls, wall_rects, map_width, map_height, sheets, zoom_factor,
+               seed, pathfinding, separation, line_of_sight):
+    # Enemies only push apart from others in the same region
+    manager = EnemyManager(sheets, zoom_factor, seed=seed, separation=separation)
+    pathfinder = Pathfinder(wall_rects, map_width, map_height) if pathfinding else None
+    sight = LineOfSight(wall_rects, map_width, map_height) if line_of_sight else None
+    collector = StrikeCollector(manager)
+    proxies = []
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        time, dt, players = message
+
+        del proxies[len(players):]
+        for i in range(len(proxies), len(players)):
+            proxies.append(PlayerProxy(i))
+        for proxy, (x, y, health) in zip(proxies, players):
+            proxy.x, proxy.y, proxy.health = x, y, health
+            proxy.rect = pygame.Rect(x, y, 54, 64)
+
+        mine = np.flatnonzero(state.owner == region)
+        load_region(manager, state, mine)
+        if pathfinder is not None:
+            pathfinder.update([proxy for proxy in proxies if proxy.health > 0])
+        if sight is not None:
+            sight.begin_tick()
+        collector.strikes = []
+        manager.time = time - dt
+        manager.update(walls, proxies, dt, pathfinder, collector, sight)
+
+        n = manager.count
+        slots = manager.slot[:n]
+        for name in state.names:
+            getattr(state, name)[slots] = getattr(manager, name)[:n]
+        # Finished death animations were dropped by the update
+        freed = np.setdiff1d(mine, slots, assume_unique=True)
+        state.next_owner[freed] = FREE
+        state.next_owner[slots] = region_of(manager.x[:n], map_width, regions)
+        conn.send((collector.strikes, len(freed)))
+
+class RegionShards:
+    width, height = EnemyManager.width, EnemyManager.height
+    speed = EnemyManager.speed
+    save_every = EnemyManager.save_every
+
+    def __init__(self, sheets, walls, wall_rects, map_width, map_height, regions=2, capacity=1024, zoom_factor=3,
+                 store=None, seed=None, pathfinding=True, separation=True, line_of_sight=True):
+        walk, idle, attack, death, hurt = sheets
+        # Loaded before forking so the workers inherit them
+        self.frames = load_animation(walk, 96, 42, 8, zoom_factor)
+        self.idle_frames = load_animation(idle, 96, 42, 8, zoom_factor)
+        self.attack_frames = load_animation(attack, 96, 42, 8, zoom_factor)
+        self.death_frames = load_animation(death, 96, 42, 8, zoom_factor)
+
+        self.map_width = map_width
+        self.regions = regions
+        self.store = store
+        self.state = SharedEnemyState(capacity)
+        # EnemyView reads these as if this were an EnemyManager
+        for name in self.state.names:
+            setattr(self, name, getattr(self.state, name))
+        self.by_slot = [None] * capacity
+        self.views = []
+        self.time = 0.0
+        self.ticks = 0
+
+        seeds = np.random.SeedSequence(seed).spawn(regions)
+        context = multiprocessing.get_context('fork')
+        self.connections = []
+        self.workers = []
+        for region in range(regions):
+            parent, child = context.Pipe()
+            worker = context.Process(target=run_region, daemon=True,
+                                     args=(child, self.state, region, regions, walls, wall_rects, map_width,
+                                           map_height, sheets, zoom_factor, seeds[region], pathfinding,
+                                           separation, line_of_sight))
+            worker.start()
+            child.close()
+            self.connections.append(parent)
+            self.workers.append(worker)
+
+    def __len__(self):
+        return len(self.views)
+
+    def spawn(self, position, health=100, enemy_id=None):
+        state = self.state
+        free = np.flatnonzero(state.owner == FREE)
+        if not len(free):
+            return None
+        i = int(free[0])
+        for name in state.names:
+            getattr(state, name)[i] = 0
+        state.x[i], state.y[i] = position
+        state.health[i] = health
+        state.direction[i] = -1
+        # Ready to attack straight away, like Enemy
+        state.last_attack[i] = self.time - EnemyManager.attack_cooldown
+        state.owner[i] = state.next_owner[i] = region_of(position[0], self.map_width, self.regions)
+
+        view = self.by_slot[i] = EnemyView(self, i, enemy_id or f'enemy{next(_enemy_ids)}')
+        self.views.append(view)
+        if self.store is not None:
+            self.store.mark_dirty(view.enemy_id, view)
+        return view
+
+    @timed('enemy.update')
+    def update(self, players, dt):
+        # One tick on every worker at once; returns the hits enemies landed
+        # as (slot, player index, damage)
+        self.time += dt
+        message = (self.time, dt, [(player.x, player.y, player.health) for player in players])
+        for connection in self.connections:
+            connection.send(message)
+        strikes = []
+        freed = 0
+        for connection in self.connections:
+            region_strikes, region_freed = connection.recv()
+            strikes.extend(region_strikes)
+            freed += region_freed
+
+        state = self.state
+        state.owner[:] = state.next_owner
+        if freed:
+            by_slot = self.by_slot
+            # Update in place so World.enemies keeps pointing at this list
+            self.views[:] = [by_slot[i] for i in np.flatnonzero(state.owner != FREE)]
+
+        self.ticks += 1
+        if self.store is not None and self.ticks % self.save_every == 0:
+            for view in self.views:
+                self.store.mark_dirty(view.enemy_id, view)
+        return strikes
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+        for worker in self.workers:
+            worker.join()
+        for connection in self.connections:
+            connection.close()
+        self.views = []
+        self.by_slot = []
+        for name in self.state.names:
+            setattr(self, name, None)
+        self.state.close()
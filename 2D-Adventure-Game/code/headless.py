@@ -0,0 +1,199 @@
+import os
+import sys
+import random
+from time import perf_counter
+
+# Headless runner: same World and entity classes as main.py, but with SDL's
+# dummy video driver, no drawing and no frame cap, so the simulation steps as
+# fast as the CPU allows and every phase can be timed.
+
+GAME_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if GAME_ROOT not in sys.path:
+    sys.path.append(GAME_ROOT)
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+from config import MAP_FILE, TILE_SIZE, FIXED_DT
+from world import World
+from rendering.tilemap import map_size
+from mechanics.persistence import EntityStore
+
+MOVE_KEYS = (pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d)
+
+class ScriptedKeys:
+    # Stands in for pygame.key.get_pressed(): indexable by key constant
+    def __init__(self, pressed=()):
+        self.pressed = set(pressed)
+
+    def __getitem__(self, key):
+        return key in self.pressed
+
+class IdleInputs:
+    def __init__(self, rng):
+        self.keys = ScriptedKeys()
+
+    def __call__(self, tick):
+        return self.keys
+
+class RandomInputs:
+    # Walk in a random direction, changing every hold_ticks, attack now and
+    # then and respawn periodically if dead
+    def __init__(self, rng, hold_ticks=30, attack_chance=0.02):
+        self.rng = rng
+        self.hold_ticks = hold_ticks
+        self.attack_chance = attack_chance
+        self.held = set()
+
+    def __call__(self, tick):
+        rng = self.rng
+        if tick % self.hold_ticks == 0:
+            self.held = {rng.choice(MOVE_KEYS)} if rng.random() < 0.8 else set()
+        pressed = set(self.held)
+        if rng.random() < self.attack_chance:
+            pressed.add(pygame.K_o)
+        if tick % 600 == 0:
+            pressed.add(pygame.K_r)
+        return ScriptedKeys(pressed)
+
+INPUTS = {
+    'idle': IdleInputs,
+    'random': RandomInputs,
+}
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class HeadlessRunner:
+    PHASES = World.PHASES
+
+    def __init__(self, num_enemies=10, seed=0, inputs='random', vectorized=False, pathfinding=True, spawns=None,
+                 shards=0, lod=False, separation=True, line_of_sight=True, records=None):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        # Entities draw their wander decisions from the global random module
+        random.seed(seed)
+        # A name from INPUTS, or any callable taking the tick number and
+        # returning a key state (e.g. Recording.keys)
+        self.inputs = INPUTS[inputs](self.rng) if isinstance(inputs, str) else inputs
+
+        os.chdir(GAME_ROOT)
+        pygame.init()
+        pygame.display.set_mode((1, 1))
+
+        map_width, map_height = map_size(MAP_FILE, TILE_SIZE)
+        # Keep state in memory so benchmark runs don't touch the real save
+        # file; it is still written behind on its thread as in the game
+        self.store = EntityStore(':memory:')
+        # Saved entity state to start from, e.g. a recording's
+        if records:
+            self.store.write(records)
+        self.world = World(map_width, map_height, store=self.store, max_enemies=num_enemies, rng=self.rng,
+                           vectorized=vectorized, pathfinding=pathfinding, shards=shards, lod=lod,
+                           separation=separation, line_of_sight=line_of_sight)
+        self.world.add_player()
+        # Explicit spawn positions don't draw from the world's RNG
+        if spawns is None:
+            for _ in range(num_enemies):
+                self.world.spawn_enemy()
+        else:
+            for position in spawns:
+                self.world.spawn_enemy(position)
+
+        self.tick = 0
+        self.tick_times = []
+        self.phase_times = dict.fromkeys(self.PHASES, 0.0)
+        self.enemies_updated = 0
+
+    def step(self):
+        world = self.world
+        keys = self.inputs(self.tick)
+        phase_times = self.phase_times
+        last = start = perf_counter()
+
+        def phase_done(name):
+            nonlocal last
+            now = perf_counter()
+            phase_times[name] += now - last
+            last = now
+
+        # The game's own step, timed phase by phase
+        world.update(keys, FIXED_DT, on_phase=phase_done)
+        self.enemies_updated += world.enemies_updated
+        self.tick_times.append(perf_counter() - start)
+        self.tick += 1
+
+    def run(self, ticks):
+        for _ in range(ticks):
+            self.step()
+        return self.report()
+
+    def pathfinding_report(self, samples=20000):
+        pathfinder = self.world.pathfinder
+        if pathfinder is None:
+            return None
+        report = pathfinder.stats()
+
+        # Per-enemy lookup cost, measured on the enemies' current positions
+        players = [player for player in self.world.players if pathfinder.field_for(player) is not None]
+        positions = [enemy.rect.center for enemy in self.world.enemies]
+        if players and positions:
+            player = players[0]
+            count = len(positions)
+            start = perf_counter()
+            for i in range(samples):
+                pathfinder.step(player, *positions[i % count])
+            report['lookup_ns'] = (perf_counter() - start) * 1e9 / samples
+        return report
+
+    def report(self):
+        times = sorted(self.tick_times)
+        total = sum(times) or 1e-12
+        return {
+            'seed': self.seed,
+            'ticks': len(times),
+            'enemies': len(self.world.enemies),
+            'vectorized': self.world.enemy_manager is not None,
+            'shards': self.world.shards.regions if self.world.shards is not None else 0,
+            'lod': self.world.lod is not None,
+            'enemies_updated': self.enemies_updated / max(1, len(times)),
+            'walls': len(self.world.walls),
+            'ticks_per_sec': len(times) / total,
+            'p50_ms': percentile(times, 0.50) * 1000,
+            'p99_ms': percentile(times, 0.99) * 1000,
+            'max_ms': (times[-1] if times else 0.0) * 1000,
+            'phases_ms': {name: value * 1000 / max(1, len(times)) for name, value in self.phase_times.items()},
+            'pathfinding': self.pathfinding_report(),
+            'line_of_sight': self.world.sight.stats() if self.world.sight is not None else None,
+        }
+
+    def close(self):
+        # Flush first: the store reads enemy state the world is about to free
+        self.store.close()
+        self.world.close()
+        pygame.quit()
+
+def format_report(report):
+    lines = [
+        f"ticks={report['ticks']} enemies={report['enemies']} walls={report['walls']} seed={report['seed']}"
+        + (" (vectorized)" if report['vectorized'] else "")
+        + (f" ({report['shards']} shards)" if report.get('shards') else "")
+        + (f" (level of detail, {report['enemies_updated']:.1f} enemies updated/tick)" if report.get('lod') else ""),
+        f"  {report['ticks_per_sec']:.0f} ticks/s  p50 {report['p50_ms']:.3f} ms  p99 {report['p99_ms']:.3f} ms  max {report['max_ms']:.3f} ms",
+    ]
+    for name, value in report['phases_ms'].items():
+        lines.append(f"  {name:<10} {value:.4f} ms/tick")
+    paths = report.get('pathfinding')
+    if paths:
+        lookup = f"{paths['lookup_ns']:.0f} ns/lookup" if 'lookup_ns' in paths else "no lookups"
+        lines.append(f"  flow field {paths['recomputes']} rebuilds, {paths['recompute_ms']:.3f} ms each, "
+                     f"{lookup} ({paths['blocked_cells']}/{paths['cells']} cells blocked)")
+    sight = report.get('line_of_sight')
+    if sight:
+        lines.append(f"  sight      {sight['checks']} checks, {sight['hit_rate']:.0%} cached, {sight['traces']} traces "
+                     f"of {sight['tiles_per_trace']:.1f} tiles, {sight['trace_ns']:.0f} ns each "
+                     f"({sight['opaque_tiles']}/{sight['tiles']} tiles opaque)")
+    return '\n'.join(lines)
@@ -1,151 +1,286 @@
 import sys
 import os
 import json
+import time
+import random
+import argparse
 
+startTime = time.perf_counter()
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 os.environ['SDL_VIDEO_CENTERED'] = '1'
 
 import pygame
-from os.path import join
-from config import TILE_SIZE
-import pytmx
-from gameEntities.player import Player
-from gameEntities.enemy import Enemy
-from data.collisions import Collisions
-from mechanics.combat import base_move
-from random import randint
+from config import TILE_SIZE, FIXED_DT, VIEW_SIZE, REGION_BUDGET
+from rendering.foreground import draw_depth_sorted
+from rendering.streaming import RegionStreamer, load_layout, default_layout, world_size
+from rendering.bundle import load_bundle
+from rendering.dirty import DirtyRectRenderer
+from rendering.overlay import ProfilerOverlay
+from rendering.target import RenderTarget
+from rendering.ui import get_ui
+from mechanics.instrumentation import get_profiler
+from mechanics.persistence import get_store, EntityStore
+from mechanics.recording import Recording, state_digest
+from world import World, PLAYER_SPAWN
+from network.client import NetworkClient, RemoteWorld
+
+parser = argparse.ArgumentParser(description='2D adventure game')
+parser.add_argument('--connect', metavar='HOST:PORT', help='join a multiplayer server instead of playing locally')
+parser.add_argument('--dirty-rects', action='store_true',
+                    help='only repaint and present the parts of the window that changed (for software rendering)')
+parser.add_argument('--fps', type=int, default=60, help='render frame cap, 0 for uncapped (the simulation always runs at 60 Hz)')
+parser.add_argument('--profile', action='store_true', help='start with frame timing and the overlay on (F3 toggles)')
+parser.add_argument('--profile-frames', type=int, default=120, help='frames captured by cProfile when F5 is pressed')
+parser.add_argument('--profile-dump', metavar='PATH', help='write frame timings to PATH (.csv or .json) on exit')
+parser.add_argument('--record', metavar='PATH', help='record this session for code/replay.py (starts from a fresh state)')
+parser.add_argument('--seed', type=int, help='random seed, for repeatable sessions')
+parser.add_argument('--no-bundle', action='store_true', help='decode the PNGs instead of loading the asset bundle')
+parser.add_argument('--render-scale', type=int, default=1, metavar='N',
+                    help='compose the world at 1/N of the window size and upscale it (N divides the tile size)')
+parser.add_argument('--world', metavar='LAYOUT',
+                    help='play a world of several maps from a layout file, streaming regions in and out as you move')
+parser.add_argument('--region-budget', type=int, default=REGION_BUDGET // 2 ** 20, metavar='MIB',
+                    help='memory kept for loaded regions before distant ones are unloaded')
+args = parser.parse_args()
+if args.render_scale != 1 and args.dirty_rects:
+    parser.error('--dirty-rects needs the full-size window, not --render-scale')
+if args.world and (args.connect or args.record):
+    parser.error('--world is for local play; the server and replays use the single map')
 
 pygame.init()
 
-# TODO: implement socket programming for multiplayer
-
-WINDOW_WIDTH, WINDOW_HEIGHT = 1120, 640
+WINDOW_WIDTH, WINDOW_HEIGHT = VIEW_SIZE
 screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
 pygame.display.set_caption('Building a Game')
 
-baseMap = pygame.image.load(join('map', '2DAdventureGameV5.png')).convert_alpha()
-foreground = pygame.image.load(join('map', '2DAdventureGameForegroundV2.png')).convert_alpha()
-mapWidth, mapHeight = baseMap.get_size()
-print(mapWidth)
+# The world is drawn into target.surface, which is the window itself unless
+# --render-scale asks for a smaller one
+try:
+    target = RenderTarget(screen, args.render_scale)
+except ValueError as error:
+    parser.error(str(error))
+
+# Scaled and flipped frames, map chunks and collisions come pre-baked from
+# the asset bundle, which is (re)built here if missing or out of date. It
+# holds full-size art only, so a render scale decodes the PNGs instead.
+bundle = None if args.no_bundle else load_bundle()
+
+# The map is drawn in chunks straight from the Tiled layers, so only the
+# chunks around the camera are ever held as surfaces. The foreground is cut
+# into its non-empty tiles, which are depth-sorted with the sprites. Both
+# come from the regions the streamer has loaded around the view: the one
+# map, or with --world every map of the layout near the player, whose
+# walls are then streamed into the World as well.
+regions = load_layout(args.world) if args.world else default_layout()
+streamer = RegionStreamer(regions, target.tile_size, target.size, target.scale, bundle,
+                          budget=args.region_budget * 2 ** 20)
+baseMap, foreground = streamer.base, streamer.foreground
+collisionLayer = bundle.collision_layer() if bundle else None
+mapWidth, mapHeight = world_size(regions)
+dirtyRenderer = DirtyRectRenderer(screen, baseMap, foreground) if args.dirty_rects else None
+
+# F3 toggles timing and the overlay, F4 dumps the buffered timings to
+# CSV/JSON, F5 runs cProfile for --profile-frames frames
+profiler = get_profiler()
+profiler.set_enabled(args.profile)
+overlay = ProfilerOverlay(profiler)
+
+# Fonts, text, the dim overlay and health bars are cached here across frames
+ui = get_ui()
 
 clock = pygame.time.Clock()
 
-walls = []
-players = []
-enemies = [] 
-enemy_spawn_interval = 10000 
-time_since_last_enemy = 0
-
-player = Player( # TODO: add remaining sprites so players can choose a character
-    'base_walk_strip8.png',
-    'curlyhair_walk_strip8.png',
-    'base_idle_strip9.png',
-    'curlyhair_idle_strip9.png',
-    'base_attack_strip10.png',
-    'curlyhair_attack_strip10.png',
-    'base_death_strip13.png',
-    'curlyhair_death_strip13.png',
-    (3500, 2000),
-    zoom_factor=3
-)
-players.append(player)
-
-# Add the initial enemy
-initial_enemy = Enemy(
-    'skeleton_walk_strip8.png', 
-    'skeleton_idle_strip6.png', 
-    'skeleton_attack_strip7.png',
-    'skeleton_death_strip10.png',
-    'skeleton_hurt_strip7.png',
-    100, 
-    (2200, 1000), 
-    zoom_factor=3
-)
-enemies.append(initial_enemy)
+client = None
+recording = None
+if args.connect:
+    # The server owns the simulation; this process only sends inputs and
+    # draws the entities from its snapshots
+    host, _, port = args.connect.rpartition(':')
+    client = NetworkClient(host or '127.0.0.1', int(port))
+    client.start()
+    world = RemoteWorld(EntityStore(':memory:', flush_interval=0))
+    player = None
+else:
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    random.seed(seed)
+    if args.record:
+        # A replay can't load this save file, so a recorded session starts
+        # from a fresh in-memory state instead
+        world = World(mapWidth, mapHeight, store=EntityStore(':memory:', flush_interval=0),
+                      rng=random.Random(seed), interpolate=True, collision_layer=collisionLayer, lod=True)
+    elif args.world:
+        world = World(mapWidth, mapHeight, rng=random.Random(seed), interpolate=True, lod=True, streaming=True)
+        streamer.on_load = lambda region, walls, tiles: world.add_walls(region.name, walls, tiles, region.rect)
+        streamer.on_unload = lambda region: world.remove_walls(region.name)
+    else:
+        world = World(mapWidth, mapHeight, rng=random.Random(seed), interpolate=True, collision_layer=collisionLayer,
+                      lod=True)
+
+    # TODO: add remaining sprites so players can choose a character
+    player = world.add_player(PLAYER_SPAWN)
+
+    # Add the initial enemy
+    world.spawn_enemy((2200, 1000))
+    if args.record:
+        recording = Recording(seed, world.max_enemies, [(2200, 1000)], lod=True)
+
+players = world.players
 
 camera_x, camera_y = 0, 0
 
-map_width_tiles = mapWidth // TILE_SIZE 
+# Longest frame the simulation catches up on; anything beyond is dropped
+# rather than running hundreds of steps after a stall
+MAX_FRAME_TIME = 0.25
 
-collision_instance = Collisions(walls, TILE_SIZE, map_width_tiles)
+# Sprites are culled against the window plus a margin, so an interpolated
+# one can't pop in at the edge
+cullRect = screen.get_rect().inflate(2 * TILE_SIZE, 2 * TILE_SIZE)
 
 # Ensure value is within the min and max range
 def clamp(value, min_value, max_value):
     return max(min_value, min(value, max_value))
 
-def main():
-    global time_since_last_enemy
-
-    time = 0
-    lastAttackTime = 0
+def camera_for(player, dx=0, dy=0):
+    # Top-left of the view that follows `player`, drawn (dx, dy) behind it
+    camera_x = clamp(player.x - dx - WINDOW_WIDTH // 2, 0, mapWidth - WINDOW_WIDTH)
+    camera_y = clamp(player.y - dy - WINDOW_HEIGHT // 2, 0, mapHeight - WINDOW_HEIGHT)
+    return target.snap(camera_x, camera_y)
 
-    running = True
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-        keys = pygame.key.get_pressed()
-
-        # Player attack logic
-        if keys[pygame.K_o]:
-            if not player.isDead:
-                milliseconds = pygame.time.get_ticks()
-                time = int(milliseconds / 1000)
-                # player.attacking = True
-                if time >= lastAttackTime + 1.25:
-                    for enemy in enemies:
-                        base_move(player, [enemy])
-                        player.attack()
-                        lastAttackTimeMilli = pygame.time.get_ticks()
-                        lastAttackTime = int(lastAttackTimeMilli / 1000)
-
-        if keys[pygame.K_r]:
-            if player.isDead:
-                player.respawn((3500, 2000))
-
-        # Spawn new enemies
-        time_since_last_enemy += clock.get_time()
-        if len(enemies) < 4:
-            if time_since_last_enemy >= enemy_spawn_interval:
-                new_enemy = Enemy(
-                    'skeleton_walk_strip8.png', 'skeleton_idle_strip6.png', 
-                    'skeleton_attack_strip7.png', 'skeleton_death_strip10.png', 
-                    'skeleton_hurt_strip7.png', 100, (randint(0, mapWidth), randint(0, mapHeight)), 3
-                )
-                enemies.append(new_enemy)
-                time_since_last_enemy = 0
-
-        player.update(keys, walls)
-
-        for enemy in enemies[:]:  
-            if enemy.update(walls, players):  
-                enemies.remove(enemy)
+def on_screen(entities, camera_x, camera_y):
+    return [entity for entity in entities if entity.screen_rect(camera_x, camera_y).colliderect(cullRect)]
 
-        # Update camera position to follow player
-        camera_x = clamp(player.x - WINDOW_WIDTH // 2, 0, mapWidth - WINDOW_WIDTH)
-        camera_y = clamp(player.y - WINDOW_HEIGHT // 2, 0, mapHeight - WINDOW_HEIGHT)
+def handle_debug_key(key):
+    if key == pygame.K_F3:
+        profiler.set_enabled(not profiler.enabled)
+    elif key == pygame.K_F4:
+        name = time.strftime('profile-%Y%m%d-%H%M%S')
+        print('Wrote', profiler.dump(name + '.csv'), profiler.dump(name + '.json'))
+    elif key == pygame.K_F5:
+        profiler.start_capture(args.profile_frames, time.strftime('profile-%Y%m%d-%H%M%S.prof'))
 
-        screen.fill((255, 255, 255)) 
-        screen.blit(baseMap, (0, 0), pygame.Rect(camera_x, camera_y, WINDOW_WIDTH, WINDOW_HEIGHT))  # Draw the base map
+def main():
+    global player
 
-        font = pygame.font.Font(None, 72)
-        font2 = pygame.font.Font(None, 32)
+    if args.profile:
+        print(f"Startup took {(time.perf_counter() - startTime) * 1000:.0f} ms "
+              f"({'asset bundle' if bundle else 'decoding PNGs'})")
 
-        player.draw(screen, camera_x, camera_y)
+    if player is not None:
+        # The regions around the spawn point, before the first frame
+        streamer.update([pygame.Rect(camera_for(player), VIEW_SIZE)])
 
-        for enemy in enemies:
-            enemy.draw(screen, camera_x, camera_y)
+    running = True
+    accumulator = 0.0
+    previousTime = time.perf_counter()
+    while running:
+        currentTime = time.perf_counter()
+        accumulator += min(currentTime - previousTime, MAX_FRAME_TIME)
+        previousTime = currentTime
+
+        profiler.begin_frame()
+        with profiler.scope('events'):
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN:
+                    handle_debug_key(event.key)
+
+            keys = pygame.key.get_pressed()
+
+        if client:
+            client.send_input(keys)
+            world.apply(client.latest()[1], client.entity_id)
+            player = world.local_player
+            if player is None:
+                # No snapshot containing our player yet
+                profiler.end_frame()
+                clock.tick(args.fps)
+                continue
+            offset = None
+        else:
+            # Run as many fixed steps as real time has passed, then draw
+            # between the last two states
+            with profiler.scope('update'):
+                while accumulator >= FIXED_DT:
+                    if recording is not None:
+                        recording.record(keys)
+                    world.update(keys, FIXED_DT)
+                    accumulator -= FIXED_DT
+            alpha = accumulator / FIXED_DT
+            offset = lambda entity: world.draw_offset(entity, alpha)
 
-        screen.blit(foreground, (0, 0), pygame.Rect(camera_x, camera_y, WINDOW_WIDTH, WINDOW_HEIGHT))
+        # Update camera position to follow player
+        camera_x, camera_y = camera_for(player, *(offset(player) if offset else (0, 0)))
+
+        # Picks up regions the loader has finished and queues the ones the
+        # view is getting close to
+        with profiler.scope('streaming'):
+            streamer.update([pygame.Rect(camera_x, camera_y, WINDOW_WIDTH, WINDOW_HEIGHT)])
+
+        # Only enemies near a view are candidates, so this doesn't grow with
+        # the number of enemies on the map
+        with profiler.scope('draw.cull'):
+            sprites = players + on_screen(world.nearby_enemies(), camera_x, camera_y)
+
+        if dirtyRenderer and not player.isDead:
+            with profiler.scope('draw'):
+                rects = dirtyRenderer.render(camera_x, camera_y, sprites, offset=offset)
+            if profiler.enabled:
+                with profiler.scope('draw.overlay'):
+                    overlayRect = overlay.draw(screen)
+                rects.append(overlayRect)
+                dirtyRenderer.damage(overlayRect)
+            with profiler.scope('display.update'):
+                pygame.display.update(rects)
+            profiler.end_frame()
+            clock.tick(args.fps)
+            continue
+
+        with profiler.scope('draw.map'):
+            target.surface.fill((255, 255, 255))
+            baseMap.draw(target.surface, camera_x / target.scale, camera_y / target.scale)  # Draw the base map
+
+        with profiler.scope('draw.sprites'):
+            batch = []
+            for entity in sprites:
+                dx, dy = offset(entity) if offset else (0, 0)
+                batch.append((entity, (camera_x + dx, camera_y + dy)))
+            draw_depth_sorted(target.surface, batch, foreground, camera_x, camera_y)
+
+        if target.scale != 1:
+            with profiler.scope('draw.present'):
+                target.present()
 
         if player.isDead:
-            player.dim_background(screen)
-            player.display_death_message(screen, "You Died", "Press r to Respawn", font, font2, screen.get_width(), screen.get_height())
-
-        pygame.display.update()
-        clock.tick(60)
-
+            with profiler.scope('draw.ui'):
+                player.dim_background(screen)
+                player.display_death_message(screen, "You Died", "Press r to Respawn", ui.font(72), ui.font(32), screen.get_width(), screen.get_height())
+
+        if profiler.enabled:
+            with profiler.scope('draw.overlay'):
+                overlay.draw(screen)
+
+        if dirtyRenderer:
+            # The death overlay covers the whole window; start over once it's gone
+            dirtyRenderer.invalidate()
+
+        with profiler.scope('display.update'):
+            pygame.display.update()
+        profiler.end_frame()
+        clock.tick(args.fps)
+
+    streamer.close()
+    if client:
+        client.close()
+    elif recording is not None:
+        recording.digest = state_digest(world)
+        print('Wrote', recording.save(args.record), f'({len(recording)} ticks)')
+        world.store.close()
+    else:
+        # Flush any state still waiting on the write-behind thread
+        get_store().close()
+    if args.profile_dump:
+        profiler.dump(args.profile_dump)
     pygame.quit()
 
 if __name__ == "__main__":
@@ -1,54 +1,145 @@
 import pygame
-import json
+from mechanics.instrumentation import timed
 
-def base_move(self, enemies):
-    attack_hitbox_width = 70 
-    attack_hitbox_height = 50
-    attack_damage = 20
+# Attacks don't change health directly. Each hit becomes a DamageEvent in a
+# per-tick queue; resolve() applies all of them in one pass at the end of the
+# tick and then hands the events to the hooks (saving, animations). Hitboxes
+# are built once per attack and tested only against the entities in the grid
+# cells around them. The grid is rebuilt at most once per tick, on the first
+# attack, and shared by every attacker in that tick.
+
+ATTACK_HITBOX_WIDTH = 70
+ATTACK_HITBOX_HEIGHT = 50
+ATTACK_DAMAGE = 20
+
+def attack_hitbox(attacker, width=ATTACK_HITBOX_WIDTH, height=ATTACK_HITBOX_HEIGHT):
+    rect = attacker.rect
+    if not attacker.facing_left:
+        return pygame.Rect(rect.right, rect.top, width, height)
+    return pygame.Rect(rect.left - width, rect.top, width, height)
+
+class EntityGrid:
+    # Living entities bucketed by the cell holding their top-left corner, so
+    # a rebuild is one dict lookup per entity. Entities are smaller than a
+    # cell, so query() only has to widen the rect by one cell up and left.
+    def __init__(self, cell_size=128):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def build(self, teams):
+        cells = self.cells
+        cells.clear()
+        size = self.cell_size
+        for team, entities in teams.items():
+            for entity in entities:
+                if entity.health > 0:
+                    key = (int(entity.x) // size, int(entity.y) // size)
+                    bucket = cells.get(key)
+                    if bucket is None:
+                        cells[key] = [(entity, team)]
+                    else:
+                        bucket.append((entity, team))
+
+    def query(self, rect):
+        cells = self.cells
+        size = self.cell_size
+        found = []
+        for cx in range(rect.left // size - 1, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size - 1, (rect.bottom - 1) // size + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    found.extend(bucket)
+        return found
+
+class DamageEvent:
+    __slots__ = ('attacker', 'target', 'amount')
+
+    def __init__(self, attacker, target, amount):
+        self.attacker = attacker
+        self.target = target
+        self.amount = amount
+
+class CombatSystem:
+    def __init__(self, teams, cell_size=128):
+        # teams maps a team name to the live list of its entities, e.g.
+        # {'players': world.players, 'enemies': world.enemies}
+        self.teams = teams
+        self.index = EntityGrid(cell_size)
+        self.stale = True
+        self.events = []
+        self.hooks = []
+
+    def add_hook(self, hook):
+        # hook(events) runs after the tick's damage has been applied
+        self.hooks.append(hook)
+
+    def begin_tick(self):
+        # Entities move every tick; the index is rebuilt on the first attack
+        self.stale = True
+
+    def build_index(self):
+        self.index.build(self.teams)
+        self.stale = False
 
-    if not self.facing_left:
-        hitbox = pygame.Rect(self.rect.right, self.rect.top, attack_hitbox_width, attack_hitbox_height)
-    else:
-        hitbox = pygame.Rect(self.rect.left - attack_hitbox_width, self.rect.top, attack_hitbox_width, attack_hitbox_height)
+    def emit(self, attacker, target, amount):
+        self.events.append(DamageEvent(attacker, target, amount))
+
+    @timed('combat.attack')
+    def attack(self, attacker, team, damage=ATTACK_DAMAGE):
+        # Queue a hit on every living entity outside `team` the hitbox touches
+        if self.stale:
+            self.build_index()
+        hitbox = attack_hitbox(attacker)
+        hits = 0
+        for target, target_team in self.index.query(hitbox):
+            if target_team != team and hitbox.colliderect(target.rect):
+                self.emit(attacker, target, damage)
+                hits += 1
+        return hits
+
+    @timed('combat.resolve')
+    def resolve(self):
+        events = self.events
+        if not events:
+            return events
+        self.events = []
+
+        # Sum first so a target hit several times this tick changes once
+        totals = {}
+        for event in events:
+            totals[event.target] = totals.get(event.target, 0) + event.amount
+        for target, amount in totals.items():
+            target.health -= amount
+
+        for hook in self.hooks:
+            hook(events)
+        return events
+
+def save_targets(events):
+    # Persistence hook: one write-behind mark per damaged entity
+    for target in dict.fromkeys(event.target for event in events):
+        target.save()
+
+def start_attack_animations(events):
+    # Animation hook: attackers that landed a hit play their swing
+    for attacker in dict.fromkeys(event.attacker for event in events):
+        attacker.attack()
+
+# Immediate versions of a player's and an enemy's swing, for code that has
+# no CombatSystem to queue into
+
+def base_move(self, enemies):
+    hitbox = attack_hitbox(self)
 
     # Check for collisions with enemies
     for enemy in enemies:
         if hitbox.colliderect(enemy.rect):
-            enemy.health -= attack_damage
-            # update_health_json(enemy)
-
-
-# If further developed improve this function to simplify code in the player and enemy classes
+            enemy.health -= ATTACK_DAMAGE
 
 def enemy_move(self, players):
-    attack_hitbox_width = 70 
-    attack_hitbox_height = 50
-    attack_damage = 20
-
-    if not self.facing_left:
-        hitbox = pygame.Rect(self.rect.right, self.rect.top, attack_hitbox_width, attack_hitbox_height)
-    else:
-        hitbox = pygame.Rect(self.rect.left - attack_hitbox_width, self.rect.top, attack_hitbox_width, attack_hitbox_height)
+    hitbox = attack_hitbox(self)
 
     # Check for collisions with players
     for player in players:
         if hitbox.colliderect(player.rect):
-            player.health -= attack_damage
-            # update_health_json(player)
-
-def update_health_json(entity):
-    entity_data = {
-        "alive": "true",
-        "id": "enemy1",
-        "position": {
-            "x": entity.x,
-            "y": entity.y
-        },
-        "stats": {
-            "speed": 3,
-            "health": entity.health
-        }
-    }
-    
-    with open(f'{"enemy1"}.json', 'w') as file:
-        json.dump(entity_data, file, indent=4)
+            player.health -= ATTACK_DAMAGE
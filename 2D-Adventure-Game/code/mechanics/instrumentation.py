@@ -0,0 +1,191 @@
+import csv
+import json
+import pstats
+import cProfile
+from functools import wraps
+from time import perf_counter
+
+# Frame-time instrumentation. Code marks phases with named scopes
+#   with get_profiler().scope('draw.map'): ...
+# or the @timed('player.update') decorator. Time spent in each scope is
+# summed per frame and kept in a ring buffer of the last `capacity` frames.
+# While disabled a scope is a shared no-op object, so instrumented code
+# costs one attribute check per call.
+
+class _NullScope:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SCOPE = _NullScope()
+
+class Scope:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        current = self.profiler.current
+        current[self.name] = current.get(self.name, 0.0) + perf_counter() - self.start
+        return False
+
+class Instrumentation:
+    def __init__(self, capacity=600, enabled=False):
+        self.capacity = capacity
+        self.enabled = enabled
+        self.scopes = {}
+        self.current = {}
+        self.frame_start = None
+
+        # Ring buffers, all indexed by frame % capacity
+        self.frame_times = [0.0] * capacity
+        self.phases = {}
+        self.frames = 0
+        self.counters = {}
+
+        self.capture = None
+        self.capture_frames = 0
+        self.capture_path = None
+
+    def scope(self, name):
+        if not self.enabled:
+            return NULL_SCOPE
+        scope = self.scopes.get(name)
+        if scope is None:
+            scope = self.scopes[name] = Scope(self, name)
+        return scope
+
+    def count(self, name, value):
+        # Gauges such as entity or wall counts, shown next to the timings
+        if self.enabled:
+            self.counters[name] = value
+
+    def begin_frame(self):
+        if self.enabled:
+            self.current.clear()
+            self.frame_start = perf_counter()
+
+    def end_frame(self):
+        if self.capture is not None:
+            self.capture_frames -= 1
+            if self.capture_frames <= 0:
+                self.finish_capture()
+        if not self.enabled or self.frame_start is None:
+            return
+
+        index = self.frames % self.capacity
+        self.frame_times[index] = perf_counter() - self.frame_start
+        current = self.current
+        for name, times in self.phases.items():
+            times[index] = current.get(name, 0.0)
+        for name in current:
+            if name not in self.phases:
+                times = self.phases[name] = [0.0] * self.capacity
+                times[index] = current[name]
+        self.frames += 1
+        self.frame_start = None
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        self.frame_start = None
+
+    def reset(self):
+        self.frame_times = [0.0] * self.capacity
+        self.phases = {}
+        self.frames = 0
+        self.counters = {}
+
+    def recent(self, values=None):
+        # Buffered values, oldest first
+        values = self.frame_times if values is None else values
+        if self.frames < self.capacity:
+            return values[:self.frames]
+        index = self.frames % self.capacity
+        return values[index:] + values[:index]
+
+    def summary(self):
+        # phase -> (avg, p99, max) in milliseconds over the buffered frames
+        result = {}
+        for name, values in [('frame', self.frame_times)] + sorted(self.phases.items()):
+            times = sorted(self.recent(values))
+            if not times:
+                continue
+            result[name] = (sum(times) * 1000 / len(times),
+                            times[min(len(times) - 1, int(len(times) * 0.99))] * 1000,
+                            times[-1] * 1000)
+        return result
+
+    def dump(self, path):
+        # .json gets per-frame rows plus the summary and counters, anything
+        # else is written as CSV with one row per frame
+        names = sorted(self.phases)
+        columns = [self.recent()] + [self.recent(self.phases[name]) for name in names]
+        first = self.frames - len(columns[0])
+        rows = [[first + i] + [round(values[i] * 1000, 4) for values in columns] for i in range(len(columns[0]))]
+
+        if path.endswith('.json'):
+            data = {
+                'columns': ['frame', 'frame_ms'] + [f'{name}_ms' for name in names],
+                'frames': rows,
+                'summary': {name: dict(zip(('avg_ms', 'p99_ms', 'max_ms'), values))
+                            for name, values in self.summary().items()},
+                'counters': self.counters,
+            }
+            with open(path, 'w') as file:
+                json.dump(data, file, indent=1)
+        else:
+            with open(path, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(['frame', 'frame_ms'] + [f'{name}_ms' for name in names])
+                writer.writerows(rows)
+        return path
+
+    def start_capture(self, frames, path='profile.prof'):
+        # Run cProfile over the next `frames` frames; works with scopes disabled
+        if self.capture is not None:
+            return False
+        self.capture_frames = frames
+        self.capture_path = path
+        self.capture = cProfile.Profile()
+        self.capture.enable()
+        return True
+
+    def finish_capture(self):
+        capture, self.capture = self.capture, None
+        capture.disable()
+        capture.dump_stats(self.capture_path)
+        print(f'Profile written to {self.capture_path}')
+        pstats.Stats(capture).sort_stats('cumulative').print_stats(20)
+
+_default_profiler = None
+
+def get_profiler():
+    global _default_profiler
+    if _default_profiler is None:
+        _default_profiler = Instrumentation()
+    return _default_profiler
+
+def timed(name):
+    # Decorator form of scope() on the default profiler. The scope object is
+    # bound once, so the disabled path is a single attribute check
+    profiler = get_profiler()
+    scope = profiler.scopes.get(name) or profiler.scopes.setdefault(name, Scope(profiler, name))
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with scope:
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
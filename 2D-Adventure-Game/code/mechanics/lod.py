@@ -0,0 +1,66 @@
+import numpy as np
+import pygame
+from config import VIEW_SIZE
+
+# Level of detail for enemies. Each tick the view around every player (the
+# window main.py shows, clamped to the map the same way, plus a margin) is
+# worked out, and every enemy gets an update period from its distance to the
+# nearest view: inside it every tick, then every 2, 4 and 8 ticks one band
+# further out. Enemies in the same band are spread over the ticks by a
+# per-enemy phase, so a crowd doesn't all update on the same tick.
+#
+# Inside the view nothing changes. Further out AI and wandering run less
+# often and idle/walk animations stand still, which nobody can see; attack
+# cooldowns are on the simulation clock so they don't drift, and each update
+# moves an enemy as far as the ticks it skipped would have, so the
+# population walks at full speed. Only enemies inside a view are drawn.
+
+PERIODS = (1, 2, 4, 8)
+MAX_PERIOD = PERIODS[-1]
+
+class LevelOfDetail:
+    def __init__(self, map_width, map_height, view_size=VIEW_SIZE, margin=320, band=512):
+        # margin covers a whole enemy frame (288x126, drawn from its top-left)
+        # and the way the camera leads or lags at the map edges
+        self.map_width = map_width
+        self.map_height = map_height
+        self.view_size = view_size
+        self.margin = margin
+        self.band = band
+        self.views = []
+        self.bounds = np.zeros((0, 4))
+
+    def update_views(self, players):
+        width, height = self.view_size
+        views = []
+        for player in players:
+            camera_x = max(0, min(player.x - width // 2, self.map_width - width))
+            camera_y = max(0, min(player.y - height // 2, self.map_height - height))
+            views.append(pygame.Rect(camera_x, camera_y, width, height).inflate(2 * self.margin, 2 * self.margin))
+        self.views = views
+        self.bounds = np.array([[view.left, view.top, view.right, view.bottom] for view in views],
+                               dtype=np.float64).reshape(-1, 4)
+
+    def period(self, x, y):
+        # Update period of an enemy at (x, y)
+        if not self.views:
+            return MAX_PERIOD
+        distance = min(max(view.left - x, x - view.right, view.top - y, y - view.bottom, 0) for view in self.views)
+        if distance == 0:
+            return 1
+        return PERIODS[min(len(PERIODS) - 1, 1 + int(distance // self.band))]
+
+    def periods(self, x, y):
+        # period() for arrays of positions
+        bounds = self.bounds
+        if not len(bounds):
+            return np.full(len(x), MAX_PERIOD, dtype=np.int64)
+        x, y = x[:, None], y[:, None]
+        distance = np.maximum.reduce([bounds[:, 0] - x, x - bounds[:, 2], bounds[:, 1] - y, y - bounds[:, 3],
+                                      np.zeros((len(x), len(bounds)))]).min(axis=1)
+        band = np.where(distance > 0, 1 + distance // self.band, 0)
+        return np.asarray(PERIODS)[np.minimum(band, len(PERIODS) - 1).astype(np.int64)]
+
+def next_tick(tick, period, phase):
+    # First tick after `tick` on which an enemy with this phase is due
+    return tick + period - (tick + phase) % period
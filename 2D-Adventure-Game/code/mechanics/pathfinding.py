@@ -0,0 +1,186 @@
+import heapq
+import numpy as np
+from math import sqrt
+from time import perf_counter
+from mechanics.instrumentation import timed
+
+# Flow-field pathfinding for chasing enemies. The collision walls are
+# rasterised once into a walkability grid; for each player a bounded Dijkstra
+# from the player's cell records, for every reachable cell, which neighbour
+# to step to next. The field is only rebuilt when the player enters a new
+# cell, so any number of enemies can look up their next step in O(1).
+
+# (dx, dy, cost) for the 8 neighbours
+NEIGHBOURS = (
+    (1, 0, 1.0), (-1, 0, 1.0), (0, 1, 1.0), (0, -1, 1.0),
+    (1, 1, sqrt(2)), (1, -1, sqrt(2)), (-1, 1, sqrt(2)), (-1, -1, sqrt(2)),
+)
+
+class WalkabilityGrid:
+    def __init__(self, walls, map_width, map_height, cell_size=32, body=(54, 64)):
+        self.cell_size = cell_size
+        self.cols = -(-map_width // cell_size)
+        self.rows = -(-map_height // cell_size)
+        self.body = body
+        self.blocked = np.zeros((self.rows, self.cols), dtype=bool)
+        self.rasterise(walls, 0, 0, self.cols, self.rows)
+        self.walkable = [[not b for b in row] for row in self.blocked.tolist()]
+
+    def rasterise(self, walls, c0, r0, c1, r1):
+        # A cell is blocked when an entity-sized rect centred on it would
+        # overlap a wall, so paths never squeeze through gaps an enemy can't fit
+        half_w, half_h = self.body[0] / 2, self.body[1] / 2
+        cell_size = self.cell_size
+        blocked = self.blocked
+        for wall in walls:
+            left = wall[0] - half_w
+            top = wall[1] - half_h
+            right = wall[0] + wall[2] + half_w
+            bottom = wall[1] + wall[3] + half_h
+            # Cells whose centre lies strictly inside the inflated wall
+            wc0 = max(c0, int(np.floor(left / cell_size - 0.5)) + 1)
+            wr0 = max(r0, int(np.floor(top / cell_size - 0.5)) + 1)
+            wc1 = min(c1, int(np.ceil(right / cell_size - 0.5)))
+            wr1 = min(r1, int(np.ceil(bottom / cell_size - 0.5)))
+            if wc0 < wc1 and wr0 < wr1:
+                blocked[wr0:wr1, wc0:wc1] = True
+
+    def update_area(self, walls, area):
+        # Recomputes the cells around `area` (a world rect) after walls in it
+        # were added or removed; walls block a body's size beyond their edges
+        size = self.cell_size
+        width, height = self.body
+        c0, r0 = max(0, (area[0] - width) // size), max(0, (area[1] - height) // size)
+        c1 = min(self.cols, -(-(area[0] + area[2] + width) // size))
+        r1 = min(self.rows, -(-(area[1] + area[3] + height) // size))
+        if c0 >= c1 or r0 >= r1:
+            return
+        self.blocked[r0:r1, c0:c1] = False
+        self.rasterise(walls, c0, r0, c1, r1)
+        for row in range(r0, r1):
+            self.walkable[row][c0:c1] = [not b for b in self.blocked[row, c0:c1].tolist()]
+
+    def cell_of(self, x, y):
+        return int(x) // self.cell_size, int(y) // self.cell_size
+
+    def in_bounds(self, col, row):
+        return 0 <= col < self.cols and 0 <= row < self.rows
+
+class FlowField:
+    def __init__(self, grid, radius=512):
+        self.grid = grid
+        self.max_cost = radius / grid.cell_size
+        self.target = None
+        # cell -> (step_x, step_y); a step of (0, 0) marks the target cell
+        self.steps = {}
+        self.step_x = np.zeros((grid.rows, grid.cols), dtype=np.int8)
+        self.step_y = np.zeros((grid.rows, grid.cols), dtype=np.int8)
+        self.reached = np.zeros((grid.rows, grid.cols), dtype=bool)
+
+    def update(self, x, y):
+        # Returns True if the field had to be rebuilt
+        target = self.grid.cell_of(x, y)
+        if target == self.target:
+            return False
+        self.target = target
+        self.rebuild(target)
+        return True
+
+    def rebuild(self, target):
+        grid = self.grid
+        walkable = grid.walkable
+        cols, rows = grid.cols, grid.rows
+
+        # Clear only the cells the previous field touched
+        for col, row in self.steps:
+            self.reached[row, col] = False
+            self.step_x[row, col] = 0
+            self.step_y[row, col] = 0
+        steps = {}
+        if not grid.in_bounds(*target):
+            self.steps = steps
+            return
+
+        max_cost = self.max_cost
+        cost = {target: 0.0}
+        steps[target] = (0, 0)
+        queue = [(0.0, target)]
+        while queue:
+            current_cost, cell = heapq.heappop(queue)
+            if current_cost > cost[cell]:
+                continue
+            col, row = cell
+            for dx, dy, step_cost in NEIGHBOURS:
+                ncol, nrow = col + dx, row + dy
+                if not (0 <= ncol < cols and 0 <= nrow < rows) or not walkable[nrow][ncol]:
+                    continue
+                # No cutting corners past a blocked cell
+                if dx and dy and not (walkable[row][ncol] and walkable[nrow][col]):
+                    continue
+                new_cost = current_cost + step_cost
+                if new_cost > max_cost:
+                    continue
+                neighbour = (ncol, nrow)
+                if new_cost < cost.get(neighbour, float('inf')):
+                    cost[neighbour] = new_cost
+                    # Flow runs back towards the cell we came from
+                    steps[neighbour] = (-dx, -dy)
+                    heapq.heappush(queue, (new_cost, neighbour))
+
+        for (col, row), (sx, sy) in steps.items():
+            self.reached[row, col] = True
+            self.step_x[row, col] = sx
+            self.step_y[row, col] = sy
+        self.steps = steps
+
+    def step(self, x, y):
+        # Next step (each of -1, 0, 1) from the cell containing (x, y), or
+        # None if that cell is outside the field
+        return self.steps.get((int(x) // self.grid.cell_size, int(y) // self.grid.cell_size))
+
+class Pathfinder:
+    def __init__(self, walls, map_width, map_height, cell_size=32, radius=512):
+        self.walls = walls
+        self.grid = WalkabilityGrid(walls, map_width, map_height, cell_size)
+        self.radius = radius
+        self.fields = {}
+        self.recomputes = 0
+        self.recompute_time = 0.0
+
+    @timed('pathfinding')
+    def update(self, players):
+        # Rebuild each player's field if they changed cell since last tick
+        for player in players:
+            field = self.fields.get(player)
+            if field is None:
+                field = self.fields[player] = FlowField(self.grid, self.radius)
+            center_x, center_y = player.rect.center
+            start = perf_counter()
+            if field.update(center_x, center_y):
+                self.recompute_time += perf_counter() - start
+                self.recomputes += 1
+        if len(self.fields) > len(players):
+            for player in [p for p in self.fields if p not in players]:
+                del self.fields[player]
+
+    def walls_changed(self, area):
+        # Walls inside `area` were added or removed: update the grid there
+        # and rebuild every field on the next update
+        self.grid.update_area(self.walls, area)
+        for field in self.fields.values():
+            field.target = None
+
+    def field_for(self, player):
+        return self.fields.get(player)
+
+    def step(self, player, x, y):
+        field = self.fields.get(player)
+        return field.step(x, y) if field is not None else None
+
+    def stats(self):
+        return {
+            'cells': self.grid.cols * self.grid.rows,
+            'blocked_cells': int(self.grid.blocked.sum()),
+            'recomputes': self.recomputes,
+            'recompute_ms': self.recompute_time * 1000 / max(1, self.recomputes),
+        }
@@ -0,0 +1,146 @@
+import atexit
+import json
+import sqlite3
+import threading
+from config import SAVE_FILE, SAVE_INTERVAL
+from mechanics.instrumentation import timed
+
+# Write-behind store for entity state. Entities mark themselves dirty every
+# frame (a dict assignment). Every flush_interval seconds a background thread
+# asks for a snapshot; the simulation takes it in end_tick(), on its own
+# thread between ticks, so no entity is read halfway through an update, and
+# the background thread only encodes the records and writes them to SQLite
+# in one transaction.
+# A store backed by a file also reads the <id>.json saves written before it
+# existed; an in-memory one (benchmarks, replays, the server) starts empty.
+
+class EntityStore:
+    def __init__(self, path=SAVE_FILE, flush_interval=SAVE_INTERVAL, legacy=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.legacy = path != ':memory:' if legacy is None else legacy
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db_lock = threading.Lock()
+        with self.db_lock:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS entities (id TEXT PRIMARY KEY, data TEXT NOT NULL)')
+            self.db.commit()
+
+        self.dirty = {}
+        self.dirty_lock = threading.Lock()
+        # Records snapshotted by end_tick() and not yet written
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.snapshot_due = threading.Event()
+        self.snapshot_ready = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.closed = False
+        self.flush_count = 0
+        self.rows_written = 0
+
+    def start(self):
+        if self.thread is None and self.flush_interval:
+            self.thread = threading.Thread(target=self.run, name='entity-store', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.snapshot_due.set()
+            while not self.snapshot_ready.wait(0.1):
+                if self.stop_event.is_set():
+                    return
+            self.snapshot_ready.clear()
+            self.write_pending()
+
+    @timed('store.mark_dirty')
+    def mark_dirty(self, entity_id, entity):
+        # Entities are snapshotted with to_record() when a flush is due, so
+        # only the latest state of each one is ever written
+        with self.dirty_lock:
+            self.dirty[entity_id] = entity
+        if self.thread is None:
+            self.start()
+
+    def end_tick(self):
+        # Called by the simulation between ticks
+        if self.snapshot_due.is_set():
+            self.snapshot_due.clear()
+            self.snapshot()
+            self.snapshot_ready.set()
+
+    def snapshot(self):
+        with self.dirty_lock:
+            dirty, self.dirty = self.dirty, {}
+        records = {entity_id: entity.to_record() for entity_id, entity in dirty.items()}
+        with self.pending_lock:
+            self.pending.update(records)
+
+    def load(self, entity_id):
+        with self.dirty_lock:
+            entity = self.dirty.get(entity_id)
+        if entity is not None:
+            return entity.to_record()
+        with self.pending_lock:
+            record = self.pending.get(entity_id)
+        if record is not None:
+            return record
+
+        with self.db_lock:
+            row = self.db.execute('SELECT data FROM entities WHERE id = ?', (entity_id,)).fetchone()
+        if row:
+            return json.loads(row[0])
+        return load_legacy_json(entity_id) if self.legacy else None
+
+    def flush(self):
+        # Snapshot and write everything now; only from the simulation's thread
+        self.snapshot()
+        return self.write_pending()
+
+    def write_pending(self):
+        with self.pending_lock:
+            if not self.pending:
+                return 0
+            records, self.pending = self.pending, {}
+        written = self.write(records)
+        self.flush_count += 1
+        return written
+
+    def write(self, records):
+        # entity id -> record, stored as is (e.g. the state a replay starts from)
+        rows = [(entity_id, json.dumps(record, separators=(',', ':'))) for entity_id, record in records.items()]
+        with self.db_lock:
+            self.db.executemany('INSERT OR REPLACE INTO entities (id, data) VALUES (?, ?)', rows)
+            self.db.commit()
+        self.rows_written += len(rows)
+        return len(rows)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+        with self.db_lock:
+            self.db.close()
+
+_default_store = None
+
+def get_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = EntityStore()
+        atexit.register(_default_store.close)
+    return _default_store
+
+def load_legacy_json(entity_id):
+    # Saves written before the store existed
+    try:
+        with open(f'{entity_id}.json', 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,110 @@
+import json
+import struct
+import zlib
+from network.protocol import encode_keys, KeyState
+
+# Input recordings for replaying a session tick for tick. A recording holds
+# everything the simulation reads that isn't in the code: the RNG seed, the
+# enemy cap, where the starting enemies were spawned, the saved entity
+# records the session started from, and one byte of key bits per fixed step
+# (the same bits the network protocol sends). Replayed with the same seed, a
+# World goes through exactly the same states, so the digest of the final
+# state recorded alongside can be checked.
+#
+# File layout: header, spawn positions, starting records (length-prefixed
+# JSON, from version 2), zlib-compressed key bytes.
+
+MAGIC = b'ADVR'
+VERSION = 2
+# magic, version, flags, seed, max enemies, spawn count, ticks, final digest
+HEADER = struct.Struct('!4sBBIHHII')
+SPAWN = struct.Struct('!ii')
+RECORDS = struct.Struct('!I')
+
+VECTORIZED = 1
+NO_PATHFINDING = 2
+LEVEL_OF_DETAIL = 4
+
+class Recording:
+    def __init__(self, seed, max_enemies, spawns=(), vectorized=False, pathfinding=True, masks=b'', digest=0,
+                 lod=False, records=None):
+        self.seed = seed
+        self.max_enemies = max_enemies
+        self.spawns = [tuple(position) for position in spawns]
+        self.vectorized = vectorized
+        self.pathfinding = pathfinding
+        self.lod = lod
+        # entity id -> saved record, loaded into the replay's store first
+        self.records = dict(records or {})
+        self.masks = bytearray(masks)
+        self.digest = digest
+
+    def record(self, keys):
+        self.masks.append(encode_keys(keys))
+
+    def keys(self, tick):
+        # Past the end of the recording nothing is pressed
+        return KeyState(self.masks[tick] if tick < len(self.masks) else 0)
+
+    def __len__(self):
+        return len(self.masks)
+
+    def to_bytes(self):
+        flags = ((VECTORIZED if self.vectorized else 0) | (0 if self.pathfinding else NO_PATHFINDING)
+                 | (LEVEL_OF_DETAIL if self.lod else 0))
+        header = HEADER.pack(MAGIC, VERSION, flags, self.seed, self.max_enemies, len(self.spawns),
+                             len(self.masks), self.digest)
+        spawns = b''.join(SPAWN.pack(int(x), int(y)) for x, y in self.spawns)
+        records = json.dumps(self.records, sort_keys=True, separators=(',', ':')).encode()
+        return header + spawns + RECORDS.pack(len(records)) + records + zlib.compress(bytes(self.masks), 9)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < HEADER.size:
+            raise ValueError('recording is truncated')
+        magic, version, flags, seed, max_enemies, spawn_count, ticks, digest = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('not an input recording')
+        if version not in (1, VERSION):
+            raise ValueError(f'unsupported recording version {version}')
+        offset = HEADER.size
+        if len(data) < offset + spawn_count * SPAWN.size:
+            raise ValueError('recording is truncated')
+        spawns = [SPAWN.unpack_from(data, offset + i * SPAWN.size) for i in range(spawn_count)]
+        offset += spawn_count * SPAWN.size
+        records = {}
+        if version >= 2:
+            if len(data) < offset + RECORDS.size:
+                raise ValueError('recording is truncated')
+            (length,) = RECORDS.unpack_from(data, offset)
+            offset += RECORDS.size
+            try:
+                records = json.loads(data[offset:offset + length])
+            except ValueError as error:
+                raise ValueError(f'corrupt starting records: {error}') from None
+            offset += length
+        try:
+            masks = zlib.decompress(data[offset:])
+        except zlib.error as error:
+            raise ValueError(f'corrupt key data: {error}') from None
+        if len(masks) != ticks:
+            raise ValueError(f'expected {ticks} ticks, found {len(masks)}')
+        return cls(seed, max_enemies, spawns, bool(flags & VECTORIZED), not flags & NO_PATHFINDING, masks, digest,
+                   bool(flags & LEVEL_OF_DETAIL), records)
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(self.to_bytes())
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            return cls.from_bytes(file.read())
+
+def state_digest(world):
+    # CRC of every entity's position and health, in update order
+    crc = 0
+    for entity in list(world.players) + list(world.enemies):
+        crc = zlib.crc32(struct.pack('!ddi', entity.x, entity.y, int(entity.health)), crc)
+    return crc
@@ -0,0 +1,67 @@
+import numpy as np
+import pygame
+from config import TILE_SIZE
+
+# The parts of a streamed world whose walls the World currently has. An
+# enemy is only simulated while its rect, widened by a margin, lies inside
+# them; any other enemy is frozen where it stands (no AI, movement or
+# animation, and its clock stops) until its surroundings are loaded again.
+# Without this an enemy could walk through a region with no walls and be
+# left inside one when the region loads. Enemies frozen this way cost a
+# rect check per tick and nothing else, however large the world is.
+#
+# The margin covers the furthest an update can move an enemy (a few
+# pixels a tick, times the longest level of detail period) and the push
+# separation gives it, so an active enemy never reaches a region whose
+# walls are missing before its next check.
+
+class ResidentAreas:
+    def __init__(self, margin=TILE_SIZE):
+        self.margin = margin
+        self.areas = {}
+        self.bounds = np.zeros((0, 4))
+
+    def add(self, name, rect):
+        self.areas[name] = pygame.Rect(rect)
+        self.changed()
+
+    def remove(self, name):
+        if self.areas.pop(name, None) is not None:
+            self.changed()
+
+    def changed(self):
+        self.bounds = np.array([[area.left, area.top, area.right, area.bottom] for area in self.areas.values()],
+                               dtype=np.float64).reshape(-1, 4)
+
+    def contains(self, x, y):
+        # True if (x, y) is in a resident area
+        return any(area.collidepoint(x, y) for area in self.areas.values())
+
+    def active(self, rect):
+        # True if an enemy with this rect is simulated: each corner of the
+        # widened rect is in a resident area. Regions are bigger than an
+        # enemy, so that covers the whole rect
+        left, top = rect.left - self.margin, rect.top - self.margin
+        right, bottom = rect.right + self.margin - 1, rect.bottom + self.margin - 1
+        return all(self.contains(x, y) for x, y in ((left, top), (right, top), (left, bottom), (right, bottom)))
+
+    def active_mask(self, x, y, width, height):
+        # active() for arrays of rects with their top-left at (x, y)
+        bounds = self.bounds
+        if not len(bounds):
+            return np.zeros(len(x), dtype=bool)
+        left, top = x - self.margin, y - self.margin
+        right, bottom = x + width + self.margin - 1, y + height + self.margin - 1
+        mask = np.ones(len(x), dtype=bool)
+        for corner_x, corner_y in ((left, top), (right, top), (left, bottom), (right, bottom)):
+            corner_x, corner_y = corner_x[:, None], corner_y[:, None]
+            mask &= ((bounds[:, 0] <= corner_x) & (corner_x < bounds[:, 2]) &
+                     (bounds[:, 1] <= corner_y) & (corner_y < bounds[:, 3])).any(axis=1)
+        return mask
+
+    def random_position(self, rng):
+        # A position inside a random resident area, or None if there are none
+        if not self.areas:
+            return None
+        area = self.areas[rng.choice(sorted(self.areas))]
+        return rng.randint(area.left, area.right - 1), rng.randint(area.top, area.bottom - 1)
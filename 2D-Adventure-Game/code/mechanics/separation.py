@@ -0,0 +1,98 @@
+import numpy as np
+from data.collisions import sweep
+from mechanics.instrumentation import timed
+
+# Crowd separation. After enemies move, every pair closer than RADIUS
+# (between their top-left corners, which for same-sized rects is the
+# distance between centres) pushes both apart, so a crowd chasing a player
+# forms a ring around them instead of stacking onto one spot. Pairs are
+# found through a spatial hash with RADIUS-sized cells rebuilt each tick:
+# an enemy is only compared with the enemies in its own and the eight
+# surrounding cells, so the cost grows with the number of enemies and how
+# crowded they are, not with every pair. Pushes are whole pixels, at most
+# MAX_PUSH a tick, and never leave an enemy inside a wall.
+
+RADIUS = 40
+MAX_PUSH = 2
+
+def separation(x, y, radius=RADIUS, max_push=MAX_PUSH):
+    # (push_x, push_y) arrays for enemies at (x, y)
+    n = len(x)
+    push_x = np.zeros(n)
+    push_y = np.zeros(n)
+    if n < 2:
+        return push_x, push_y
+
+    # Cell keys, shifted so every neighbouring cell has a key in range. The
+    # cells are dense (counts and first index per cell, in key order), which
+    # for positions on the map is a few thousand entries
+    col = (x // radius).astype(np.int64)
+    row = (y // radius).astype(np.int64)
+    col -= col.min() - 1
+    row -= row.min() - 1
+    width = int(col.max()) + 2
+    keys = row * width + col
+    order = np.argsort(keys, kind='stable')
+    counts = np.bincount(keys, minlength=(int(row.max()) + 2) * width)
+    starts = np.cumsum(counts) - counts
+
+    # Every (enemy, neighbour) pair from the 3x3 cells around the enemy
+    firsts = []
+    seconds = []
+    indices = np.arange(n)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            target = keys + dy * width + dx
+            start = starts[target]
+            count = counts[target]
+            total = int(count.sum())
+            if not total:
+                continue
+            # Position of each pair within its cell's run of enemies
+            within = np.arange(total) - np.repeat(np.cumsum(count) - count, count)
+            firsts.append(np.repeat(indices, count))
+            seconds.append(order[np.repeat(start, count) + within])
+    i = np.concatenate(firsts)
+    j = np.concatenate(seconds)
+
+    dx = x[i] - x[j]
+    dy = y[i] - y[j]
+    distance2 = dx * dx + dy * dy
+    close = (i != j) & (distance2 < radius * radius)
+    i, j, dx, dy, distance2 = i[close], j[close], dx[close], dy[close], distance2[close]
+    if not len(i):
+        return push_x, push_y
+
+    # Enemies on exactly the same spot split sideways by index
+    same = distance2 == 0
+    dx[same] = np.where(i[same] > j[same], 1.0, -1.0)
+    distance2[same] = 1.0
+
+    # Each side of a pair moves half the overlap
+    distance = np.sqrt(distance2)
+    weight = (radius - distance) / distance / 2
+    push_x = np.bincount(i, dx * weight, minlength=n)
+    push_y = np.bincount(i, dy * weight, minlength=n)
+    length = np.hypot(push_x, push_y)
+    scale = np.minimum(1.0, max_push / np.maximum(length, 1e-9))
+    return np.round(push_x * scale), np.round(push_y * scale)
+
+@timed('enemy.separation')
+def separate(enemies, walls):
+    # Pushes living Enemy objects apart; returns how many moved
+    living = [enemy for enemy in enemies if not enemy.is_dead]
+    if len(living) < 2:
+        return 0
+    x = np.fromiter((enemy.x for enemy in living), np.float64, len(living))
+    y = np.fromiter((enemy.y for enemy in living), np.float64, len(living))
+    push_x, push_y = separation(x, y)
+    moved = np.flatnonzero((push_x != 0) | (push_y != 0))
+    for k in moved:
+        enemy = living[k]
+        rect = enemy.rect.move(int(push_x[k]), int(push_y[k]))
+        # Only a push that ends on a wall needs resolving
+        if rect.collidelist(walls.query(rect)) != -1:
+            rect.topleft = sweep(walls, enemy.rect, int(push_x[k]), int(push_y[k]), 1)
+        enemy.x, enemy.y = rect.topleft
+        enemy.rect.topleft = rect.topleft
+    return len(moved)
@@ -0,0 +1,103 @@
+from time import perf_counter
+from config import TILE_SIZE
+from mechanics.instrumentation import timed
+from mechanics.pathfinding import WalkabilityGrid
+
+# Line of sight for enemy aggro. The walls are rasterised onto the tile grid:
+# a tile is opaque when a wall covers its centre, so full collision boxes
+# block sight while logs, bushes and the thin boxes along water don't. A
+# check walks the tiles that a line from one tile centre to another crosses
+# (an integer grid DDA) and stops at the first opaque one. The two end tiles
+# are skipped, since an entity can stand partly on a wall tile. Every enemy
+# in a tile looking at a player in another tile gets the same answer, so
+# results are cached by (enemy tile, player tile) for the rest of the tick
+# and most checks are one dict lookup.
+
+class LineOfSight:
+    def __init__(self, walls, map_width, map_height, cell_size=TILE_SIZE):
+        self.walls = walls
+        self.cell_size = cell_size
+        # Cells whose centre lies inside a wall, with no body around them
+        self.grid = WalkabilityGrid(walls, map_width, map_height, cell_size, body=(0, 0))
+        self.cache = {}
+        self.checks = 0
+        self.hits = 0
+        self.total_checks = 0
+        self.total_hits = 0
+        self.traces = 0
+        self.trace_tiles = 0
+        self.trace_time = 0.0
+
+    def begin_tick(self):
+        # Enemies and players move between ticks
+        self.cache.clear()
+        self.total_checks += self.checks
+        self.total_hits += self.hits
+        self.checks = 0
+        self.hits = 0
+
+    def walls_changed(self, area):
+        self.grid.update_area(self.walls, area)
+        self.cache.clear()
+
+    def visible(self, x0, y0, x1, y1):
+        # Whether (x1, y1) can be seen from (x0, y0), both in world pixels
+        size = self.cell_size
+        key = (int(x0) // size, int(y0) // size, int(x1) // size, int(y1) // size)
+        self.checks += 1
+        seen = self.cache.get(key)
+        if seen is None:
+            start = perf_counter()
+            seen = self.cache[key] = self.trace(*key)
+            self.trace_time += perf_counter() - start
+        else:
+            self.hits += 1
+        return seen
+
+    @timed('line_of_sight')
+    def trace(self, col0, row0, col1, row1):
+        walkable = self.grid.walkable
+        cols, rows = self.grid.cols, self.grid.rows
+        nx, ny = abs(col1 - col0), abs(row1 - row0)
+        step_x = 1 if col1 > col0 else -1
+        step_y = 1 if row1 > row0 else -1
+        self.traces += 1
+        self.trace_tiles += nx + ny
+
+        col, row = col0, row0
+        ix = iy = 0
+        while ix < nx or iy < ny:
+            # Which tile edge the line crosses next, compared without dividing
+            decision = (1 + 2 * ix) * ny - (1 + 2 * iy) * nx
+            if decision == 0:
+                # Through a corner: the tiles on both sides must be clear
+                if 0 <= row < rows and 0 <= col + step_x < cols and not walkable[row][col + step_x]:
+                    return False
+                if 0 <= row + step_y < rows and 0 <= col < cols and not walkable[row + step_y][col]:
+                    return False
+                col += step_x
+                row += step_y
+                ix += 1
+                iy += 1
+            elif decision < 0:
+                col += step_x
+                ix += 1
+            else:
+                row += step_y
+                iy += 1
+            if (col != col1 or row != row1) and 0 <= row < rows and 0 <= col < cols and not walkable[row][col]:
+                return False
+        return True
+
+    def stats(self):
+        checks = self.total_checks + self.checks
+        hits = self.total_hits + self.hits
+        return {
+            'tiles': self.grid.cols * self.grid.rows,
+            'opaque_tiles': int(self.grid.blocked.sum()),
+            'checks': checks,
+            'hit_rate': hits / max(1, checks),
+            'traces': self.traces,
+            'tiles_per_trace': self.trace_tiles / max(1, self.traces),
+            'trace_ns': self.trace_time * 1e9 / max(1, self.traces),
+        }
@@ -0,0 +1,97 @@
+import os
+import sys
+import random
+import asyncio
+import argparse
+
+# Loopback load check: starts a GameServer in this process, connects N bot
+# clients that send random inputs and decode every snapshot, and prints the
+# server's tick-time and bandwidth stats. Exits non-zero if any bot fails
+# the handshake, stops decoding, or never decodes a snapshot.
+#   python code/network/bots.py --clients 32 --seconds 10
+
+CODE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if CODE_DIR not in sys.path:
+    sys.path.append(CODE_DIR)
+
+from network.server import GameServer, format_stats
+from network.protocol import HELLO, WELCOME, INPUT, SNAPSHOT, WELCOME_BODY, INPUT_BODY, frame, read_message, decode_snapshot
+
+class Bot:
+    def __init__(self, number, rng):
+        self.number = number
+        self.rng = rng
+        self.history = {}
+        self.tick = 0
+        self.snapshots = 0
+        self.entity_id = None
+
+    async def run(self, host, port, duration):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(frame(HELLO, f'bot{self.number}'.encode('utf-8')))
+        message_type, payload = await read_message(reader)
+        if message_type != WELCOME:
+            raise ConnectionError(f'bot{self.number}: server did not send WELCOME')
+        self.entity_id = WELCOME_BODY.unpack(payload)[0]
+
+        receiving = asyncio.create_task(self.receive(reader))
+        loop = asyncio.get_running_loop()
+        end = loop.time() + duration
+        input_tick = 0
+        mask = 0
+        while loop.time() < end:
+            input_tick += 1
+            if input_tick % 30 == 0:
+                mask = self.rng.choice((0, 1, 2, 4, 8, 5, 9, 6, 10)) | (16 if self.rng.random() < 0.1 else 0)
+            writer.write(frame(INPUT, INPUT_BODY.pack(input_tick, self.tick, mask)))
+            await asyncio.sleep(1 / 60)
+
+        writer.close()
+        # Decode errors and a bot missing from its snapshot surface here
+        await receiving
+        if self.snapshots == 0:
+            raise RuntimeError(f'bot{self.number} decoded no snapshots')
+
+    async def receive(self, reader):
+        try:
+            while True:
+                message_type, payload = await read_message(reader)
+                if message_type == SNAPSHOT:
+                    tick, states = decode_snapshot(payload, self.history)
+                    self.history[tick] = states
+                    for old in [t for t in self.history if t < tick - 120]:
+                        del self.history[old]
+                    self.tick = tick
+                    self.snapshots += 1
+                    if self.entity_id not in states:
+                        raise AssertionError(f'bot{self.number} missing from its own snapshot')
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+async def run(args):
+    server = GameServer('127.0.0.1', 0, num_enemies=args.enemies, max_enemies=args.enemies)
+    await server.start()
+    rng = random.Random(args.seed)
+    bots = [Bot(i, random.Random(rng.random())) for i in range(args.clients)]
+    try:
+        results = await asyncio.gather(*(bot.run('127.0.0.1', server.port, args.seconds) for bot in bots),
+                                       return_exceptions=True)
+        print(format_stats(server.stats()))
+        print(f'snapshots decoded per bot: min {min(b.snapshots for b in bots)} max {max(b.snapshots for b in bots)}')
+    finally:
+        await server.stop()
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for error in errors:
+        print(f'error: {type(error).__name__}: {error}', file=sys.stderr)
+    return 1 if errors else 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Loopback multiplayer load check')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--enemies', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=0)
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+if __name__ == '__main__':
+    main()
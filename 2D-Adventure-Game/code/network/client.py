@@ -0,0 +1,146 @@
+import asyncio
+import threading
+from network.protocol import (HELLO, WELCOME, INPUT, SNAPSHOT, PLAYER, FACING_LEFT, MOVING, ATTACKING, DEAD,
+                              WELCOME_BODY, INPUT_BODY, frame, read_message, encode_keys, decode_snapshot)
+from world import PLAYER_SHEETS, ENEMY_SHEETS
+from gameEntities.player import Player
+from gameEntities.enemy import Enemy
+
+class NetworkClient:
+    # Runs the connection on a background asyncio thread so the pygame loop
+    # in main.py stays synchronous. The newest decoded snapshot is swapped in
+    # atomically and read with latest().
+    MAX_HISTORY = 128
+
+    def __init__(self, host, port, name='player'):
+        self.host = host
+        self.port = port
+        self.name = name
+
+        self.entity_id = None
+        self.tick_rate = None
+        self.history = {}
+        self.snapshot = (0, {})
+        self.input_tick = 0
+        self.bytes_received = 0
+        self.error = None
+
+        self.loop = None
+        self.writer = None
+        self.connected = threading.Event()
+        self.thread = None
+
+    def start(self, timeout=5.0):
+        self.thread = threading.Thread(target=self.run_loop, name='network-client', daemon=True)
+        self.thread.start()
+        if not self.connected.wait(timeout):
+            raise ConnectionError(f'could not connect to {self.host}:{self.port}')
+        if self.error:
+            raise self.error
+
+    def run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.run())
+        except Exception as error:
+            self.error = error
+        finally:
+            self.connected.set()
+            self.loop.close()
+
+    async def run(self):
+        reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(frame(HELLO, self.name.encode('utf-8')))
+
+        message_type, payload = await read_message(reader)
+        if message_type != WELCOME:
+            raise ConnectionError('server did not send WELCOME')
+        self.entity_id, self.tick_rate = WELCOME_BODY.unpack(payload)
+        self.connected.set()
+
+        try:
+            while True:
+                message_type, payload = await read_message(reader)
+                self.bytes_received += len(payload) + 5
+                if message_type == SNAPSHOT:
+                    self.apply_snapshot(payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def apply_snapshot(self, payload):
+        tick, states = decode_snapshot(payload, self.history)
+        self.history[tick] = states
+        if len(self.history) > self.MAX_HISTORY:
+            for old in sorted(self.history)[:-self.MAX_HISTORY]:
+                del self.history[old]
+        self.snapshot = (tick, states)
+
+    def latest(self):
+        return self.snapshot
+
+    def send_input(self, keys):
+        if self.writer is None or self.loop is None or self.loop.is_closed():
+            return
+        self.input_tick += 1
+        # Every input also acknowledges the newest snapshot, which the server
+        # uses as the base for the next delta
+        message = frame(INPUT, INPUT_BODY.pack(self.input_tick, self.snapshot[0], encode_keys(keys)))
+        self.loop.call_soon_threadsafe(self.writer.write, message)
+
+    def close(self):
+        if self.loop is not None and not self.loop.is_closed() and self.writer is not None:
+            self.loop.call_soon_threadsafe(self.writer.close)
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+
+class RemoteWorld:
+    # Mirrors the server's entities with real Player/Enemy objects used only
+    # for drawing, so remote entities look exactly like local ones
+    def __init__(self, store):
+        self.store = store
+        self.proxies = {}
+        self.players = []
+        self.enemies = []
+        self.local_player = None
+
+    def proxy(self, entity_id, kind, position):
+        entity = self.proxies.get(entity_id)
+        if entity is None:
+            if kind == PLAYER:
+                entity = Player(*PLAYER_SHEETS, position, zoom_factor=3, player_id=f'remote{entity_id}', store=self.store)
+            else:
+                entity = Enemy(*ENEMY_SHEETS, 100, position, 3, enemy_id=f'remote{entity_id}', store=self.store)
+            self.proxies[entity_id] = entity
+        return entity
+
+    def apply(self, states, local_id):
+        players = []
+        enemies = []
+        for entity_id, (kind, x, y, health, flags, frame_index) in states.items():
+            entity = self.proxy(entity_id, kind, (x, y))
+            entity.x, entity.y = x, y
+            entity.rect.x, entity.rect.y = x, y
+            entity.health = health
+            entity.facing_left = bool(flags & FACING_LEFT)
+            entity.moving = bool(flags & MOVING)
+            entity.attacking = bool(flags & ATTACKING)
+            entity.current_frame = frame_index
+            entity.current_attack_frame = frame_index
+            entity.death_frame_index = frame_index
+            if kind == PLAYER:
+                entity.isDead = bool(flags & DEAD)
+                players.append(entity)
+            else:
+                entity.is_dead = bool(flags & DEAD)
+                enemies.append(entity)
+
+        for entity_id in [i for i in self.proxies if i not in states]:
+            del self.proxies[entity_id]
+
+        # Update in place so references held by main.py stay valid
+        self.players[:] = players
+        self.enemies[:] = enemies
+        self.local_player = self.proxies.get(local_id)
+
+    def nearby_enemies(self):
+        return self.enemies
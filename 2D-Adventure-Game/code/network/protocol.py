@@ -0,0 +1,151 @@
+import struct
+import pygame
+
+# Wire format shared by the server and clients. Every message is framed as
+#   type (u8) | payload length (u32) | payload
+# and all integers are big-endian.
+
+HELLO = 1      # client -> server: player name (utf-8)
+WELCOME = 2    # server -> client: own entity id, tick rate
+INPUT = 3      # client -> server: input tick, last applied snapshot tick, key bits
+SNAPSHOT = 4   # server -> client: entity states delta-encoded against a base tick
+
+HEADER = struct.Struct('!BI')
+WELCOME_BODY = struct.Struct('!HH')
+INPUT_BODY = struct.Struct('!IIB')
+SNAPSHOT_HEADER = struct.Struct('!IIHH')
+ENTRY_HEADER = struct.Struct('!HB')
+ENTITY_ID = struct.Struct('!H')
+
+PLAYER = 0
+ENEMY = 1
+
+# Entity state is the tuple (kind, x, y, health, flags, frame). Each field has
+# a bit in the per-entry change mask and only changed fields are sent.
+FIELDS = (
+    struct.Struct('!B'),  # kind
+    struct.Struct('!i'),  # x
+    struct.Struct('!i'),  # y
+    struct.Struct('!h'),  # health
+    struct.Struct('!B'),  # flags
+    struct.Struct('!B'),  # animation frame
+)
+ALL_FIELDS = (1 << len(FIELDS)) - 1
+
+FACING_LEFT = 1
+MOVING = 2
+ATTACKING = 4
+DEAD = 8
+
+# Key bits sent in INPUT messages, with the pygame keys each one stands for
+KEY_BITS = (
+    (1, (pygame.K_w, pygame.K_UP)),
+    (2, (pygame.K_s, pygame.K_DOWN)),
+    (4, (pygame.K_a, pygame.K_LEFT)),
+    (8, (pygame.K_d, pygame.K_RIGHT)),
+    (16, (pygame.K_o,)),
+    (32, (pygame.K_r,)),
+)
+KEY_MASKS = {key: bit for bit, keys in KEY_BITS for key in keys}
+
+def frame(message_type, payload=b''):
+    return HEADER.pack(message_type, len(payload)) + payload
+
+async def read_message(reader):
+    message_type, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    payload = await reader.readexactly(length) if length else b''
+    return message_type, payload
+
+def encode_keys(keys):
+    mask = 0
+    for bit, bound in KEY_BITS:
+        for key in bound:
+            if keys[key]:
+                mask |= bit
+                break
+    return mask
+
+class KeyState:
+    # Rebuilds a pygame.key.get_pressed()-style lookup from the key bits
+    def __init__(self, mask=0):
+        self.mask = mask
+
+    def __getitem__(self, key):
+        return bool(self.mask & KEY_MASKS.get(key, 0))
+
+def entity_state(kind, entity):
+    dead = entity.health <= 0 if kind == PLAYER else entity.is_dead
+    attacking = entity.attacking
+    if dead:
+        frame_index = entity.death_frame_index
+    elif attacking:
+        frame_index = entity.current_attack_frame
+    else:
+        frame_index = entity.current_frame
+
+    flags = 0
+    if entity.facing_left:
+        flags |= FACING_LEFT
+    if entity.moving:
+        flags |= MOVING
+    if attacking:
+        flags |= ATTACKING
+    if dead:
+        flags |= DEAD
+    return (kind, int(entity.x), int(entity.y), max(-32768, min(32767, int(entity.health))), flags, int(frame_index) & 0xFF)
+
+def encode_snapshot(tick, base_tick, base, current):
+    # base and current map entity id -> state tuple. base_tick 0 means the
+    # snapshot is a full one and base is empty.
+    parts = []
+    changed = 0
+    for entity_id, state in current.items():
+        old = base.get(entity_id)
+        if old == state:
+            continue
+        if old is None:
+            mask = ALL_FIELDS
+        else:
+            mask = 0
+            for i in range(len(FIELDS)):
+                if old[i] != state[i]:
+                    mask |= 1 << i
+        parts.append(ENTRY_HEADER.pack(entity_id, mask))
+        for i, field in enumerate(FIELDS):
+            if mask & (1 << i):
+                parts.append(field.pack(state[i]))
+        changed += 1
+
+    removed = [entity_id for entity_id in base if entity_id not in current]
+    for entity_id in removed:
+        parts.append(ENTITY_ID.pack(entity_id))
+
+    return SNAPSHOT_HEADER.pack(tick, base_tick, changed, len(removed)) + b''.join(parts)
+
+def decode_snapshot(payload, history):
+    # history maps tick -> state dict of previously applied snapshots
+    tick, base_tick, changed, removed = SNAPSHOT_HEADER.unpack_from(payload, 0)
+    offset = SNAPSHOT_HEADER.size
+    if base_tick:
+        base = history.get(base_tick)
+        if base is None:
+            raise ValueError(f'snapshot {tick} is based on unknown tick {base_tick}')
+        states = dict(base)
+    else:
+        states = {}
+
+    for _ in range(changed):
+        entity_id, mask = ENTRY_HEADER.unpack_from(payload, offset)
+        offset += ENTRY_HEADER.size
+        state = list(states.get(entity_id, (0,) * len(FIELDS)))
+        for i, field in enumerate(FIELDS):
+            if mask & (1 << i):
+                state[i] = field.unpack_from(payload, offset)[0]
+                offset += field.size
+        states[entity_id] = tuple(state)
+
+    for _ in range(removed):
+        states.pop(ENTITY_ID.unpack_from(payload, offset)[0], None)
+        offset += ENTITY_ID.size
+
+    return tick, states
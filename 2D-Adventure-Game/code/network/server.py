@@ -0,0 +1,279 @@
+import os
+import sys
+import asyncio
+import argparse
+from collections import deque
+from itertools import count
+from time import perf_counter
+
+# Authoritative multiplayer server. It owns the World tick (players, enemies,
+# combat), applies each client's latest input and sends every client a binary
+# snapshot of the entities around its player, delta-encoded against the last
+# snapshot that client acknowledged.
+#   python code/network/server.py --port 5555
+
+CODE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if CODE_DIR not in sys.path:
+    sys.path.append(CODE_DIR)
+
+from headless import GAME_ROOT, percentile
+import pygame
+from config import MAP_FILE, TILE_SIZE
+from world import World
+from rendering.tilemap import map_size
+from mechanics.persistence import EntityStore
+from network.protocol import (HELLO, WELCOME, INPUT, SNAPSHOT, PLAYER, ENEMY, WELCOME_BODY, INPUT_BODY,
+                              KeyState, frame, read_message, entity_state, encode_snapshot)
+
+NO_KEYS = KeyState()
+
+class ClientSession:
+    def __init__(self, writer, player, entity_id, name):
+        self.writer = writer
+        self.player = player
+        self.entity_id = entity_id
+        self.name = name
+        self.keys = KeyState()
+        self.input_tick = 0
+
+        # tick -> {entity id: state} for every snapshot sent but not yet
+        # superseded by an acknowledgement
+        self.history = {}
+        self.acked_tick = 0
+
+        self.bytes_sent = 0
+        self.snapshots_sent = 0
+        self.full_snapshots = 0
+        self.skipped_snapshots = 0
+
+    def acknowledge(self, tick):
+        if tick > self.acked_tick and tick in self.history:
+            self.acked_tick = tick
+            for old in [t for t in self.history if t < tick]:
+                del self.history[old]
+
+class GameServer:
+    MAX_HISTORY = 120
+    # Don't queue more snapshots for a client that isn't reading them
+    MAX_WRITE_BUFFER = 256 * 1024
+
+    def __init__(self, host='127.0.0.1', port=5555, tick_rate=60, snapshot_every=2, aoi=(1000, 700),
+                 num_enemies=1, max_enemies=4, store=None):
+        self.host = host
+        self.port = port
+        self.tick_rate = tick_rate
+        self.snapshot_every = snapshot_every
+        self.aoi_x, self.aoi_y = aoi
+        self.num_enemies = num_enemies
+        self.max_enemies = max_enemies
+        self.store = store or EntityStore(':memory:', flush_interval=0)
+
+        self.world = None
+        self.sessions = []
+        self.entity_ids = {}
+        self.next_ids = count(1)
+        self.player_numbers = count(1)
+        self.tick = 0
+        self.running = False
+        self.tick_times = deque(maxlen=600)
+        self.started = None
+        self.peak_clients = 0
+        self.bytes_sent = 0
+        self.snapshots_sent = 0
+        self.full_snapshots = 0
+        self.skipped_snapshots = 0
+
+    async def start(self):
+        os.chdir(GAME_ROOT)
+        pygame.init()
+        pygame.display.set_mode((1, 1))
+        map_width, map_height = map_size(MAP_FILE, TILE_SIZE)
+        self.world = World(map_width, map_height, store=self.store, max_enemies=self.max_enemies)
+        for _ in range(self.num_enemies):
+            self.world.spawn_enemy()
+
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.running = True
+        self.started = perf_counter()
+        self.tick_task = asyncio.create_task(self.tick_loop())
+
+    async def stop(self):
+        self.running = False
+        self.server.close()
+        await self.server.wait_closed()
+        for session in self.sessions[:]:
+            session.writer.close()
+        await self.tick_task
+        self.store.close()
+
+    def entity_id(self, entity):
+        entity_id = self.entity_ids.get(entity)
+        if entity_id is None:
+            entity_id = next(self.next_ids) % 65535 + 1
+            self.entity_ids[entity] = entity_id
+        return entity_id
+
+    async def handle_client(self, reader, writer):
+        try:
+            message_type, payload = await read_message(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        if message_type != HELLO:
+            writer.close()
+            return
+
+        player = self.world.add_player(player_id=f'player{next(self.player_numbers)}')
+        session = ClientSession(writer, player, self.entity_id(player), payload.decode('utf-8', 'replace'))
+        self.sessions.append(session)
+        self.peak_clients = max(self.peak_clients, len(self.sessions))
+        writer.write(frame(WELCOME, WELCOME_BODY.pack(session.entity_id, self.tick_rate)))
+
+        try:
+            while True:
+                message_type, payload = await read_message(reader)
+                if message_type == INPUT:
+                    input_tick, acked_tick, mask = INPUT_BODY.unpack(payload)
+                    # Inputs can't arrive out of order over TCP, but a stale
+                    # one must never overwrite a newer one
+                    if input_tick >= session.input_tick:
+                        session.input_tick = input_tick
+                        session.keys = KeyState(mask)
+                    session.acknowledge(acked_tick)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.remove(session)
+            self.world.remove_player(player)
+            self.entity_ids.pop(player, None)
+            writer.close()
+
+    def step(self):
+        self.tick += 1
+        inputs = {session.player: session.keys for session in self.sessions}
+        self.world.update(NO_KEYS, 1 / self.tick_rate, inputs)
+
+        if self.tick % 60 == 0:
+            live = set(self.world.players)
+            live.update(self.world.enemies)
+            for entity in [e for e in self.entity_ids if e not in live]:
+                del self.entity_ids[entity]
+
+    def visible_states(self, session):
+        # Area of interest: a box around the client's own player
+        center = session.player
+        cx, cy = center.x, center.y
+        aoi_x, aoi_y = self.aoi_x, self.aoi_y
+        states = {}
+        for kind, entities in ((PLAYER, self.world.players), (ENEMY, self.world.enemies)):
+            for entity in entities:
+                if entity is center or (abs(entity.x - cx) <= aoi_x and abs(entity.y - cy) <= aoi_y):
+                    states[self.entity_id(entity)] = entity_state(kind, entity)
+        return states
+
+    def send_snapshots(self):
+        for session in self.sessions:
+            transport = session.writer.transport
+            if transport.is_closing():
+                continue
+            if transport.get_write_buffer_size() > self.MAX_WRITE_BUFFER:
+                session.skipped_snapshots += 1
+                self.skipped_snapshots += 1
+                continue
+
+            current = self.visible_states(session)
+            base_tick = session.acked_tick
+            base = session.history.get(base_tick)
+            if base is None:
+                base_tick, base = 0, {}
+                session.full_snapshots += 1
+                self.full_snapshots += 1
+
+            data = frame(SNAPSHOT, encode_snapshot(self.tick, base_tick, base, current))
+            session.history[self.tick] = current
+            if len(session.history) > self.MAX_HISTORY:
+                # The client has stopped acknowledging; start over from a full snapshot
+                session.history = {self.tick: current}
+                session.acked_tick = 0
+
+            session.writer.write(data)
+            session.bytes_sent += len(data)
+            session.snapshots_sent += 1
+            self.bytes_sent += len(data)
+            self.snapshots_sent += 1
+
+    async def tick_loop(self):
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.tick_rate
+        next_time = loop.time()
+        while self.running:
+            start = perf_counter()
+            self.step()
+            if self.tick % self.snapshot_every == 0:
+                self.send_snapshots()
+            self.tick_times.append(perf_counter() - start)
+
+            next_time += interval
+            delay = next_time - loop.time()
+            if delay < -interval * 5:
+                # Fell far behind; don't try to catch up with a burst of ticks
+                next_time = loop.time()
+                delay = 0
+            await asyncio.sleep(max(0, delay))
+
+    def stats(self):
+        times = sorted(self.tick_times)
+        uptime = max(1e-9, perf_counter() - self.started) if self.started else 1e-9
+        return {
+            'tick': self.tick,
+            'clients': len(self.sessions),
+            'peak_clients': self.peak_clients,
+            'enemies': len(self.world.enemies) if self.world else 0,
+            'tick_p50_ms': percentile(times, 0.50) * 1000,
+            'tick_p99_ms': percentile(times, 0.99) * 1000,
+            'bytes_per_sec': self.bytes_sent / uptime,
+            'bytes_per_client_per_sec': self.bytes_sent / uptime / max(1, self.peak_clients),
+            'avg_snapshot_bytes': self.bytes_sent / max(1, self.snapshots_sent),
+            'snapshots_sent': self.snapshots_sent,
+            'full_snapshots': self.full_snapshots,
+            'skipped_snapshots': self.skipped_snapshots,
+        }
+
+def format_stats(stats):
+    return (f"tick {stats['tick']} clients {stats['clients']} (peak {stats['peak_clients']}) enemies {stats['enemies']} | "
+            f"tick p50 {stats['tick_p50_ms']:.2f} ms p99 {stats['tick_p99_ms']:.2f} ms | "
+            f"{stats['bytes_per_sec'] / 1024:.1f} KiB/s ({stats['bytes_per_client_per_sec'] / 1024:.2f} KiB/s per client, "
+            f"{stats['avg_snapshot_bytes']:.0f} B/snapshot, {stats['full_snapshots']} of {stats['snapshots_sent']} full)")
+
+async def serve(args):
+    store = EntityStore(args.save) if args.save else None
+    server = GameServer(args.host, args.port, tick_rate=args.tick_rate, snapshot_every=args.snapshot_every,
+                        num_enemies=args.enemies, max_enemies=max(args.enemies, args.max_enemies), store=store)
+    await server.start()
+    print(f'Serving on {server.host}:{server.port}')
+    try:
+        while True:
+            await asyncio.sleep(args.stats_interval)
+            print(format_stats(server.stats()))
+    finally:
+        await server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Authoritative adventure game server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--tick-rate', type=int, default=60)
+    parser.add_argument('--snapshot-every', type=int, default=2, help='send a snapshot every N ticks')
+    parser.add_argument('--enemies', type=int, default=1)
+    parser.add_argument('--max-enemies', type=int, default=4)
+    parser.add_argument('--save', help='SQLite file for player/enemy state (default: in memory)')
+    parser.add_argument('--stats-interval', type=float, default=5.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import os
+import json
+import mmap
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import numpy as np
+import pygame
+from config import ASSET_BUNDLE, MAP_FILE, TILE_SIZE, BASE_MAP_IMAGE, FOREGROUND_IMAGE
+from data.collisions import load_collision_layer
+from gameEntities.animations import Animation, extract_frames, use_bundle
+from rendering.tilemap import ChunkedMapRenderer, load_map, base_layers, layer_key, FOREGROUND_LAYERS
+from world import PLAYER_SHEETS, ENEMY_SHEETS
+
+# Pre-baked assets in one file: every entity animation already scaled and
+# flipped, the map layers already cut into chunks, and the collision layer,
+# all as raw pixels/arrays. Loading maps the file and wraps each surface
+# around its bytes, so startup does no PNG decoding and no scaling; only the
+# map chunks the camera reaches are ever read from disk.
+#
+# The bundle records the size and mtime of every source file (and what it
+# was built for); load_bundle() rebuilds it when any of them changed, with
+# the PNGs decoded on a thread pool.
+#   python code/benchmark.py --startup    # rebuild and time startup both ways
+#
+# File layout: header, JSON index, raw data. Index offsets are relative to
+# the start of the data.
+
+MAGIC = b'ADVB'
+VERSION = 1
+# magic, version, index length
+HEADER = struct.Struct('!4sBI')
+ALIGN = 64
+
+CHUNK_TILES = 8
+
+def animation_specs():
+    # load_animation() arguments of everything the entities draw
+    player = [(sheet, 96, 42, 10 if 'attack' in sheet else 8, 3) for sheet in PLAYER_SHEETS]
+    enemy = [(sheet, 96, 42, 8, 3) for sheet in ENEMY_SHEETS]
+    return player + enemy
+
+def layer_specs():
+    # (layer names, flattened fallback image, opaque) as main.py draws them
+    return [
+        (base_layers(load_map(MAP_FILE)), BASE_MAP_IMAGE, True),
+        (list(FOREGROUND_LAYERS), FOREGROUND_IMAGE, False),
+    ]
+
+def source_files():
+    sheets = sorted({spec[0] for spec in animation_specs()})
+    return [os.path.join('sprites', sheet) for sheet in sheets] + [MAP_FILE, BASE_MAP_IMAGE, FOREGROUND_IMAGE]
+
+def fingerprint():
+    sources = {}
+    for path in source_files():
+        if os.path.exists(path):
+            stat = os.stat(path)
+            sources[path] = [stat.st_mtime_ns, stat.st_size]
+    return {
+        'sources': sources,
+        'animations': [list(spec) for spec in animation_specs()],
+        'layers': [layer_key(MAP_FILE, names, TILE_SIZE, CHUNK_TILES) for names, _, _ in layer_specs()],
+    }
+
+def decode_images(paths):
+    # SDL_image releases the GIL while decoding, so PNGs decode in parallel
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as pool:
+        return dict(zip(paths, pool.map(pygame.image.load, paths)))
+
+class BundleWriter:
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def add(self, data):
+        offset = self.size
+        self.parts.append(data)
+        self.size += len(data)
+        padding = -self.size % ALIGN
+        if padding:
+            self.parts.append(bytes(padding))
+            self.size += padding
+        return offset
+
+    def surface(self, surface, format):
+        return self.add(pygame.image.tobytes(surface, format))
+
+def build_bundle(path=ASSET_BUNDLE):
+    # Needs a display mode set, since map chunks are rendered by the game's
+    # own ChunkedMapRenderer
+    start = perf_counter()
+    prints = fingerprint()
+    specs = animation_specs()
+    layers = layer_specs()
+    images = decode_images([os.path.join('sprites', sheet) for sheet in sorted({s[0] for s in specs})]
+                           + [image for _, image, _ in layers if os.path.exists(image)])
+    decoded = perf_counter()
+
+    writer = BundleWriter()
+    index = {'fingerprint': prints, 'animations': {}, 'layers': {}}
+    for spec in specs:
+        sheet, frame_width, frame_height, num_frames, zoom_factor = spec
+        frames = extract_frames(images[os.path.join('sprites', sheet)], frame_width, frame_height, num_frames,
+                                zoom_factor)
+        index['animations'][json.dumps(list(spec))] = {
+            'size': list(frames[0].get_size()) if frames else [0, 0],
+            'frames': [writer.surface(frame, 'RGBA') for frame in frames],
+            'flipped': [writer.surface(pygame.transform.flip(frame, True, False), 'RGBA') for frame in frames],
+        }
+
+    for names, image, opaque in layers:
+        renderer = ChunkedMapRenderer(MAP_FILE, names, TILE_SIZE, (1, 1), CHUNK_TILES,
+                                      fallback_image=images.get(image, image), opaque=opaque)
+        chunks = {}
+        for cy in range(-(-renderer.height // renderer.chunk_size)):
+            for cx in range(-(-renderer.width // renderer.chunk_size)):
+                surface = renderer.render_chunk(cx, cy)
+                if surface is not None:
+                    chunks[f'{cx},{cy}'] = [writer.surface(surface, 'RGB' if opaque else 'RGBA'),
+                                            *surface.get_size()]
+        # Chunks left out are fully transparent
+        index['layers'][layer_key(MAP_FILE, names, TILE_SIZE, CHUNK_TILES)] = {'opaque': opaque, 'chunks': chunks}
+
+    layer = np.ascontiguousarray(load_collision_layer())
+    index['collisions'] = {'offset': writer.add(layer.tobytes()), 'dtype': layer.dtype.str, 'shape': list(layer.shape)}
+
+    header_index = json.dumps(index, separators=(',', ':')).encode('utf-8')
+    header = HEADER.pack(MAGIC, VERSION, len(header_index)) + header_index
+    header += bytes(-len(header) % ALIGN)
+    # Write then rename so a half-written bundle is never picked up
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(header)
+        for part in writer.parts:
+            file.write(part)
+    os.replace(temp_path, path)
+    return {'decode_s': decoded - start, 'build_s': perf_counter() - start, 'bytes': len(header) + writer.size}
+
+class AssetBundle:
+    def __init__(self, path=ASSET_BUNDLE):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, index_size = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an asset bundle')
+        if version != VERSION:
+            raise ValueError(f'{path}: unsupported bundle version {version}')
+        self.index = json.loads(self.data[HEADER.size:HEADER.size + index_size])
+        self.start = HEADER.size + index_size + (-(HEADER.size + index_size) % ALIGN)
+        self.view = memoryview(self.data)
+
+    def is_current(self):
+        return self.index['fingerprint'] == fingerprint()
+
+    def surface(self, offset, size, format):
+        # Wraps the mapped bytes, then converts to the display format
+        start = self.start + offset
+        length = size[0] * size[1] * len(format)
+        image = pygame.image.frombuffer(self.view[start:start + length], size, format)
+        return image.convert() if format == 'RGB' else image.convert_alpha()
+
+    def animation(self, key):
+        entry = self.index['animations'].get(json.dumps(list(key)))
+        if entry is None:
+            return None
+        size = entry['size']
+        return Animation([self.surface(offset, size, 'RGBA') for offset in entry['frames']],
+                         [self.surface(offset, size, 'RGBA') for offset in entry['flipped']])
+
+    def map_layer(self, key):
+        return self.index['layers'].get(key)
+
+    def chunk(self, layer, cx, cy):
+        entry = layer['chunks'].get(f'{cx},{cy}')
+        if entry is None:
+            return None
+        offset, width, height = entry
+        return self.surface(offset, (width, height), 'RGB' if layer['opaque'] else 'RGBA')
+
+    def collision_layer(self):
+        entry = self.index['collisions']
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        return np.frombuffer(self.data, dtype, count, self.start + entry['offset']).reshape(entry['shape'])
+
+def load_bundle(path=ASSET_BUNDLE):
+    # Opens the bundle, building it first if it's missing or any source
+    # changed, and makes load_animation() read from it
+    bundle = None
+    if os.path.exists(path):
+        try:
+            bundle = AssetBundle(path)
+        except (OSError, ValueError):
+            bundle = None
+        if bundle is not None and not bundle.is_current():
+            bundle = None
+    if bundle is None:
+        build_bundle(path)
+        bundle = AssetBundle(path)
+    use_bundle(bundle)
+    return bundle
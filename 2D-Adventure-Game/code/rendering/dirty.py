@@ -0,0 +1,135 @@
+import pygame
+from rendering.foreground import draw_depth_sorted
+
+# Dirty-rectangle render path. Instead of redrawing the whole window every
+# frame it repaints only what changed: sprites whose position or animation
+# frame changed since the last frame, and the strips uncovered when the
+# camera scrolls (the rest of the window is shifted with Surface.scroll).
+# Large camera jumps, and anything the caller can't track, fall back to a
+# full redraw.
+
+def draw_state(entity):
+    # Everything that changes what an entity's draw() puts on screen
+    return (entity.facing_left, entity.attacking, entity.moving, int(entity.current_frame),
+            int(entity.current_attack_frame), entity.death_frame_index, entity.health)
+
+def merge_rects(rects):
+    # Union overlapping rects so no pixel is repainted twice
+    merged = []
+    for rect in rects:
+        rect = rect.copy()
+        index = rect.collidelist(merged)
+        while index != -1:
+            rect.union_ip(merged.pop(index))
+            index = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+class DirtyRectRenderer:
+    def __init__(self, screen, base, foreground, max_scroll=None, background=(255, 255, 255)):
+        self.screen = screen
+        self.base = base
+        self.foreground = foreground
+        self.background = background
+        width, height = screen.get_size()
+        # Scrolling further than this redraws the whole window instead
+        self.max_scroll = max_scroll or (width // 4, height // 4)
+
+        self.camera = None
+        self.drawn = {}
+        self.damaged = []
+        self.full_redraws = 0
+        self.partial_frames = 0
+        self.dirty_area = 0
+
+    def invalidate(self):
+        # Forget what is on screen, e.g. after something else drew over it
+        self.camera = None
+
+    def damage(self, rect):
+        # Screen rect something else drew over; repainted on the next frame
+        self.damaged.append(pygame.Rect(rect))
+
+    def paint(self, area, camera_x, camera_y, sprites):
+        screen = self.screen
+        screen.set_clip(area)
+        screen.fill(self.background, area)
+        self.base.draw(screen, camera_x, camera_y, area)
+        # The foreground is a SparseForeground, sorted in with the sprites
+        draw_depth_sorted(screen, [(sprite, camera) for sprite, rect, camera in sprites if rect.colliderect(area)],
+                          self.foreground, camera_x, camera_y, area)
+        screen.set_clip(None)
+
+    def render(self, camera_x, camera_y, entities, full=False, offset=None):
+        # Draws the frame and returns the rects to pass to pygame.display.update.
+        # offset(entity) gives a per-entity camera adjustment (interpolation)
+        camera_x, camera_y = int(camera_x), int(camera_y)
+        screen_rect = self.screen.get_rect()
+        sprites = []
+        drawn = {}
+        for entity in entities:
+            if offset is None:
+                sprite_camera = (camera_x, camera_y)
+            else:
+                dx, dy = offset(entity)
+                sprite_camera = (camera_x + dx, camera_y + dy)
+            rect = entity.screen_rect(*sprite_camera)
+            if rect.colliderect(screen_rect):
+                sprites.append((entity, rect, sprite_camera))
+                drawn[entity] = (rect, draw_state(entity))
+
+        previous, self.drawn = self.drawn, drawn
+        damaged, self.damaged = self.damaged, []
+        if self.camera is None or full:
+            dx = dy = None
+        else:
+            dx, dy = camera_x - self.camera[0], camera_y - self.camera[1]
+        self.camera = (camera_x, camera_y)
+
+        if dx is None or abs(dx) > self.max_scroll[0] or abs(dy) > self.max_scroll[1]:
+            self.paint(screen_rect, camera_x, camera_y, sprites)
+            self.full_redraws += 1
+            self.dirty_area = screen_rect.width * screen_rect.height
+            return [screen_rect]
+
+        dirty = []
+        if dx or dy:
+            self.screen.scroll(-dx, -dy)
+            width, height = screen_rect.size
+            if dx > 0:
+                dirty.append(pygame.Rect(width - dx, 0, dx, height))
+            elif dx < 0:
+                dirty.append(pygame.Rect(0, 0, -dx, height))
+            if dy > 0:
+                dirty.append(pygame.Rect(0, height - dy, width, dy))
+            elif dy < 0:
+                dirty.append(pygame.Rect(0, 0, width, -dy))
+
+        for rect in damaged:
+            # Both where it scrolled to and where it was drawn
+            dirty.append(rect.move(-dx, -dy).clip(screen_rect))
+            dirty.append(rect)
+
+        # After the scroll, a sprite that neither moved in the world nor
+        # changed frame is already in the right place
+        for entity, (rect, state) in previous.items():
+            old_rect = rect.move(-dx, -dy)
+            current = drawn.get(entity)
+            if current is None or current[0] != old_rect or current[1] != state:
+                dirty.append(old_rect.clip(screen_rect))
+        for entity, (rect, state) in drawn.items():
+            old = previous.get(entity)
+            if old is None or old[0].move(-dx, -dy) != rect or old[1] != state:
+                dirty.append(rect.clip(screen_rect))
+
+        dirty = merge_rects([rect for rect in dirty if rect.width and rect.height])
+        for area in dirty:
+            self.paint(area, camera_x, camera_y, sprites)
+        self.partial_frames += 1
+        self.dirty_area = sum(rect.width * rect.height for rect in dirty)
+
+        if dx or dy:
+            # Every pixel moved, so the whole window has to be presented,
+            # but only the strips and sprites were actually redrawn
+            return [screen_rect]
+        return dirty
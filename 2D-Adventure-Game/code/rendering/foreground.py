@@ -0,0 +1,128 @@
+import numpy as np
+import pygame
+
+# Sparse foreground drawn in depth order with the entities. At load time the
+# foreground layer is cut into one piece per tile that has any visible
+# pixels, cropped to those pixels, and the pieces are indexed by grid cell.
+# Touching pieces belong to the same object (a tree, a roof) and share its
+# depth, the world y of the object's bottom edge. Each frame the pieces
+# around the camera and the entities' sprites are sorted by depth and sent
+# in a single Surface.blits call, so an entity walking in front of an
+# object is drawn over it and one walking behind it is hidden. Only the
+# visible pixels of the foreground are alpha-blended, instead of whole
+# window-sized chunks.
+#
+# With a render scale (rendering.target) the layer is rendered that many
+# times smaller; pieces are placed in its pixels, but depths stay in world
+# pixels so they sort against the entities' depths. A layer that is one
+# region of a larger world (rendering.streaming) is placed at `origin`.
+
+class ForegroundPiece:
+    __slots__ = ('image', 'x', 'y', 'depth')
+
+    def __init__(self, image, x, y, depth=0):
+        self.image = image
+        self.x = x
+        self.y = y
+        self.depth = depth
+
+class SparseForeground:
+    def __init__(self, layer, cell_size=None, scale=1, origin=(0, 0)):
+        # layer: the ChunkedMapRenderer of the foreground layers, drawn at
+        # 1/scale of world size; origin is its top-left in the layer's pixels
+        self.width = layer.width
+        self.height = layer.height
+        self.tile_size = layer.tile_size
+        self.cell_size = cell_size or layer.chunk_size
+        self.scale = scale
+        self.origin = origin
+        self.cells = {}
+        tiles = self.cut(layer)
+        assign_depths(tiles, scale)
+        self.pieces = list(tiles.values())
+        for piece in self.pieces:
+            key = (piece.x // self.cell_size, piece.y // self.cell_size)
+            self.cells.setdefault(key, []).append(piece)
+
+    def cut(self, layer):
+        # One piece per non-empty tile, keyed by (column, row)
+        tile = self.tile_size
+        tiles = {}
+        for cy in range(-(-layer.height // layer.chunk_size)):
+            for cx in range(-(-layer.width // layer.chunk_size)):
+                # Straight from the source, not through the layer's LRU cache
+                chunk = layer.render_chunk(cx, cy)
+                if chunk is None:
+                    continue
+                # Which tiles have any alpha, for the whole chunk at once;
+                # chunks are always a whole number of tiles
+                width, height = chunk.get_size()
+                alpha = pygame.surfarray.pixels_alpha(chunk)
+                used = alpha.reshape(width // tile, tile, height // tile, tile).any(axis=(1, 3))
+                del alpha
+                for col, row in zip(*np.nonzero(used)):
+                    cell = chunk.subsurface((col * tile, row * tile, tile, tile))
+                    bounds = cell.get_bounding_rect()
+                    world_x = cx * layer.chunk_size + int(col) * tile + self.origin[0]
+                    world_y = cy * layer.chunk_size + int(row) * tile + self.origin[1]
+                    # Copied, so the chunk itself isn't kept alive
+                    image = cell.subsurface(bounds).copy()
+                    tiles[(world_x // tile, world_y // tile)] = ForegroundPiece(
+                        image, world_x + bounds.x, world_y + bounds.y)
+        return tiles
+
+    def visible(self, camera_x, camera_y, area):
+        # Pieces that may overlap `area` (a screen rect), with the camera in
+        # the layer's pixels. Pieces are at most
+        # a tile, so cells one up and one left of the area are included.
+        size = self.cell_size
+        left, top = int(camera_x) + area.left, int(camera_y) + area.top
+        cells = self.cells
+        found = []
+        for cy in range(top // size - 1, (top + area.height - 1) // size + 1):
+            for cx in range(left // size - 1, (left + area.width - 1) // size + 1):
+                pieces = cells.get((cx, cy))
+                if pieces:
+                    found.extend(pieces)
+        return found
+
+    def draw(self, surface, camera_x, camera_y, area=None):
+        # Everything in front of the entities, as the chunked layer drew it
+        draw_depth_sorted(surface, (), self, camera_x, camera_y, area)
+
+def assign_depths(tiles, scale=1):
+    # Pieces on neighbouring tiles (diagonals included) form one object
+    seen = set()
+    for start in tiles:
+        if start in seen:
+            continue
+        seen.add(start)
+        group = [start]
+        stack = [start]
+        while stack:
+            col, row = stack.pop()
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    neighbour = (col + dx, row + dy)
+                    if neighbour in tiles and neighbour not in seen:
+                        seen.add(neighbour)
+                        group.append(neighbour)
+                        stack.append(neighbour)
+        depth = max(tiles[key].y + tiles[key].image.get_height() for key in group) * scale
+        for key in group:
+            tiles[key].depth = depth
+
+def draw_depth_sorted(surface, sprites, foreground, camera_x, camera_y, area=None):
+    # sprites: (entity, (camera_x, camera_y)) pairs; each entity is drawn
+    # with its own camera, which may be offset for interpolation. Cameras
+    # are in world pixels. On equal depth the foreground wins.
+    if area is None:
+        area = surface.get_rect()
+    layers = []
+    for entity, camera in sprites:
+        layers.append((entity.depth, 0, entity.sprites(*camera)))
+    camera_x, camera_y = camera_x / foreground.scale, camera_y / foreground.scale
+    for piece in foreground.visible(camera_x, camera_y, area):
+        layers.append((piece.depth, 1, ((piece.image, (piece.x - camera_x, piece.y - camera_y)),)))
+    layers.sort(key=lambda layer: (layer[0], layer[1]))
+    surface.blits([blit for _, _, blits in layers for blit in blits], doreturn=False)
@@ -0,0 +1,62 @@
+import pygame
+from rendering.ui import get_ui
+
+# On-screen view of the instrumentation ring buffer: a frame-time graph with
+# 60 and 30 fps guide lines, the per-phase breakdown and the counters. The
+# text panel is only re-rendered every `refresh` frames. draw() returns the
+# screen rect it covered.
+
+class ProfilerOverlay:
+    def __init__(self, profiler, width=360, graph_height=80, refresh=15):
+        self.profiler = profiler
+        self.width = width
+        self.graph_height = graph_height
+        self.refresh = refresh
+        self.font = get_ui().font(20)
+        self.line_height = self.font.get_linesize()
+        self.panel = None
+        self.rendered_at = None
+
+    def build_panel(self):
+        profiler = self.profiler
+        rows = [('phase (ms)', 'avg', 'p99', 'max')]
+        for name, values in profiler.summary().items():
+            rows.append((name,) + tuple(f'{value:.2f}' for value in values))
+        counters = '  '.join(f'{name} {value}' for name, value in sorted(profiler.counters.items()))
+
+        height = self.graph_height + 8 + self.line_height * (len(rows) + bool(counters))
+        panel = pygame.Surface((self.width, height), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 170))
+        white = (255, 255, 255)
+        y = self.graph_height + 6
+        for name, *values in rows:
+            panel.blit(self.font.render(name, True, white), (6, y))
+            # Right-align the numbers; the default font isn't monospaced
+            for column, value in enumerate(values):
+                text = self.font.render(value, True, white)
+                panel.blit(text, (self.width - 126 + column * 60 - text.get_width(), y))
+            y += self.line_height
+        if counters:
+            panel.blit(self.font.render(counters, True, white), (6, y))
+        self.panel = panel
+        self.rendered_at = profiler.frames
+
+    def draw(self, surface, position=(10, 10)):
+        profiler = self.profiler
+        if self.panel is None or profiler.frames - self.rendered_at >= self.refresh:
+            self.build_panel()
+        x, y = position
+        area = surface.blit(self.panel, position)
+
+        # 1 px per frame, scaled so 33 ms fills the graph
+        height = self.graph_height
+        scale = height / (1000 / 30)
+        bottom = y + height
+        for fps, color in ((60, (80, 200, 80)), (30, (200, 80, 80))):
+            guide = bottom - int(1000 / fps * scale)
+            pygame.draw.line(surface, color, (x, guide), (x + self.width - 1, guide))
+        times = profiler.recent()[-self.width:]
+        if len(times) > 1:
+            points = [(x + i, bottom - min(height, int(t * 1000 * scale))) for i, t in enumerate(times)]
+            pygame.draw.lines(surface, (255, 255, 0), False, points)
+        return area
@@ -0,0 +1,244 @@
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict
+import pygame
+from config import TILE_SIZE, MAP_FILE, BASE_MAP_IMAGE, FOREGROUND_IMAGE, VIEW_SIZE, REGION_BUDGET, REGION_PREFETCH
+from data.collisions import load_collision_layer, merge_walls, wall_rects
+from mechanics.instrumentation import get_profiler
+from rendering.foreground import SparseForeground, draw_depth_sorted
+from rendering.tilemap import ChunkedMapRenderer, load_map, map_size, base_layers, FOREGROUND_LAYERS
+
+# A world made of several Tiled maps (regions) placed side by side, of which
+# only the ones near a view are resident. Regions within REGION_PREFETCH of
+# a view are queued for a loader thread, which decodes the region's images,
+# cuts its foreground and builds its walls off the main thread; the main
+# thread only picks up finished regions in update() and hands their walls to
+# the World. A region the view has reached before its load finished is
+# waited for (a stall, counted). Regions out of range stay loaded until the
+# estimated size of everything resident goes over the budget, then the
+# least recently wanted ones are dropped along with their walls. The World
+# freezes enemies outside the regions whose walls it has
+# (mechanics.residency), so none walks where there are no walls.
+#
+# A layout file lists the regions, in world pixels:
+#   {"regions": [{"name": "west", "map": "map/a.tmj", "x": 0, "y": 0,
+#                 "base_image": "map/a.png", "foreground_image": "map/a-fg.png"}, ...]}
+
+class Region:
+    def __init__(self, name, map_path, x=0, y=0, base_image=None, foreground_image=None):
+        if x % TILE_SIZE or y % TILE_SIZE:
+            raise ValueError(f'region {name} must start on a tile boundary, not at ({x}, {y})')
+        self.name = name
+        self.map_path = map_path
+        self.base_image = base_image
+        self.foreground_image = foreground_image
+        # Only the map's size is read here; tiles load with the region
+        self.rect = pygame.Rect((x, y), map_size(map_path, TILE_SIZE))
+
+def load_layout(path):
+    with open(path, 'r') as file:
+        data = json.load(file)
+    regions = []
+    for index, entry in enumerate(data['regions']):
+        regions.append(Region(entry.get('name', str(index)), entry['map'], entry.get('x', 0), entry.get('y', 0),
+                              entry.get('base_image'), entry.get('foreground_image')))
+    if len({region.name for region in regions}) != len(regions):
+        raise ValueError(f'{path} has two regions with the same name')
+    return regions
+
+def default_layout():
+    # The single map the game has always used
+    return [Region(os.path.splitext(os.path.basename(MAP_FILE))[0], MAP_FILE, 0, 0, BASE_MAP_IMAGE, FOREGROUND_IMAGE)]
+
+def world_size(regions):
+    return max(region.rect.right for region in regions), max(region.rect.bottom for region in regions)
+
+def surface_bytes(surface):
+    return surface.get_pitch() * surface.get_height()
+
+class LoadedRegion:
+    def __init__(self, region, base, foreground, walls, tiles):
+        self.region = region
+        self.base = base
+        self.foreground = foreground
+        # Merged walls, and the per-tile ones enemies resolve against
+        self.walls = walls
+        self.tiles = tiles
+        # What the region holds at most: the base map image (when drawn from
+        # the flattened PNG), a full chunk cache and the foreground pieces
+        self.bytes = base.max_chunks * base.chunk_size * base.chunk_size * 4
+        if base.fallback is not None:
+            self.bytes += surface_bytes(base.fallback)
+        self.bytes += sum(surface_bytes(piece.image) for piece in foreground.pieces)
+
+def region_walls(region, bundle=None):
+    # A region's merged walls and the per-tile ones enemies resolve against,
+    # in world coordinates. The asset bundle only holds the main map's
+    # collisions
+    if bundle is not None and region.map_path == MAP_FILE:
+        layer = bundle.collision_layer()
+    else:
+        layer = load_collision_layer(region.map_path)
+    tiles = wall_rects(layer, TILE_SIZE, origin=region.rect.topleft)
+    return merge_walls(tiles), tiles
+
+def load_region(region, tile_size=TILE_SIZE, viewport=VIEW_SIZE, scale=1, bundle=None):
+    # Everything a region needs, built without touching the World; runs on
+    # the loader thread
+    tiled = load_map(region.map_path)
+    origin = (region.rect.x // scale, region.rect.y // scale)
+    base = ChunkedMapRenderer(region.map_path, base_layers(tiled), tile_size, viewport,
+                              fallback_image=region.base_image, opaque=True, bundle=bundle)
+    # The foreground's renderer is only needed to cut the pieces
+    foreground = SparseForeground(ChunkedMapRenderer(region.map_path, FOREGROUND_LAYERS, tile_size, viewport,
+                                                     fallback_image=region.foreground_image, bundle=bundle),
+                                  scale=scale, origin=origin)
+    return LoadedRegion(region, base, foreground, *region_walls(region, bundle))
+
+class RegionStreamer:
+    def __init__(self, regions, tile_size=TILE_SIZE, viewport=VIEW_SIZE, scale=1, bundle=None, budget=REGION_BUDGET,
+                 prefetch=REGION_PREFETCH, on_load=None, on_unload=None, background=True):
+        # on_load(region, walls, tiles) and on_unload(region) run on the main
+        # thread; without a background thread regions load inside update()
+        self.regions = regions
+        self.tile_size = tile_size
+        self.viewport = viewport
+        self.scale = scale
+        self.bundle = bundle
+        self.budget = budget
+        self.prefetch = prefetch
+        self.on_load = on_load
+        self.on_unload = on_unload
+
+        # Least recently wanted first
+        self.loaded = OrderedDict()
+        self.pending = set()
+        self.resident_bytes = 0
+        self.loads = 0
+        self.unloads = 0
+        self.stalls = 0
+
+        self.base = StreamedBase(self)
+        self.foreground = StreamedForeground(self)
+
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = None
+        if background:
+            self.thread = threading.Thread(target=self.run, name='region-loader', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            region = self.requests.get()
+            if region is None:
+                return
+            try:
+                result = load_region(region, self.tile_size, self.viewport, self.scale, self.bundle)
+            except Exception as error:
+                # Raised again on the main thread
+                result = error
+            self.results.put((region, result))
+
+    def publish(self, region, result):
+        self.pending.discard(region.name)
+        if isinstance(result, Exception):
+            raise result
+        self.loaded[region.name] = result
+        self.resident_bytes += result.bytes
+        self.loads += 1
+        if self.on_load is not None:
+            self.on_load(region, result.walls, result.tiles)
+
+    def unload(self, name):
+        loaded = self.loaded.pop(name)
+        self.resident_bytes -= loaded.bytes
+        self.unloads += 1
+        if self.on_unload is not None:
+            self.on_unload(loaded.region)
+
+    def update(self, views):
+        # views: the world rects drawn this frame. Returns the regions that
+        # had to be waited for.
+        while True:
+            try:
+                self.publish(*self.results.get_nowait())
+            except queue.Empty:
+                break
+
+        margin = 2 * self.prefetch
+        near = [view.inflate(margin, margin) for view in views]
+        wanted = [region for region in self.regions if region.rect.collidelist(near) != -1]
+        for region in wanted:
+            if region.name not in self.loaded and region.name not in self.pending:
+                if self.thread is None:
+                    self.publish(region, load_region(region, self.tile_size, self.viewport, self.scale, self.bundle))
+                else:
+                    self.pending.add(region.name)
+                    self.requests.put(region)
+
+        # Anything on screen has to be there this frame
+        stalled = [region for region in wanted
+                   if region.name not in self.loaded and region.rect.collidelist(views) != -1]
+        for region in stalled:
+            self.stalls += 1
+            while region.name not in self.loaded:
+                self.publish(*self.results.get())
+
+        for region in wanted:
+            if region.name in self.loaded:
+                self.loaded.move_to_end(region.name)
+        self.evict({region.name for region in wanted})
+
+        profiler = get_profiler()
+        profiler.count('regions', len(self.loaded))
+        profiler.count('region_bytes', self.resident_bytes)
+        return stalled
+
+    def evict(self, keep):
+        for name in list(self.loaded):
+            if self.resident_bytes <= self.budget:
+                break
+            if name not in keep:
+                self.unload(name)
+
+    def close(self):
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join()
+            self.thread = None
+
+class StreamedBase:
+    # The loaded regions' base maps, drawn like one ChunkedMapRenderer
+    def __init__(self, streamer):
+        self.streamer = streamer
+
+    def draw(self, surface, camera_x, camera_y, area=None):
+        # Camera in the render target's pixels
+        if area is None:
+            area = surface.get_rect()
+        scale = self.streamer.scale
+        view = area.move(int(camera_x), int(camera_y))
+        for loaded in self.streamer.loaded.values():
+            rect = loaded.region.rect
+            x, y = rect.x // scale, rect.y // scale
+            if view.colliderect((x, y, rect.width // scale, rect.height // scale)):
+                loaded.base.draw(surface, camera_x - x, camera_y - y, area)
+
+class StreamedForeground:
+    # The loaded regions' foreground pieces, which are already placed in the
+    # world, as one SparseForeground
+    def __init__(self, streamer):
+        self.streamer = streamer
+        self.scale = streamer.scale
+
+    def visible(self, camera_x, camera_y, area):
+        found = []
+        for loaded in self.streamer.loaded.values():
+            found.extend(loaded.foreground.visible(camera_x, camera_y, area))
+        return found
+
+    def draw(self, surface, camera_x, camera_y, area=None):
+        draw_depth_sorted(surface, (), self, camera_x, camera_y, area)
@@ -0,0 +1,46 @@
+import pygame
+from config import TILE_SIZE
+from gameEntities.animations import set_render_scale
+
+# Low-resolution render target. The map tiles are 4x and the sprites 3x
+# their pixel art, so most of the window is large flat blocks of colour.
+# With a scale of N the world is composed into a surface N times smaller in
+# each direction (map chunks at TILE_SIZE // N, frames loaded N times
+# smaller) and upscaled into the window once per frame, so every blit and
+# fill touches about 1/N^2 of the pixels and the frames take 1/N^2 of the
+# memory. The camera is snapped to whole target pixels so the map, the
+# foreground and the sprites all move together. UI that should stay sharp
+# (the death message, the profiler overlay) is drawn on the window after
+# present().
+#
+# N must divide the tile size. The map art is made of whole 4x4 blocks, so
+# the map and foreground come out exactly as in the full-size window (the
+# camera just moves in steps of N pixels). The sprites' 3x isn't a multiple
+# of N, so their frames are resampled: at 2 a few rows and columns of each
+# sprite come out a pixel wider or narrower, at 4 some are dropped.
+
+class RenderTarget:
+    def __init__(self, screen, scale=1):
+        # Sets the scale frames are loaded at, so create it before any entity
+        width, height = screen.get_size()
+        if scale < 1 or TILE_SIZE % scale or width % scale or height % scale:
+            raise ValueError(f'render scale {scale} must divide the tile size ({TILE_SIZE}) '
+                             f'and the window size ({width}x{height})')
+        self.screen = screen
+        self.scale = scale
+        self.tile_size = TILE_SIZE // scale
+        self.size = (width // scale, height // scale)
+        self.surface = screen if scale == 1 else pygame.Surface(self.size).convert()
+        set_render_scale(scale)
+
+    def snap(self, camera_x, camera_y):
+        # Camera in world pixels, moved onto a whole pixel of the target
+        scale = self.scale
+        if scale == 1:
+            return camera_x, camera_y
+        return int(camera_x) // scale * scale, int(camera_y) // scale * scale
+
+    def present(self):
+        # Integer upscale of the composed world into the window
+        if self.scale != 1:
+            pygame.transform.scale(self.surface, self.screen.get_size(), self.screen)
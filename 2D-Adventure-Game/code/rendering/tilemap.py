@@ -0,0 +1,232 @@
+import os
+import json
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+import pygame
+
+# Chunked renderer for the Tiled map. Map layers are pre-rendered into
+# fixed-size chunk surfaces on first use and kept in an LRU cache, and each
+# frame only the chunks that intersect the camera are blitted. Memory scales
+# with the viewport rather than the whole map.
+
+FLIP_FLAGS = 0xE0000000
+FLIP_H = 0x80000000
+FLIP_V = 0x40000000
+
+# Layers drawn above the entities; everything else except the collision
+# layer is part of the base map
+FOREGROUND_LAYERS = ('Foreground',)
+HIDDEN_LAYERS = ('Collisions',)
+
+def load_map(path):
+    with open(path, 'r') as file:
+        data = json.load(file)
+    layers = OrderedDict()
+    for layer in data['layers']:
+        if layer.get('type') == 'tilelayer':
+            layers[layer['name']] = layer['data']
+    return {
+        'path': path,
+        'width': data['width'],
+        'height': data['height'],
+        'tile_width': data['tilewidth'],
+        'tile_height': data['tileheight'],
+        'tilesets': data.get('tilesets', []),
+        'layers': layers,
+    }
+
+def map_size(path, tile_size):
+    # Map size in world pixels, without decoding any images
+    tiled = load_map(path)
+    return tiled['width'] * tile_size, tiled['height'] * tile_size
+
+def base_layers(tiled):
+    return [name for name in tiled['layers'] if name not in FOREGROUND_LAYERS + HIDDEN_LAYERS]
+
+def layer_key(map_path, layer_names, tile_size, chunk_tiles):
+    # Names a set of layers rendered at a given size in an asset bundle
+    return f"{os.path.basename(map_path)}:{'+'.join(layer_names)}:{tile_size}:{chunk_tiles}"
+
+def find_file(path, *fallback_dirs):
+    # Tiled stores paths relative to the file that references them, and
+    # they often point outside the repo; fall back to the same file name in
+    # the given directories
+    if os.path.exists(path):
+        return path
+    for directory in fallback_dirs:
+        candidate = os.path.join(directory, os.path.basename(path))
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+class Tileset:
+    def __init__(self, first_gid, image, tile_width, tile_height, columns):
+        self.first_gid = first_gid
+        self.image = image
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.columns = columns
+        self.tiles = {}
+
+    @classmethod
+    def load(cls, map_path, entry, search_dirs):
+        map_dir = os.path.dirname(map_path)
+        tsx_path = find_file(os.path.normpath(os.path.join(map_dir, entry['source'])), *search_dirs)
+        if tsx_path is None:
+            return None
+        root = ET.parse(tsx_path).getroot()
+        image = root.find('image')
+        if image is None:
+            return None
+        image_path = find_file(os.path.normpath(os.path.join(os.path.dirname(tsx_path), image.get('source'))), *search_dirs)
+        if image_path is None:
+            return None
+        return cls(entry['firstgid'], pygame.image.load(image_path).convert_alpha(),
+                   int(root.get('tilewidth')), int(root.get('tileheight')), int(root.get('columns')))
+
+    def tile(self, gid, size):
+        # Scaled (and flipped) tile surface, cached per gid including flags
+        surface = self.tiles.get(gid)
+        if surface is None:
+            index = (gid & ~FLIP_FLAGS) - self.first_gid
+            col, row = index % self.columns, index // self.columns
+            source = self.image.subsurface((col * self.tile_width, row * self.tile_height, self.tile_width, self.tile_height))
+            surface = pygame.transform.scale(source, (size, size))
+            if gid & (FLIP_H | FLIP_V):
+                surface = pygame.transform.flip(surface, bool(gid & FLIP_H), bool(gid & FLIP_V))
+            self.tiles[gid] = surface
+        return surface
+
+class ChunkedMapRenderer:
+    def __init__(self, map_path, layer_names, tile_size, viewport, chunk_tiles=8, fallback_image=None,
+                 opaque=False, max_chunks=None, search_dirs=('map', 'sprites'), bundle=None):
+        self.tiled = load_map(map_path)
+        self.layers = [self.tiled['layers'][name] for name in layer_names if name in self.tiled['layers']]
+        self.map_tiles_x = self.tiled['width']
+        self.map_tiles_y = self.tiled['height']
+        self.tile_size = tile_size
+        self.chunk_tiles = chunk_tiles
+        self.chunk_size = chunk_tiles * tile_size
+        self.width = self.map_tiles_x * tile_size
+        self.height = self.map_tiles_y * tile_size
+        self.opaque = opaque
+
+        # Pre-rendered chunks from an asset bundle, if it has this layer set
+        self.bundle = bundle
+        self.bundle_key = layer_key(map_path, layer_names, tile_size, chunk_tiles)
+        self.bundle_layer = bundle.map_layer(self.bundle_key) if bundle is not None else None
+
+        tilesets = [Tileset.load(map_path, entry, search_dirs) for entry in self.tiled['tilesets']]
+        self.tilesets = sorted([t for t in tilesets if t is not None], key=lambda t: t.first_gid, reverse=True)
+
+        # Without the tileset image the layers can't be drawn, so chunks are
+        # cut from the pre-flattened PNG instead
+        self.fallback = None
+        if self.bundle_layer is None and (not self.tilesets or len(self.tilesets) < len(self.tiled['tilesets'])):
+            if fallback_image is None:
+                raise FileNotFoundError(f'tileset image for {map_path} not found and no fallback image given')
+            # A path, or an image the caller already decoded
+            image = fallback_image if isinstance(fallback_image, pygame.Surface) else pygame.image.load(fallback_image)
+            if image.get_size() != (self.width, self.height):
+                # Drawn at a smaller tile size for a render scale
+                image = pygame.transform.scale(image, (self.width, self.height))
+            self.fallback = image.convert() if opaque else image.convert_alpha()
+
+        if max_chunks is None:
+            # Enough for the viewport plus a ring around it
+            across = -(-viewport[0] // self.chunk_size) + 2
+            down = -(-viewport[1] // self.chunk_size) + 2
+            max_chunks = across * down
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict()
+        self.empty = set()
+        self.chunks_rendered = 0
+
+    def tileset_for(self, gid):
+        for tileset in self.tilesets:
+            if gid >= tileset.first_gid:
+                return tileset
+        return None
+
+    def render_chunk(self, cx, cy):
+        if self.bundle_layer is not None:
+            self.chunks_rendered += 1
+            return self.bundle.chunk(self.bundle_layer, cx, cy)
+
+        size = self.chunk_size
+        width = min(size, self.width - cx * size)
+        height = min(size, self.height - cy * size)
+        flags = 0 if self.opaque else pygame.SRCALPHA
+        surface = pygame.Surface((width, height), flags)
+        if self.opaque:
+            surface = surface.convert()
+        else:
+            surface = surface.convert_alpha()
+            surface.fill((0, 0, 0, 0))
+
+        if self.fallback is not None:
+            surface.blit(self.fallback, (0, 0), pygame.Rect(cx * size, cy * size, width, height))
+        else:
+            tile_size = self.tile_size
+            first_col, first_row = cx * self.chunk_tiles, cy * self.chunk_tiles
+            last_col = min(self.map_tiles_x, first_col + self.chunk_tiles)
+            last_row = min(self.map_tiles_y, first_row + self.chunk_tiles)
+            blits = []
+            for layer in self.layers:
+                for row in range(first_row, last_row):
+                    base = row * self.map_tiles_x
+                    for col in range(first_col, last_col):
+                        gid = layer[base + col]
+                        if gid:
+                            tileset = self.tileset_for(gid & ~FLIP_FLAGS)
+                            if tileset is not None:
+                                blits.append((tileset.tile(gid, tile_size),
+                                              ((col - first_col) * tile_size, (row - first_row) * tile_size)))
+            surface.blits(blits, doreturn=False)
+
+        self.chunks_rendered += 1
+        if not self.opaque and surface.get_bounding_rect().width == 0:
+            # Fully transparent: remember that and never blit it
+            return None
+        return surface
+
+    def chunk(self, cx, cy):
+        key = (cx, cy)
+        surface = self.chunks.get(key)
+        if surface is not None:
+            self.chunks.move_to_end(key)
+            return surface
+        if key in self.empty:
+            return None
+
+        surface = self.render_chunk(cx, cy)
+        if surface is None:
+            self.empty.add(key)
+            return None
+        self.chunks[key] = surface
+        while len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+        return surface
+
+    def visible_chunks(self, camera_x, camera_y, width, height):
+        size = self.chunk_size
+        first_cx = max(0, int(camera_x) // size)
+        first_cy = max(0, int(camera_y) // size)
+        last_cx = min(-(-self.width // size) - 1, (int(camera_x) + width - 1) // size)
+        last_cy = min(-(-self.height // size) - 1, (int(camera_y) + height - 1) // size)
+        for cy in range(first_cy, last_cy + 1):
+            for cx in range(first_cx, last_cx + 1):
+                yield cx, cy
+
+    def draw(self, surface, camera_x, camera_y, area=None):
+        # area limits drawing to the chunks under that screen rect; the
+        # caller is expected to have set a matching clip
+        if area is None:
+            area = surface.get_rect()
+        size = self.chunk_size
+        blits = []
+        for cx, cy in self.visible_chunks(camera_x + area.x, camera_y + area.y, area.width, area.height):
+            chunk = self.chunk(cx, cy)
+            if chunk is not None:
+                blits.append((chunk, (cx * size - camera_x, cy * size - camera_y)))
+        surface.blits(blits, doreturn=False)
@@ -0,0 +1,80 @@
+import pygame
+
+# Per-frame UI drawing without per-frame allocations. Fonts, rendered text,
+# the full-screen dim overlay and health bars are created the first time
+# they're needed and then reused; a health bar is only re-rendered when the
+# health it shows changes. `created` counts the fonts and surfaces made, so
+# a frame drawn from warm caches can be checked to have made none.
+
+class UI:
+    BAR_WIDTH = 50
+    BAR_HEIGHT = 5
+
+    def __init__(self):
+        self.fonts = {}
+        self.texts = {}
+        self.dim_surfaces = {}
+        self.health_bars = {}
+        self.created = 0
+
+    def font(self, size, name=None):
+        key = (name, size)
+        font = self.fonts.get(key)
+        if font is None:
+            font = self.fonts[key] = pygame.font.Font(name, size)
+            self.created += 1
+        return font
+
+    def render(self, font, text, color=(255, 255, 255)):
+        key = (font, text, color)
+        surface = self.texts.get(key)
+        if surface is None:
+            surface = self.texts[key] = font.render(text, True, color)
+            self.created += 1
+        return surface
+
+    def dim(self, surface, alpha=128):
+        key = (surface.get_size(), alpha)
+        overlay = self.dim_surfaces.get(key)
+        if overlay is None:
+            overlay = pygame.Surface(surface.get_size())
+            overlay.set_alpha(alpha)
+            overlay.fill((0, 0, 0))
+            self.dim_surfaces[key] = overlay
+            self.created += 1
+        surface.blit(overlay, (0, 0))
+
+    def health_bar(self, health, color, scale=1):
+        # Bar surface for a health value out of 100, one per distinct width;
+        # `scale` times smaller for a low-resolution render target
+        width = int(self.BAR_WIDTH * (health / 100))
+        key = (max(0, width), color, scale)
+        bar = self.health_bars.get(key)
+        if bar is None:
+            if scale != 1:
+                full = self.health_bar(health, color)
+                bar = pygame.transform.scale(full, (full.get_width() // scale, -(-full.get_height() // scale)))
+            else:
+                bar = pygame.Surface((max(self.BAR_WIDTH, width), self.BAR_HEIGHT), pygame.SRCALPHA)
+                bar.fill((0, 0, 0), (0, 0, self.BAR_WIDTH, self.BAR_HEIGHT))
+                if width > 0:
+                    bar.fill(color, (0, 0, width, self.BAR_HEIGHT))
+            self.health_bars[key] = bar
+            self.created += 1
+        return bar
+
+    def draw_health_bar(self, surface, health, color, x, y):
+        surface.blit(self.health_bar(health, color), (x, y))
+
+    def clear(self):
+        self.texts.clear()
+        self.dim_surfaces.clear()
+        self.health_bars.clear()
+
+_default_ui = None
+
+def get_ui():
+    global _default_ui
+    if _default_ui is None:
+        _default_ui = UI()
+    return _default_ui
@@ -0,0 +1,190 @@
+import argparse
+import csv
+import json
+import os
+import random
+from time import perf_counter
+from headless import HeadlessRunner, GAME_ROOT, INPUTS, format_report, percentile
+import pygame
+from config import MAP_FILE, TILE_SIZE, BASE_MAP_IMAGE, FOREGROUND_IMAGE, VIEW_SIZE
+from rendering.tilemap import ChunkedMapRenderer, load_map, base_layers, map_size, FOREGROUND_LAYERS
+from rendering.foreground import SparseForeground, draw_depth_sorted
+from rendering.target import RenderTarget
+from gameEntities.animations import set_render_scale
+from rendering.ui import get_ui
+from mechanics.recording import Recording, state_digest
+
+# Record and replay input sessions, so changes to collisions, AI or drawing
+# can be timed on exactly the same workload.
+#   python code/replay.py record recordings/wander-50.rec --seed 1 --enemies 50 --ticks 3600
+#   python code/replay.py play recordings/wander-50.rec [--render] [--frames frames.csv]
+# `record` runs a headless session with scripted inputs, starting from an
+# empty store or the saved records in a --records JSON file (entity id ->
+# record); main.py --record saves a live one in the same format. The
+# library in recordings/ is recorded from an empty store with:
+#   record recordings/idle-10.rec --seed 1 --enemies 10 --ticks 1800 --inputs idle
+#   record recordings/wander-50.rec --seed 1 --enemies 50
+#   record recordings/horde-200.rec --seed 1 --enemies 200
+#   record recordings/horde-200-vectorized.rec --seed 1 --enemies 200 --vectorized
+# `play` feeds the recorded keys back through the same World and reports
+# per-frame update and draw times. Draws go to SDL's dummy driver unless
+# SDL_VIDEODRIVER says otherwise.
+
+WINDOW_SIZE = VIEW_SIZE
+
+class ReplayView:
+    # main.py's full-frame drawing, with the camera on the first player.
+    # With a scale above 1 the world's entities must have been created after
+    # set_render_scale(scale).
+    def __init__(self, world, size=WINDOW_SIZE, scale=1):
+        self.world = world
+        self.screen = pygame.display.set_mode(size)
+        self.target = target = RenderTarget(self.screen, scale)
+        self.base = ChunkedMapRenderer(MAP_FILE, base_layers(load_map(MAP_FILE)), target.tile_size, target.size,
+                                       fallback_image=BASE_MAP_IMAGE, opaque=True)
+        self.foreground = SparseForeground(ChunkedMapRenderer(MAP_FILE, FOREGROUND_LAYERS, target.tile_size,
+                                                              target.size, fallback_image=FOREGROUND_IMAGE),
+                                           scale=target.scale)
+
+    def draw(self):
+        screen = self.screen
+        target = self.target
+        world = self.world
+        width, height = screen.get_size()
+        map_width, map_height = self.base.width * target.scale, self.base.height * target.scale
+        player = world.players[0]
+        camera_x = max(0, min(player.x - width // 2, map_width - width))
+        camera_y = max(0, min(player.y - height // 2, map_height - height))
+        camera_x, camera_y = target.snap(camera_x, camera_y)
+
+        target.surface.fill((255, 255, 255))
+        self.base.draw(target.surface, camera_x / target.scale, camera_y / target.scale)
+        sprites = [(entity, (camera_x, camera_y)) for entity in world.players + list(world.nearby_enemies())]
+        draw_depth_sorted(target.surface, sprites, self.foreground, camera_x, camera_y)
+        target.present()
+        if player.isDead:
+            ui = get_ui()
+            player.dim_background(screen)
+            player.display_death_message(screen, "You Died", "Press r to Respawn", ui.font(72), ui.font(32),
+                                         width, height)
+        pygame.display.update()
+
+def record(args):
+    output = os.path.abspath(args.output)
+    map_width, map_height = map_size(os.path.join(GAME_ROOT, MAP_FILE), TILE_SIZE)
+
+    # Starting positions and inputs get RNGs of their own, so the replay
+    # draws from the world's RNG exactly as this run does
+    placement = random.Random(args.seed + 1)
+    spawns = [(placement.randint(0, map_width), placement.randint(0, map_height)) for _ in range(args.enemies)]
+    source = INPUTS[args.inputs](random.Random(args.seed + 2))
+    records = {}
+    if args.records:
+        with open(args.records, 'r') as file:
+            records = json.load(file)
+    recording = Recording(args.seed, args.enemies, spawns, args.vectorized, not args.no_pathfinding, lod=args.lod,
+                          records=records)
+
+    def inputs(tick):
+        keys = source(tick)
+        recording.record(keys)
+        return keys
+
+    runner = HeadlessRunner(args.enemies, seed=args.seed, inputs=inputs, vectorized=args.vectorized,
+                            pathfinding=not args.no_pathfinding, spawns=spawns, lod=args.lod, records=records)
+    print(format_report(runner.run(args.ticks)))
+    recording.digest = state_digest(runner.world)
+    runner.close()
+    recording.save(output)
+    print(f'Wrote {output}: {len(recording)} ticks, {os.path.getsize(output)} bytes, digest {recording.digest:08x}')
+
+def play(args):
+    recording = Recording.load(args.recording)
+    frames_path = os.path.abspath(args.frames) if args.frames else None
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    if args.render:
+        # Frames are loaded at the scale the view draws at
+        set_render_scale(args.render_scale)
+    runner = HeadlessRunner(recording.max_enemies, seed=recording.seed, inputs=recording.keys,
+                            vectorized=recording.vectorized, pathfinding=recording.pathfinding,
+                            spawns=recording.spawns, lod=recording.lod, records=recording.records)
+    view = ReplayView(runner.world, scale=args.render_scale) if args.render else None
+
+    draw_times = []
+    for _ in range(len(recording)):
+        runner.step()
+        if view is not None:
+            start = perf_counter()
+            view.draw()
+            draw_times.append(perf_counter() - start)
+
+    report = runner.report()
+    report['recording'] = args.recording
+    report['digest'] = state_digest(runner.world)
+    report['digest_matches'] = report['digest'] == recording.digest
+    update_times = runner.tick_times
+    frame_times = [update + draw for update, draw in zip(update_times, draw_times)] if view else update_times
+    if view is not None:
+        draws = sorted(draw_times)
+        report['draw_p50_ms'] = percentile(draws, 0.50) * 1000
+        report['draw_p99_ms'] = percentile(draws, 0.99) * 1000
+    frames = sorted(frame_times)
+    report['frame_p50_ms'] = percentile(frames, 0.50) * 1000
+    report['frame_p99_ms'] = percentile(frames, 0.99) * 1000
+    runner.close()
+
+    print(format_report(report))
+    if view is not None:
+        print(f"  draw       p50 {report['draw_p50_ms']:.3f} ms  p99 {report['draw_p99_ms']:.3f} ms")
+    print(f"  frame      p50 {report['frame_p50_ms']:.3f} ms  p99 {report['frame_p99_ms']:.3f} ms")
+    if report['digest_matches']:
+        print(f"  final state matches the recording ({report['digest']:08x})")
+    else:
+        print(f"  final state differs from the recording ({report['digest']:08x} != {recording.digest:08x})")
+
+    if frames_path:
+        with open(frames_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['tick', 'update_ms', 'draw_ms', 'frame_ms'])
+            for tick, update in enumerate(update_times):
+                draw = draw_times[tick] if view else 0.0
+                writer.writerow([tick, f'{update * 1000:.4f}', f'{draw * 1000:.4f}', f'{(update + draw) * 1000:.4f}'])
+    if json_path:
+        with open(json_path, 'w') as file:
+            json.dump(report, file, indent=2)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Record and replay input sessions')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    recorder = commands.add_parser('record', help='record a scripted headless session')
+    recorder.add_argument('output')
+    recorder.add_argument('--enemies', type=int, default=10)
+    recorder.add_argument('--ticks', type=int, default=3600)
+    recorder.add_argument('--seed', type=int, default=0)
+    recorder.add_argument('--inputs', choices=sorted(INPUTS), default='random')
+    recorder.add_argument('--vectorized', action='store_true', help='use the array-backed EnemyManager')
+    recorder.add_argument('--no-pathfinding', action='store_true', help='chase in straight lines instead of flow fields')
+    recorder.add_argument('--lod', action='store_true', help='update distant enemies less often, as main.py does')
+    recorder.add_argument('--records', metavar='JSON', help='start from these saved entity records, not an empty store')
+
+    player = commands.add_parser('play', help='replay a recording and time it')
+    player.add_argument('recording')
+    player.add_argument('--render', action='store_true', help='draw every frame as the game does')
+    player.add_argument('--render-scale', type=int, default=1, metavar='N',
+                        help='with --render, compose at 1/N of the window size and upscale, as main.py can')
+    player.add_argument('--frames', help='write per-frame timings to this CSV file')
+    player.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record(args)
+    else:
+        report = play(args)
+        if not report['digest_matches']:
+            raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+import numpy as np
+import pygame
+import random
+from config import TILE_SIZE, FIXED_DT
+from gameEntities.player import Player
+from gameEntities.enemy_pool import EnemyPool
+from data.collisions import Collisions
+from gameEntities.enemy_manager import EnemyManager
+from gameEntities.region_shards import RegionShards
+from mechanics.combat import CombatSystem, save_targets, start_attack_animations
+from mechanics.pathfinding import Pathfinder
+from mechanics.sight import LineOfSight
+from mechanics.persistence import get_store
+from mechanics.instrumentation import get_profiler
+from mechanics.lod import LevelOfDetail
+from mechanics.residency import ResidentAreas
+
+PLAYER_SPAWN = (3500, 2000)
+PLAYER_SHEETS = (
+    'base_walk_strip8.png',
+    'curlyhair_walk_strip8.png',
+    'base_idle_strip9.png',
+    'curlyhair_idle_strip9.png',
+    'base_attack_strip10.png',
+    'curlyhair_attack_strip10.png',
+    'base_death_strip13.png',
+    'curlyhair_death_strip13.png',
+)
+ENEMY_SHEETS = (
+    'skeleton_walk_strip8.png',
+    'skeleton_idle_strip6.png',
+    'skeleton_attack_strip7.png',
+    'skeleton_death_strip10.png',
+    'skeleton_hurt_strip7.png',
+)
+
+# Simulation state shared by the windowed game and the headless runner:
+# walls, players, enemies and the per-frame update order. Nothing in here
+# draws, so it runs the same with or without a real display.
+
+class World:
+    # The parts of update(), in order
+    PHASES = ('input', 'spawning', 'players', 'enemies', 'combat')
+
+    def __init__(self, map_width, map_height, store=None, max_enemies=4, enemy_spawn_interval=10000, rng=None,
+                 vectorized=False, pathfinding=True, enemy_pool_size=None, interpolate=False, shards=0,
+                 collision_layer=None, lod=False, separation=True, streaming=False, line_of_sight=True):
+        self.map_width = map_width
+        self.map_height = map_height
+        self.store = store
+        self.max_enemies = max_enemies
+        self.enemy_spawn_interval = enemy_spawn_interval
+        self.rng = rng or random
+
+        self.walls = []
+        # collision_layer comes from the asset bundle when there is one. With
+        # streaming the world starts without walls; each region's are added
+        # through add_walls() when it loads and dropped when it unloads
+        # (rendering.streaming), and enemies outside the regions that are in
+        # are frozen (mechanics.residency)
+        self.resident = ResidentAreas() if streaming else None
+        if streaming:
+            if shards:
+                raise ValueError('region walls only reach this process, so streaming needs shards=0')
+            collision_layer = np.zeros((0, map_width // TILE_SIZE), dtype=np.uint32)
+        self.collisions = Collisions(self.walls, TILE_SIZE, map_width // TILE_SIZE, collision_layer)
+        self.wall_grid = self.collisions.grid
+        # Enemies resolve against the per-tile walls (data.collisions)
+        self.enemy_walls = self.collisions.tile_grid
+        # Flow fields that let chasing enemies path around walls; with shards
+        # every worker keeps its own
+        self.pathfinder = Pathfinder(self.walls, map_width, map_height) if pathfinding and not shards else None
+        # Enemies don't aggro on players behind walls
+        self.sight = LineOfSight(self.walls, map_width, map_height) if line_of_sight and not shards else None
+
+        self.players = []
+        self.shards = None
+        # Enemies far from every player's view update less often and aren't
+        # drawn; region shards simulate everything every tick
+        self.lod = LevelOfDetail(map_width, map_height) if lod and not shards else None
+        self.enemies_updated = 0
+        if shards:
+            # Enemies are simulated by worker processes, one per strip of the
+            # map, in shared memory; self.enemies holds views of it
+            self.enemy_manager = None
+            self.enemy_pool = None
+            self.shards = RegionShards(ENEMY_SHEETS, self.enemy_walls, self.walls, map_width, map_height, regions=shards,
+                                       capacity=max_enemies, zoom_factor=3, store=store or get_store(),
+                                       seed=self.rng.randrange(2 ** 32), pathfinding=pathfinding,
+                                       separation=separation, line_of_sight=line_of_sight)
+            self.enemies = self.shards.views
+        elif vectorized:
+            # Enemies live in NumPy arrays; self.enemies holds their views
+            self.enemy_manager = EnemyManager(ENEMY_SHEETS, zoom_factor=3, store=store or get_store(),
+                                              seed=self.rng.randrange(2 ** 32), lod=self.lod,
+                                              separation=separation, resident=self.resident)
+            self.enemies = self.enemy_manager.views
+            self.enemy_pool = None
+        else:
+            # Enemies are pre-allocated up to the cap and recycled when they die
+            self.enemy_manager = None
+            self.enemy_pool = EnemyPool(ENEMY_SHEETS, max_enemies if enemy_pool_size is None else enemy_pool_size,
+                                        zoom_factor=3, store=store, lod=self.lod, separation=separation,
+                                        resident=self.resident)
+            self.enemies = self.enemy_pool.active
+        self.time_since_last_enemy = 0
+
+        # Hits from every attacker are queued and applied once per step
+        self.combat = CombatSystem({'players': self.players, 'enemies': self.enemies})
+        self.combat.add_hook(save_targets)
+        self.combat.add_hook(start_attack_animations)
+
+        # Simulation clock, advanced by a fixed dt per step
+        self.time = 0.0
+        self.tick = 0
+        # Positions before the latest step, for render interpolation
+        self.interpolate = interpolate
+        self.previous = {}
+
+    def add_player(self, position=PLAYER_SPAWN, player_id="player1"):
+        player = Player(*PLAYER_SHEETS, position, zoom_factor=3, player_id=player_id, store=self.store)
+        self.players.append(player)
+        return player
+
+    def add_walls(self, name, rects, tiles=None, area=None):
+        # A region's merged walls and the per-tile ones, in world coordinates;
+        # with streaming, `area` is the part of the world they cover
+        self.collisions.add_region(name, rects, tiles)
+        if self.resident is not None and area is not None:
+            self.resident.add(name, area)
+        self.walls_changed(rects)
+
+    def remove_walls(self, name):
+        rects, _ = self.collisions.regions.get(name, (None, None))
+        self.collisions.remove_region(name)
+        if self.resident is not None:
+            self.resident.remove(name)
+        self.walls_changed(rects)
+
+    def walls_changed(self, rects):
+        if not rects:
+            return
+        area = rects[0].unionall(rects)
+        if self.pathfinder is not None:
+            self.pathfinder.walls_changed(area)
+        if self.sight is not None:
+            self.sight.walls_changed(area)
+
+    def spawn_enemy(self, position=None):
+        if position is None:
+            if self.resident is not None:
+                # Only where there are walls to keep the enemy out of them
+                position = self.resident.random_position(self.rng)
+                if position is None:
+                    return None
+            else:
+                position = (self.rng.randint(0, self.map_width), self.rng.randint(0, self.map_height))
+        if self.shards is not None:
+            return self.shards.spawn(position)
+        if self.enemy_manager is not None:
+            return self.enemy_manager.spawn(position)
+        return self.enemy_pool.acquire(position)
+
+    def handle_input(self, player, keys):
+        # Player attack logic
+        if keys[pygame.K_o]:
+            if not player.isDead:
+                time = int(self.time)
+                if time >= player.lastAttackTime + 1.25:
+                    self.combat.attack(player, 'players')
+                    player.attack()
+                    player.lastAttackTime = time
+
+        if keys[pygame.K_r]:
+            if player.isDead:
+                player.respawn(PLAYER_SPAWN)
+
+    def update_spawning(self, dt):
+        # enemy_spawn_interval is in milliseconds
+        self.time_since_last_enemy += dt * 1000
+        if len(self.enemies) < self.max_enemies:
+            if self.time_since_last_enemy >= self.enemy_spawn_interval:
+                self.spawn_enemy()
+                self.time_since_last_enemy = 0
+
+    def update_players(self, keys, dt, inputs=None):
+        # inputs maps a player to its own key state (multiplayer); players
+        # without an entry use keys
+        for player in self.players:
+            player.update(inputs.get(player, keys) if inputs else keys, self.wall_grid, dt)
+
+    def update_enemies(self, dt):
+        if self.shards is not None:
+            # Hits the workers' enemies landed join this tick's combat queue
+            by_slot = self.shards.by_slot
+            for slot, index, amount in self.shards.update(self.players, dt):
+                self.combat.emit(by_slot[slot], self.players[index], amount)
+            self.enemies_updated = len(self.enemies)
+            return
+        if self.pathfinder is not None:
+            self.pathfinder.update([player for player in self.players if player.health > 0])
+        if self.lod is not None:
+            self.lod.update_views(self.players)
+        if self.enemy_manager is not None:
+            self.enemies_updated = self.enemy_manager.update(self.enemy_walls, self.players, dt, self.pathfinder,
+                                                             self.combat, self.sight)
+            return
+        self.enemies_updated = self.enemy_pool.update(self.enemy_walls, self.players, dt, self.pathfinder, self.combat,
+                                                      self.sight)
+
+    def nearby_enemies(self):
+        # Enemies that may be on screen: with level of detail, the ones
+        # inside a view as of the latest step
+        if self.lod is None:
+            return self.enemies
+        if self.enemy_manager is not None:
+            return self.enemy_manager.near
+        return self.enemy_pool.near
+
+    def resolve_combat(self):
+        return self.combat.resolve()
+
+    def close(self):
+        if self.shards is not None:
+            self.shards.close()
+
+    def remove_player(self, player):
+        if player in self.players:
+            self.players.remove(player)
+
+    def begin_step(self, dt):
+        if self.interpolate:
+            previous = self.previous
+            previous.clear()
+            for entity in self.players:
+                previous[entity] = (entity.x, entity.y)
+            for entity in self.nearby_enemies():
+                previous[entity] = (entity.x, entity.y)
+        self.time += dt
+        self.tick += 1
+        self.combat.begin_tick()
+        if self.sight is not None:
+            self.sight.begin_tick()
+
+    def draw_offset(self, entity, alpha):
+        # Added to the camera when drawing `entity`, so it appears `alpha` of
+        # the way from its previous position to its current one
+        previous = self.previous.get(entity)
+        if previous is None:
+            return 0, 0
+        dx, dy = entity.x - previous[0], entity.y - previous[1]
+        if abs(dx) > TILE_SIZE or abs(dy) > TILE_SIZE:
+            # Spawned or respawned; don't slide across the map
+            return 0, 0
+        return round(dx * (1 - alpha)), round(dy * (1 - alpha))
+
+    def update(self, keys, dt=FIXED_DT, inputs=None, on_phase=None):
+        # One fixed simulation step. on_phase(name) is called as each of
+        # PHASES finishes, e.g. by the headless runner to time them
+        profiler = get_profiler()
+        self.begin_step(dt)
+        with profiler.scope('world.input'):
+            for player in self.players:
+                self.handle_input(player, inputs.get(player, keys) if inputs else keys)
+        if on_phase is not None:
+            on_phase('input')
+        with profiler.scope('world.spawning'):
+            self.update_spawning(dt)
+        if on_phase is not None:
+            on_phase('spawning')
+        with profiler.scope('world.players'):
+            self.update_players(keys, dt, inputs)
+        if on_phase is not None:
+            on_phase('players')
+        with profiler.scope('world.enemies'):
+            self.update_enemies(dt)
+        if on_phase is not None:
+            on_phase('enemies')
+        with profiler.scope('world.combat'):
+            events = self.resolve_combat()
+        if on_phase is not None:
+            on_phase('combat')
+        profiler.count('hits', len(events))
+        profiler.count('players', len(self.players))
+        profiler.count('enemies', len(self.enemies))
+        profiler.count('enemies_updated', self.enemies_updated)
+        profiler.count('walls', len(self.walls))
+        # Between ticks is when the store may snapshot the entities
+        (self.store or get_store()).end_tick()
+        if self.sight is not None:
+            # This tick's line-of-sight checks and how many the cache answered
+            profiler.count('sight_checks', self.sight.checks)
+            profiler.count('sight_hits', self.sight.hits)
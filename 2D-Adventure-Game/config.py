@@ -1 +1,28 @@
-TILE_SIZE = 64
\ No newline at end of file
+TILE_SIZE = 64
+
+# The simulation advances in fixed steps of FIXED_DT seconds regardless of
+# frame rate; speeds and animation rates are per step
+TICK_RATE = 60
+FIXED_DT = 1 / TICK_RATE
+
+# Entity state is written behind to this SQLite file every SAVE_INTERVAL seconds
+SAVE_FILE = 'game_state.db'
+SAVE_INTERVAL = 2.0
+
+# Tiled map and the pre-flattened exports used when the tileset image is missing
+MAP_FILE = 'map/2DAdventureGameV4C.tmj'
+BASE_MAP_IMAGE = 'map/2DAdventureGameV5.png'
+FOREGROUND_IMAGE = 'map/2DAdventureGameForegroundV2.png'
+
+# Pre-scaled frames, map chunks and collisions, rebuilt when a source changes
+ASSET_BUNDLE = 'data/assets.bundle'
+
+# Window size; enemies outside the view around a player are neither drawn
+# nor updated every tick
+VIEW_SIZE = (1120, 640)
+
+# With a multi-region world (main.py --world), regions within REGION_PREFETCH
+# pixels of the view are loaded on a background thread, and regions out of
+# view are unloaded, least recently seen first, above REGION_BUDGET bytes
+REGION_PREFETCH = 640
+REGION_BUDGET = 256 * 2 ** 20
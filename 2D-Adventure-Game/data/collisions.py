@@ -1,95 +1,337 @@
+import os
+import sys
+import json
+import xml.etree.ElementTree as ET
+import numpy as np
 import pygame
+from config import MAP_FILE, TILE_SIZE
 
-collisions = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 1033, 1033, 1033, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 1033, 1033, 1033, 2355, 0, 0, 0, 1879, 1033, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2355, 0, 0, 0, 0, 0, 2395, 2395, 0, 0, 1879, 1033, 2395, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1879, 2395, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2355, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1879, 1879, 2395, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 1033, 1033, 1033, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 1033, 2355, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1879, 2395, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2395, 2395, 0, 0, 0, 2395, 2395, 0, 0, 0, 0, 0, 0, 2355, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1879, 2395, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2395, 2395, 2395, 0, 2395, 2395, 2395, 0, 2395, 0, 0, 0, 0, 2355, 0, 1367, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1879, 2395, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2395, 2395, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 2395, 0, 0, 2395, 2395, 855, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 2903, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 2395, 855, 0, 2395, 2395, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2903, 2903, 0, 2395, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 0, 0, 0, 2395, 2395, 2395, 2395, 1033, 1033, 1033, 1033, 855, 1879, 2395, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2903, 2903, 0, 2395, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2395, 2395, 0, 0, 0, 0, 0, 0, 0, 2395, 2903, 0, 0, 0, 0, 2395, 2355, 2395, 2355, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1367, 2395, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2395, 2355, 0, 2395, 2395, 0, 0, 0, 0, 0, 0, 2903, 0, 0, 0, 0, 2395, 2395, 1154, 2355, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1367, 2395, 2395, 2395, 2395, 2395, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2355, 2395, 2395, 0, 0, 2395, 2395, 0, 0, 0, 2395, 2355, 0, 0, 0, 0, 1367, 2395, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1367, 2355, 1879, 2395, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 0, 0, 0, 1879, 0, 0, 0, 2355, 0, 0, 2903, 2903, 1367, 2395, 2395, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1367, 2355, 0, 0, 0, 2395, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 2903, 0, 0, 0, 0, 0, 0, 0, 0, 1154, 1154, 1154, 1154, 2395, 2395, 2903, 2395, 0, 0, 0, 0, 0, 0, 1367, 1033, 1033, 1033, 1033, 2355, 0, 0, 2903, 2903, 2395, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1879, 0, 1033, 1033, 1033, 1033, 1033, 2355, 0, 0, 0, 0, 0, 0, 0, 0, 1367, 2395, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2355, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2355, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2903, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2395, 2395, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 2903, 0, 0, 0, 0, 0, 0, 0, 0, 2903, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2395, 2903, 2903, 0, 0, 0, 0, 0, 0, 1367, 2395, 2395, 2395, 855, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2903, 2903, 0, 1367, 2395, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2355, 2391, 2395, 2395, 2395, 2395, 2395, 2395, 2395, 2395, 0, 0, 0, 0, 2395, 2395, 2395, 2395, 2395, 2395, 2395, 855, 0, 0, 0, 0, 1367, 2395, 2395, 0, 2395, 2395, 2395, 2395, 2395, 2395, 2395, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2355, 0, 1879, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2395, 2395, 2395, 2395, 2395, 2395, 1033, 1033, 0, 1033, 1033, 1033, 1033, 1033, 2395, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2355, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1879, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2355, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 855, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 855, 0, 0, 0, 0, 0, 0, 0, 0, 2903, 2903, 1367, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 855, 0, 0, 0, 0, 0, 0, 1367, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2395, 2395, 2395, 855, 0, 0, 0, 0, 1367, 2395, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2395, 855, 0, 0, 0, 1367, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2395, 2395, 2395, 2395, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2395, 2395, 2395, 2395, 2395, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+# Walls come from the "Collisions" layer of the Tiled map. The layer is
+# extracted once into a .npy cache next to this file (rebuilt whenever the
+# map is newer than the cache) and turned into rects with one vectorised
+# pass over SHAPES. Runs of touching same-shape rects (a coastline, a cliff
+# edge) are then merged into single larger rects for players, the pathfinder
+# and line of sight. Enemies stop at the first wall they hit, so which rects
+# there are and their order matters to them; they resolve against the
+# per-tile rects, which keeps their moves exactly as they were.
+#   python -m data.collisions             # rebuild the cache by hand
+#   python -m data.collisions --verify    # check no player or enemy move changes
+
+COLLISION_LAYER = 'Collisions'
+CACHE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def shape_table(tile_size):
+    # Collision tile id -> (x offset, y offset, width, height) of its wall
+    # relative to the tile's top-left corner
+    return {
+        2395: (-tile_size - 56, -54, tile_size, tile_size),   # Standard collision box
+        2903: (-tile_size - 28, -48, 10, 10),                 # Smaller box for logs, bushes and small trees
+        1154: (-tile_size - 32, -60, tile_size, 15),          # Box to get close to flowing water without getting in it
+        855: (-tile_size - 25, -25, 15, 15),                  # Box to prevent you from access bottom left corner of a tile
+        1367: (-tile_size - 5, -25, 15, 15),                  # Box to prevent you from access bottom right corner of a tile
+        1879: (-tile_size, -5, 10, 15),                       # Box to prevent you from access top right corner of a tile
+        2355: (-2 * tile_size - 10, -30, 15, 15),             # Box to prevent you from access top left corner of a tile
+        1033: (-tile_size - 56, -56, tile_size, 26),          # Box to get close to edge without going up or down
+    }
+
+SHAPES = shape_table(TILE_SIZE)
+
+def read_collision_layer(map_path):
+    # (rows, cols) array of tile ids from a .tmj or CSV-encoded .tmx map
+    if map_path.endswith('.tmx'):
+        root = ET.parse(map_path).getroot()
+        for layer in root.iter('layer'):
+            if layer.get('name') == COLLISION_LAYER:
+                data = layer.find('data')
+                if data.get('encoding') != 'csv':
+                    raise ValueError(f'{map_path}: only CSV-encoded layers are supported')
+                ids = [int(value) for value in data.text.replace('\n', '').split(',')]
+                return np.array(ids, dtype=np.uint32).reshape(int(layer.get('height')), int(layer.get('width')))
+    else:
+        with open(map_path, 'r') as file:
+            data = json.load(file)
+        for layer in data['layers']:
+            if layer['name'] == COLLISION_LAYER:
+                return np.array(layer['data'], dtype=np.uint32).reshape(layer['height'], layer['width'])
+    raise ValueError(f'{map_path} has no {COLLISION_LAYER} layer')
+
+def cache_path_for(map_path):
+    name = os.path.splitext(os.path.basename(map_path))[0]
+    return os.path.join(CACHE_DIR, f'{name}.collisions.npy')
+
+def build_cache(map_path=MAP_FILE, cache_path=None):
+    cache_path = cache_path or cache_path_for(map_path)
+    layer = read_collision_layer(map_path)
+    # Write then rename so a half-written cache is never picked up
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        np.save(file, layer)
+    os.replace(temp_path, cache_path)
+    return layer
+
+def load_collision_layer(map_path=MAP_FILE, cache_path=None):
+    cache_path = cache_path or cache_path_for(map_path)
+    try:
+        if os.path.getmtime(cache_path) >= os.path.getmtime(map_path):
+            return np.load(cache_path)
+    except (OSError, ValueError):
+        pass
+    return build_cache(map_path, cache_path)
+
+def wall_rects(layer, tile_size=TILE_SIZE, shapes=None, origin=(0, 0)):
+    # One rect per collision tile, in row-major order; origin is the world
+    # position of the layer's top-left corner
+    shapes = shape_table(tile_size) if shapes is None else shapes
+    layer = np.asarray(layer, dtype=np.int64)
+    ids = np.array(list(shapes), dtype=np.int64)
+    table = np.array(list(shapes.values()), dtype=np.int64)
+
+    # Tile id -> row of the shape table, -1 for tiles without a wall
+    lookup = np.full(ids.max() + 1, -1, dtype=np.int64)
+    lookup[ids] = np.arange(len(ids))
+    index = np.where(layer <= ids.max(), lookup[np.minimum(layer, ids.max())], -1)
+
+    rows, cols = np.nonzero(index >= 0)
+    table = table[index[rows, cols]]
+    xs = cols * tile_size + table[:, 0] + origin[0]
+    ys = rows * tile_size + table[:, 1] + origin[1]
+    return [pygame.Rect(x, y, w, h) for x, y, w, h in zip(xs.tolist(), ys.tolist(), table[:, 2].tolist(), table[:, 3].tolist())]
+
+def merge_runs(rects, axis):
+    # Merge rects that share their extent across `axis` and touch or overlap
+    # along it: same y and height for axis 0, same x and width for axis 1
+    across = 1 - axis
+    runs = {}
+    for rect in rects:
+        runs.setdefault((rect[across], rect[across + 2]), []).append(rect)
+    merged = []
+    for run in runs.values():
+        run.sort(key=lambda rect: rect[axis])
+        current = pygame.Rect(run[0])
+        for rect in run[1:]:
+            if rect[axis] <= current[axis] + current[axis + 2]:
+                end = max(current[axis] + current[axis + 2], rect[axis] + rect[axis + 2])
+                current[axis + 2] = end - current[axis]
+            else:
+                merged.append(current)
+                current = pygame.Rect(rect)
+        merged.append(current)
+    return merged
+
+def merge_walls(rects):
+    # Greedy compaction: merge along rows, then along columns, until nothing
+    # changes, then drop rects lying entirely inside another (anything
+    # reaching one has already been stopped by the other). Covers exactly
+    # the same area; returned in row-major order like wall_rects()
+    merged = list(rects)
+    count = None
+    while count != len(merged):
+        count = len(merged)
+        merged = merge_runs(merge_runs(merged, 0), 1)
+    merged = [rect for i, rect in enumerate(merged)
+              if not any(j != i and other.contains(rect) and (other != rect or j < i)
+                         for j, other in enumerate(merged))]
+    merged.sort(key=lambda rect: (rect.y, rect.x))
+    return merged
+
+class SpatialGrid:
+    # Uniform grid of buckets holding rects. query() returns the rects that
+    # share a bucket with the given rect, in the order they were added, so
+    # collision resolution matches looping over the full list. `version`
+    # changes whenever the set of rects does.
+    def __init__(self, cell_size, margin=None):
+        self.cell_size = cell_size
+        # Resolving one overlap can push an entity across a whole wall, so
+        # queries are widened to catch the walls it might be pushed into
+        self.margin = cell_size if margin is None else margin
+        self.cells = {}
+        self.items = []
+        self.removed = 0
+        self.version = 0
+
+    def build(self, rects):
+        self.cells.clear()
+        self.items = []
+        self.removed = 0
+        for rect in rects:
+            self.insert(rect)
+
+    def insert(self, rect):
+        index = len(self.items)
+        self.items.append(rect)
+        self.version += 1
+        for key in self.cell_keys(rect):
+            bucket = self.cells.get(key)
+            if bucket is None:
+                self.cells[key] = [index]
+            else:
+                bucket.append(index)
+
+    def remove(self, rects):
+        # Removed slots are left empty so the rest keep their order; once
+        # most of the slots are empty the grid is rebuilt
+        gone = {id(rect) for rect in rects}
+        items = self.items
+        for index, rect in enumerate(items):
+            if rect is not None and id(rect) in gone:
+                items[index] = None
+                self.removed += 1
+                for key in self.cell_keys(rect):
+                    bucket = self.cells[key]
+                    bucket.remove(index)
+                    if not bucket:
+                        del self.cells[key]
+        self.version += 1
+        if self.removed > len(items) // 2:
+            self.build([rect for rect in items if rect is not None])
+
+    def cell_keys(self, rect, margin=0):
+        size = self.cell_size
+        left = (rect[0] - margin) // size
+        top = (rect[1] - margin) // size
+        right = (rect[0] + rect[2] + margin - 1) // size
+        bottom = (rect[1] + rect[3] + margin - 1) // size
+        return [(cx, cy) for cx in range(left, right + 1) for cy in range(top, bottom + 1)]
+
+    def query(self, rect):
+        cells = self.cells
+        found = set()
+        for key in self.cell_keys(rect, self.margin):
+            bucket = cells.get(key)
+            if bucket:
+                found.update(bucket)
+        if not found:
+            return []
+        items = self.items
+        return [items[i] for i in sorted(found)]
+
+    def __iter__(self):
+        return (rect for rect in self.items if rect is not None)
+
+    def __len__(self):
+        return len(self.items) - self.removed
 
 class Collisions:
-    def __init__(self, walls, tile_size, map_width_tiles):
+    def __init__(self, walls, tile_size, map_width_tiles, layer=None):
         self.walls = walls
         self.tile_size = tile_size
         self.map_width_tiles = map_width_tiles
 
-        for i in range(0, len(collisions),):
-            if collisions[i] == 2395: # Standard collision box
-                row = i // map_width_tiles  # Calculate row in the grid
-                col = i % map_width_tiles   # Calculate column in the grid
-                rect = pygame.Rect((col * self.tile_size) - self.tile_size  - 56, row * self.tile_size - 54, self.tile_size, self.tile_size)
-                walls.append(rect)
-            elif collisions[i] == 2903: # Smaller box for logs, bushes and small trees
-                row = i // map_width_tiles
-                col = i % map_width_tiles
-                rect = pygame.Rect((col * self.tile_size) - self.tile_size  - 28, row * self.tile_size - 48, 10, 10)
-                walls.append(rect)
-            elif collisions[i] == 1154: # Box to get close to flowing water without getting in it
-                row = i // map_width_tiles 
-                col = i % map_width_tiles 
-                rect = pygame.Rect((col * self.tile_size) - self.tile_size - 32, row * self.tile_size - 60, self.tile_size, 15)
-                walls.append(rect)
-            elif collisions[i] == 855: # Box to prevent you from access bottom left corner of a tile
-                row = i // map_width_tiles 
-                col = i % map_width_tiles 
-                rect = pygame.Rect((col * self.tile_size) - self.tile_size - 25, row * self.tile_size - 25, 15, 15)
-                walls.append(rect)
-            elif collisions[i] == 1367: # Box to prevent you from access bottom right corner of a tile
-                row = i // map_width_tiles 
-                col = i % map_width_tiles 
-                rect = pygame.Rect((col * self.tile_size) - self.tile_size - 5, row * self.tile_size - 25, 15, 15)
-                walls.append(rect)
-            elif collisions[i] == 1879: # Box to prevent you from access top right corner of a tile
-                row = i // map_width_tiles 
-                col = i % map_width_tiles 
-                rect = pygame.Rect((col * self.tile_size) - self.tile_size, row * self.tile_size - 5, 10, 15)
-                walls.append(rect)
-            elif collisions[i] ==  2355: # Box to prevent you from access top left corner of a tile
-                row = i // map_width_tiles 
-                col = i % map_width_tiles 
-                rect = pygame.Rect((col * self.tile_size) - (2 * self.tile_size) - 10, row * self.tile_size - 30, 15, 15)
-                walls.append(rect)
-            elif collisions[i] == 1033: # Box to get close to edge without going up or down
-                row = i // map_width_tiles 
-                col = i % map_width_tiles 
-                rect = pygame.Rect((col * self.tile_size) - self.tile_size - 56, row * self.tile_size - 56, self.tile_size, 26)
-                walls.append(rect)
+        if layer is None:
+            layer = load_collision_layer()
+        self.layer = np.asarray(layer).reshape(-1, map_width_tiles)
+        tiles = wall_rects(self.layer, tile_size)
+        walls.extend(merge_walls(tiles))
+
+        # Broadphase indexes so entities only test the walls around them:
+        # the merged walls for players, the per-tile ones for enemies
+        self.grid = SpatialGrid(self.tile_size * 2)
+        self.grid.build(walls)
+        self.tile_grid = SpatialGrid(self.tile_size * 2)
+        self.tile_grid.build(tiles)
+        # (merged, per-tile) walls added per streamed region, by region name
+        self.regions = {}
+
+    def add_region(self, name, rects, tiles=None):
+        # tiles: the per-tile rects the merged `rects` were built from
+        tiles = rects if tiles is None else tiles
+        self.regions[name] = (rects, tiles)
+        self.walls.extend(rects)
+        for rect in rects:
+            self.grid.insert(rect)
+        for rect in tiles:
+            self.tile_grid.insert(rect)
+
+    def remove_region(self, name):
+        rects, tiles = self.regions.pop(name, ((), ()))
+        if rects:
+            gone = {id(rect) for rect in rects}
+            self.walls[:] = [wall for wall in self.walls if id(wall) not in gone]
+            self.grid.remove(rects)
+        if tiles:
+            self.tile_grid.remove(tiles)
+
+    def query(self, rect):
+        return self.grid.query(rect)
 
     def draw(self, screen, camera_x, camera_y):
         # Draw collision rectangles for debugging
         for wall in self.walls:
-            pygame.draw.rect(screen, (0,0,0), pygame.Rect(wall[0] - camera_x, wall[1] - camera_y, self.tile_size, self.tile_size), 2)
+            pygame.draw.rect(screen, (0,0,0), pygame.Rect(wall[0] - camera_x, wall[1] - camera_y, wall[2], wall[3]), 2)
+
+def sweep(walls, rect, dx, dy, steps, first_hit=False):
+    # Moves `rect` by (dx, dy) per step the way entities do: x then y, each
+    # pushed back out of the walls it ends up in. Players resolve every wall
+    # they overlap in turn; enemies (first_hit) stop moving along the axis
+    # at the first one, so any later overlap is left as it is
+    rect = pygame.Rect(rect)
+    for _ in range(steps):
+        rect.x += dx
+        step = dx
+        for wall in walls.query(rect):
+            if rect.colliderect(wall):
+                if step > 0:
+                    rect.right = wall.left
+                elif step < 0:
+                    rect.left = wall.right
+                if first_hit:
+                    step = 0
+        rect.y += dy
+        step = dy
+        for wall in walls.query(rect):
+            if rect.colliderect(wall):
+                if step > 0:
+                    rect.bottom = wall.top
+                elif step < 0:
+                    rect.top = wall.bottom
+                if first_hit:
+                    step = 0
+    return rect.topleft
+
+def verify(layer, tile_size=TILE_SIZE, body=(54, 64), spacing=32, steps=40):
+    # Sweeps a body from every free spot on a grid near the walls, in eight
+    # directions at the game's speeds, with both resolution rules, against
+    # the per-tile walls and against the walls Collisions gives that rule.
+    # Returns the sweeps whose final positions differ. Starts too far away
+    # to reach a wall are skipped.
+    tiles = wall_rects(layer, tile_size)
+    unmerged = SpatialGrid(tile_size * 2)
+    unmerged.build(tiles)
+    collisions = Collisions([], tile_size, np.asarray(layer).shape[1], layer)
+    rules = (('player', collisions.grid, False), ('enemy', collisions.tile_grid, True))
+
+    height, width = np.asarray(layer).shape
+    sweeps = 0
+    mismatches = []
+    for y in range(0, height * tile_size - body[1], spacing):
+        for x in range(0, width * tile_size - body[0], spacing):
+            start = pygame.Rect(x, y, *body)
+            reach = start.inflate(6 * steps, 6 * steps)
+            if start.collidelist(unmerged.query(start)) != -1 or reach.collidelist(unmerged.query(reach)) == -1:
+                continue
+            for speed in (1, 2, 3):
+                for dx in (-speed, 0, speed):
+                    for dy in (-speed, 0, speed):
+                        if dx or dy:
+                            for rule, walls, first_hit in rules:
+                                sweeps += 1
+                                before = sweep(unmerged, start, dx, dy, steps, first_hit)
+                                after = sweep(walls, start, dx, dy, steps, first_hit)
+                                if before != after:
+                                    mismatches.append((rule, start.topleft, (dx, dy), before, after))
+    return sweeps, mismatches
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--verify']
+    map_path = args[0] if args else MAP_FILE
+    layer = build_cache(map_path)
+    tiles = wall_rects(layer)
+    print(f'Wrote {cache_path_for(map_path)}: {layer.shape[1]}x{layer.shape[0]} tiles, '
+          f'{len(tiles)} walls, {len(merge_walls(tiles))} after merging')
+    if '--verify' in sys.argv[1:]:
+        sweeps, mismatches = verify(layer)
+        for rule, start, step, before, after in mismatches[:10]:
+            print(f'  {rule} from {start} moving {step}: {before} per tile, {after} in game')
+        print(f'{sweeps} sweeps, {len(mismatches)} ending somewhere else than against per-tile walls')
+        if mismatches:
+            sys.exit(1)